@@ -3,6 +3,9 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+With API_VIEW_STACK=async the Spotify and LLM endpoints are served by native
+async views; run it with e.g. `gunicorn backend.asgi:application -k uvicorn.workers.UvicornWorker`.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.ServerTimingMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -84,6 +86,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
+# 'sync' serves every endpoint from DRF views; 'async' swaps the Spotify/LLM-bound
+# ones for native async views (run under ASGI, e.g. gunicorn -k uvicorn.workers.UvicornWorker)
+API_VIEW_STACK = os.getenv('API_VIEW_STACK', 'sync')
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -108,6 +114,60 @@ DATABASES = {
     }
 }
 
+# Connection reuse for the remote database, selected with DB_POOL_MODE:
+#   none       - new connection per request
+#   persistent - keep each worker's connection open for DB_CONN_MAX_AGE seconds, health checked
+#   pool       - psycopg 3 connection pool per process (DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE)
+#   pgbouncer  - behind a transaction-mode pooler (Supabase pooler on port 6543, pgbouncer)
+DB_POOL_MODE = os.getenv('DB_POOL_MODE', 'persistent')
+
+if DB_POOL_MODE == 'persistent':
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', '600'))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+elif DB_POOL_MODE == 'pool':
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+        }
+    }
+elif DB_POOL_MODE == 'pgbouncer':
+    # Transactions may land on different server connections: no server-side cursors
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', '600'))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core': {'handlers': ['console'], 'level': os.getenv('CORE_LOG_LEVEL', 'INFO')},
+    },
+}
+
+
+# Cache
+# Redis when REDIS_URL is set, so cached state is shared by every worker
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -155,7 +215,136 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
 SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
 SPOTIFY_REDIRECT_URI = os.getenv('SPOTIFY_REDIRECT_URI')
+SPOTIFY_API_BASE = os.getenv('SPOTIFY_API_BASE', 'https://api.spotify.com/v1/')
+
+# Fetch the user data endpoints in parallel over a shared keep-alive pool
+SPOTIFY_CONCURRENT_FETCH = os.getenv('SPOTIFY_CONCURRENT_FETCH', 'True') == 'True'
+SPOTIFY_POOL_SIZE = int(os.getenv('SPOTIFY_POOL_SIZE', '20'))
+SPOTIFY_REQUEST_TIMEOUT = float(os.getenv('SPOTIFY_REQUEST_TIMEOUT', '10'))
+SPOTIFY_TRACK_CACHE_MAX_ENTRIES = int(os.getenv('SPOTIFY_TRACK_CACHE_MAX_ENTRIES', '50000'))
+# Shared Spotify request budget: SPOTIFY_RATE_LIMIT requests per SPOTIFY_RATE_WINDOW
+# seconds across all workers; 0 disables it. The budget lives in the cache, so it is
+# only shared with REDIS_URL set; "manage.py check" warns (core.W001) without it
+SPOTIFY_RATE_LIMIT = int(os.getenv('SPOTIFY_RATE_LIMIT', '20'))
+SPOTIFY_RATE_WINDOW = float(os.getenv('SPOTIFY_RATE_WINDOW', '1'))
+SPOTIFY_RATE_MAX_WAIT = float(os.getenv('SPOTIFY_RATE_MAX_WAIT', '5'))
+SPOTIFY_RATE_LIMIT_CACHE_ALIAS = os.getenv('SPOTIFY_RATE_LIMIT_CACHE_ALIAS', 'default')
+# Tokens expiring within this many seconds are refreshed in the background
+SPOTIFY_TOKEN_REFRESH_MARGIN = int(os.getenv('SPOTIFY_TOKEN_REFRESH_MARGIN', '300'))
+
+# Stored listening history: recently played is synced incrementally with the `after`
+# cursor at most every LISTENING_HISTORY_SYNC_INTERVAL seconds and read back locally
+LISTENING_HISTORY_ENABLED = os.getenv('LISTENING_HISTORY_ENABLED', 'True') == 'True'
+LISTENING_HISTORY_SYNC_INTERVAL = int(os.getenv('LISTENING_HISTORY_SYNC_INTERVAL', '120'))
+LISTENING_HISTORY_SYNC_MAX_PAGES = int(os.getenv('LISTENING_HISTORY_SYNC_MAX_PAGES', '5'))
+# Plays included in analyses and playlist ranking (profile responses keep the last 50)
+LISTENING_HISTORY_ANALYSIS_LIMIT = int(os.getenv('LISTENING_HISTORY_ANALYSIS_LIMIT', '500'))
+
+# Shared track/artist/genre catalog, upserted from Spotify fetches and consulted before
+# Spotify for track lookups. Stored plays reference catalog tracks, so listening
+# history writes the tracks it stores even with this off; set LISTENING_HISTORY_ENABLED
+# to False as well to stop every catalog write
+CATALOG_ENABLED = os.getenv('CATALOG_ENABLED', 'True') == 'True'
+# Catalog rows this process remembers writing, so unchanged objects aren't rewritten
+CATALOG_SEEN_MAX_ENTRIES = int(os.getenv('CATALOG_SEEN_MAX_ENTRIES', '50000'))
+
+# Deep library fetch (opt-in): analyses sample saved tracks from a per-user columnar
+# store of the full saved library and the medium/long term top items. Missing or
+# stale stores (older than LIBRARY_SYNC_INTERVAL seconds) are refetched in the
+# background; the analysis uses whatever is stored meanwhile
+LIBRARY_DEEP_FETCH_ENABLED = os.getenv('LIBRARY_DEEP_FETCH_ENABLED', 'False') == 'True'
+LIBRARY_SYNC_INTERVAL = int(os.getenv('LIBRARY_SYNC_INTERVAL', '86400'))
+# Tracks kept per user; the newest saves win once a library is larger
+LIBRARY_MAX_TRACKS = int(os.getenv('LIBRARY_MAX_TRACKS', '20000'))
+# Page requests in flight at once during a deep fetch
+LIBRARY_FETCH_CONCURRENCY = int(os.getenv('LIBRARY_FETCH_CONCURRENCY', '4'))
+# Saved tracks sampled from the store into each analysis
+LIBRARY_SAMPLE_SIZE = int(os.getenv('LIBRARY_SAMPLE_SIZE', '100'))
+# Background syncs run at once per process, so deep fetches take a bounded share of
+# the Spotify request budget
+LIBRARY_SYNC_WORKERS = int(os.getenv('LIBRARY_SYNC_WORKERS', '1'))
+# How long a user's sync stays claimed; must outlast queueing plus the largest fetch
+LIBRARY_SYNC_LOCK_TIMEOUT = int(os.getenv('LIBRARY_SYNC_LOCK_TIMEOUT', '1800'))
+
+# Per-user Spotify snapshot cache: 'memory', 'django' or 'none'
+SPOTIFY_SNAPSHOT_CACHE_BACKEND = os.getenv('SPOTIFY_SNAPSHOT_CACHE_BACKEND', 'memory')
+SPOTIFY_SNAPSHOT_CACHE_ALIAS = os.getenv('SPOTIFY_SNAPSHOT_CACHE_ALIAS', 'default')
+SPOTIFY_SNAPSHOT_CACHE_MAX_ENTRIES = int(os.getenv('SPOTIFY_SNAPSHOT_CACHE_MAX_ENTRIES', '5000'))
+SPOTIFY_SNAPSHOT_RETENTION = int(os.getenv('SPOTIFY_SNAPSHOT_RETENTION', '86400'))
+# Seconds each endpoint is served from cache before revalidating
+SPOTIFY_SNAPSHOT_TTLS = {
+    'user': int(os.getenv('SPOTIFY_TTL_USER', '3600')),
+    'top_tracks': int(os.getenv('SPOTIFY_TTL_TOP_TRACKS', '3600')),
+    'top_artists': int(os.getenv('SPOTIFY_TTL_TOP_ARTISTS', '3600')),
+    'recently_played': int(os.getenv('SPOTIFY_TTL_RECENTLY_PLAYED', '120')),
+    'saved_tracks': int(os.getenv('SPOTIFY_TTL_SAVED_TRACKS', '600')),
+}
 
 # OpenRouter Configuration
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
\ No newline at end of file
+OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_CONNECT_TIMEOUT = float(os.getenv('OPENROUTER_CONNECT_TIMEOUT', '5'))
+OPENROUTER_READ_TIMEOUT = float(os.getenv('OPENROUTER_READ_TIMEOUT', '90'))
+OPENROUTER_MAX_RETRIES = int(os.getenv('OPENROUTER_MAX_RETRIES', '3'))
+OPENROUTER_BACKOFF_BASE = float(os.getenv('OPENROUTER_BACKOFF_BASE', '1'))
+OPENROUTER_BACKOFF_MAX = float(os.getenv('OPENROUTER_BACKOFF_MAX', '20'))
+OPENROUTER_POOL_SIZE = int(os.getenv('OPENROUTER_POOL_SIZE', '10'))
+# Model tiers in preference order; the first is the default model for every completion.
+# With more than one, a completion that is slow, fails or doesn't parse is hedged to the next
+OPENROUTER_MODEL_TIERS = [
+    model.strip() for model in os.getenv('OPENROUTER_MODEL_TIERS', 'deepseek/deepseek-chat:free').split(',')
+    if model.strip()
+]
+OPENROUTER_HEDGE_ENABLED = os.getenv('OPENROUTER_HEDGE_ENABLED', 'True') == 'True'
+# Hedge once a model exceeds this quantile of its recent latencies...
+OPENROUTER_HEDGE_QUANTILE = float(os.getenv('OPENROUTER_HEDGE_QUANTILE', '0.9'))
+# ...or this many seconds until it has OPENROUTER_HEDGE_MIN_SAMPLES completions recorded
+OPENROUTER_HEDGE_DELAY = float(os.getenv('OPENROUTER_HEDGE_DELAY', '15'))
+OPENROUTER_HEDGE_MIN_DELAY = float(os.getenv('OPENROUTER_HEDGE_MIN_DELAY', '1'))
+OPENROUTER_HEDGE_MIN_SAMPLES = int(os.getenv('OPENROUTER_HEDGE_MIN_SAMPLES', '20'))
+# Seconds a hedged completion may take across all its attempts; each attempt's read
+# timeout ends there, so losing requests stop holding hedge workers
+OPENROUTER_HEDGE_DEADLINE = float(os.getenv('OPENROUTER_HEDGE_DEADLINE', '90'))
+# Largest share of recent completions allowed to send a duplicate request
+OPENROUTER_HEDGE_BUDGET = float(os.getenv('OPENROUTER_HEDGE_BUDGET', '0.2'))
+# Models whose recent error + parse failure rate reaches this are tried last
+OPENROUTER_DEMOTE_FAILURE_RATE = float(os.getenv('OPENROUTER_DEMOTE_FAILURE_RATE', '0.5'))
+# Completions per model kept for the latency and failure statistics
+OPENROUTER_STATS_WINDOW = int(os.getenv('OPENROUTER_STATS_WINDOW', '200'))
+
+# Prompt encoding: compact interned JSON trimmed to an estimated token budget (0 = no limit)
+AI_PROMPT_COMPACT = os.getenv('AI_PROMPT_COMPACT', 'True') == 'True'
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv('AI_PROMPT_TOKEN_BUDGET', '4000'))
+
+
+# Analysis jobs
+# When enabled, POST /analyze/ queues a job and returns its id immediately
+ANALYSIS_JOBS_ENABLED = os.getenv('ANALYSIS_JOBS_ENABLED', 'False') == 'True'
+# In-process workers per server process; 0 leaves jobs to `manage.py run_analysis_workers`
+ANALYSIS_JOB_WORKERS = int(os.getenv('ANALYSIS_JOB_WORKERS', '2'))
+# Running jobs older than this are assumed abandoned and picked up again
+ANALYSIS_JOB_TIMEOUT = int(os.getenv('ANALYSIS_JOB_TIMEOUT', '300'))
+# Seconds an analysis is reused for unchanged listening data; 0 always calls the LLM
+ANALYSIS_REUSE_WINDOW = int(os.getenv('ANALYSIS_REUSE_WINDOW', '86400'))
+
+# Playlist generation: 'ranker' picks tracks locally, 'llm' asks the model for track ids
+PLAYLIST_TRACK_SOURCE = os.getenv('PLAYLIST_TRACK_SOURCE', 'ranker')
+PLAYLIST_TRACK_COUNT = int(os.getenv('PLAYLIST_TRACK_COUNT', '30'))
+# Cache of playlist naming/generation completions: 'memory', 'django' or 'none'
+PLAYLIST_COMPLETION_CACHE_BACKEND = os.getenv('PLAYLIST_COMPLETION_CACHE_BACKEND', 'memory')
+PLAYLIST_COMPLETION_CACHE_ALIAS = os.getenv('PLAYLIST_COMPLETION_CACHE_ALIAS', 'default')
+PLAYLIST_COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv('PLAYLIST_COMPLETION_CACHE_MAX_ENTRIES', '2000'))
+PLAYLIST_COMPLETION_CACHE_TTL = int(os.getenv('PLAYLIST_COMPLETION_CACHE_TTL', '86400'))
+
+
+# Instrumentation
+# Per-stage timings in a Server-Timing response header
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'True') == 'True'
+# Prometheus text metrics at /metrics, served only to "Authorization: Bearer <METRICS_TOKEN>";
+# the endpoint stays off while METRICS_TOKEN is unset
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Responses
+# gzip response bodies for clients that send Accept-Encoding: gzip
+RESPONSE_COMPRESSION_ENABLED = os.getenv('RESPONSE_COMPRESSION_ENABLED', 'True') == 'True'
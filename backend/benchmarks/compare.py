@@ -0,0 +1,48 @@
+# Diff two benchmark result files:
+#
+#   python -m benchmarks.compare baseline.json candidate.json
+
+import argparse
+import json
+
+
+def load_runs(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report, {(run['endpoint'], run['concurrency']): run for run in report['runs']}
+
+
+def change(before, after):
+    if not before:
+        return '    n/a'
+    return f"{(after - before) / before * 100:+6.1f}%"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args(argv)
+
+    base_report, base = load_runs(args.baseline)
+    cand_report, cand = load_runs(args.candidate)
+    print(f"baseline:  {base_report.get('label') or args.baseline} ({base_report.get('git_revision')})")
+    print(f"candidate: {cand_report.get('label') or args.candidate} ({cand_report.get('git_revision')})")
+
+    for key in sorted(base.keys() & cand.keys()):
+        before, after = base[key], cand[key]
+        print(
+            f"{key[0]:>18} c={key[1]:<4} "
+            f"p50 {before['latency_ms']['p50']:8.1f} -> {after['latency_ms']['p50']:8.1f}ms "
+            f"({change(before['latency_ms']['p50'], after['latency_ms']['p50'])})  "
+            f"p95 {change(before['latency_ms']['p95'], after['latency_ms']['p95'])}  "
+            f"rps {change(before['throughput_rps'], after['throughput_rps'])}  "
+            f"queries {before['db_queries']['mean']:.1f} -> {after['db_queries']['mean']:.1f}"
+        )
+
+    for key in sorted(base.keys() ^ cand.keys()):
+        print(f"{key[0]:>18} c={key[1]:<4} only in {'baseline' if key in base else 'candidate'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+GENRES = [
+    'indie pop', 'bedroom pop', 'lo-fi beats', 'ambient', 'hip hop', 'trap', 'edm', 'house',
+    'classical', 'jazz', 'soul', 'r&b', 'metal', 'punk', 'folk', 'k-pop', 'latin', 'disco',
+]
+
+# music_analytics for seeded history rows; live analyses compute their own
+SEED_ANALYTICS = {
+    "top_genres": ["indie pop", "ambient", "hip hop", "jazz", "edm"],
+    "mood_distribution": {"happy": 30, "melancholic": 20, "energetic": 25, "calm": 20, "angsty": 5},
+    "audio_features": {
+        "energy_level": "medium",
+        "danceability": 6,
+        "acousticness": 4,
+        "instrumentalness": 3,
+        "complexity": 7
+    }
+}
+
+ANALYSIS_COMPLETION = {
+    "personality_type": "The Explorer",
+    "description": "Restless ears that keep wandering between scenes.",
+    "insights": [
+        "Curious and open to new experiences",
+        "Uses music to regulate focus",
+        "Values authenticity over polish"
+    ],
+    "recommendations": {
+        "similar_artists": ["Artist 3", "Artist 7"],
+        "growth_opportunities": ["Explore modern classical"]
+    }
+}
+
+PLAYLIST_NAME_COMPLETION = {
+    "name": "Benchmark Mix",
+    "description": "A playlist assembled for load testing."
+}
+
+
+class FakeServer:
+    # Threaded local HTTP server with configurable latency and error injection.
+    # Every request is counted per path so runs can report outbound call volume.
+    def __init__(self, latency_ms=50.0, jitter_ms=10.0, error_rate=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.server = None
+
+    def delay(self, latency_ms=None):
+        with self.lock:
+            base_ms = self.latency_ms if latency_ms is None else latency_ms
+            delay_ms = max(base_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms), 0.0)
+            fail = self.random.random() < self.error_rate
+        time.sleep(delay_ms / 1000.0)
+        return fail
+
+    def count(self, path):
+        with self.lock:
+            self.requests[path] += 1
+
+    def request_counts(self):
+        with self.lock:
+            return dict(self.requests)
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests.clear()
+
+    def handler_class(self):
+        raise NotImplementedError
+
+    def start(self, host='127.0.0.1', port=0):
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(body or b'{}')
+        except json.JSONDecodeError:
+            return {}
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self):
+        if self.fake.random.random() < 0.5:
+            self.send_json({'error': {'status': 429, 'message': 'rate limited'}}, status=429, headers={'Retry-After': '1'})
+        else:
+            self.send_json({'error': {'status': 500, 'message': 'injected failure'}}, status=500)
+
+
+class FakeSpotify(FakeServer):
+    # Serves the Web API endpoints SpotifyService uses, with `items` entries per list.
+    # Paged requests (offset=) see a saved library of `library_items` tracks
+    def __init__(self, items=50, library_items=None, **kwargs):
+        super().__init__(**kwargs)
+        self.items = items
+        self.library_items = library_items or items
+        self.payloads = self._build_payloads(items)
+        self.etags = {path: f'"{hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]}"'
+                      for path, payload in self.payloads.items()}
+        self.known_tracks = {track['id'] for track in self.payloads['/me/top/tracks']['items']}
+        self.known_tracks.update(item['track']['id'] for item in self.payloads['/me/tracks']['items'])
+        self.known_tracks.update(item['track']['id'] for item in self.payloads['/me/player/recently-played']['items'])
+        self.started_at = datetime.now(timezone.utc)
+
+    def page(self, path, offset, limit):
+        if path == '/me/tracks':
+            end = min(offset + limit, self.library_items)
+            items = [{
+                'track': self._track(i + 2000),
+                'added_at': (self.started_at - timedelta(hours=i)).isoformat().replace('+00:00', 'Z'),
+            } for i in range(offset, end)]
+            return {'items': items, 'total': self.library_items, 'offset': offset, 'limit': limit}
+        items = self.payloads[path]['items']
+        return {'items': items[offset:offset + limit], 'total': len(items), 'offset': offset, 'limit': limit}
+
+    @staticmethod
+    def _track(i):
+        return {
+            'id': f'{i:022d}',
+            'name': f'Track {i}',
+            'uri': f'spotify:track:{i:022d}',
+            'popularity': (i * 37) % 100,
+            'duration_ms': 150000 + (i * 7919) % 180000,
+            'explicit': i % 5 == 0,
+            'artists': [{'id': f'artist{i % 40:016d}', 'name': f'Artist {i % 40}'}],
+            'album': {
+                'id': f'album{i % 60:017d}',
+                'name': f'Album {i % 60}',
+                'release_date': f'{1975 + i % 50}-06-01',
+                'images': [{'url': f'https://example.com/{i}/{size}.jpg', 'height': size, 'width': size}
+                           for size in (640, 300, 64)],
+            },
+            'available_markets': ['US', 'GB', 'DE', 'FR', 'SE', 'JP', 'BR'],
+            'external_urls': {'spotify': f'https://open.spotify.com/track/{i:022d}'},
+        }
+
+    def _build_payloads(self, items):
+        now = datetime.now(timezone.utc)
+        artists = [{
+            'id': f'artist{i:016d}',
+            'name': f'Artist {i}',
+            'genres': [GENRES[(i + k) % len(GENRES)] for k in range(1 + i % 3)],
+            'popularity': (i * 53) % 100,
+            'followers': {'total': i * 1000},
+            'images': [{'url': f'https://example.com/a{i}.jpg', 'height': 640, 'width': 640}],
+        } for i in range(items)]
+
+        return {
+            '/me': {
+                'id': 'bench-user', 'display_name': 'Benchmark User', 'country': 'US',
+                'email': 'bench@example.com', 'followers': {'total': 12}, 'images': [],
+            },
+            '/me/top/tracks': {'items': [self._track(i) for i in range(items)], 'total': items},
+            '/me/top/artists': {'items': artists, 'total': items},
+            '/me/player/recently-played': {'items': [{
+                'track': self._track(i * 3 % (items * 2) + 1000),
+                'played_at': (now - timedelta(minutes=7 * i)).isoformat().replace('+00:00', 'Z'),
+            } for i in range(items)], 'cursors': {'after': str(int(now.timestamp() * 1000))}},
+            '/me/tracks': {'items': [{
+                'track': self._track(i + 2000),
+                'added_at': (now - timedelta(days=3 * i)).isoformat().replace('+00:00', 'Z'),
+            } for i in range(items)], 'total': items},
+        }
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(_JSONHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                path = re.sub(r'^/v1', '', url.path).rstrip('/')
+                fake.count(f'GET {path}')
+                if fake.delay():
+                    return self.send_error_json()
+
+                if path == '/tracks':
+                    ids = parse_qs(url.query).get('ids', [''])[0].split(',')
+                    tracks = [fake._track(int(i)) if i in fake.known_tracks else None for i in ids]
+                    return self.send_json({'tracks': tracks})
+
+                after = parse_qs(url.query).get('after')
+                if path == '/me/player/recently-played' and after:
+                    # Only plays newer than the cursor, like the real endpoint
+                    after_ms = int(after[0])
+                    items = [item for item in fake.payloads[path]['items']
+                             if datetime.fromisoformat(item['played_at'].replace('Z', '+00:00')).timestamp() * 1000 > after_ms]
+                    return self.send_json({'items': items, 'cursors': fake.payloads[path]['cursors'], 'next': None})
+
+                query = parse_qs(url.query)
+                if 'offset' in query and path in fake.payloads and path != '/me':
+                    return self.send_json(fake.page(path, int(query['offset'][0]), int(query.get('limit', ['20'])[0])))
+
+                payload = fake.payloads.get(path)
+                if payload is None:
+                    return self.send_json({'error': {'status': 404, 'message': 'not found'}}, status=404)
+
+                etag = fake.etags[path]
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                return self.send_json(payload, headers={'ETag': etag})
+
+            def do_POST(self):
+                path = re.sub(r'^/v1', '', urlparse(self.path).path).rstrip('/')
+                fake.count('POST ' + re.sub(r'/[^/]+/(playlists|tracks|items)$', r'/{id}/\1', path))
+                body = self.read_json()
+                if fake.delay():
+                    return self.send_error_json()
+
+                if path.endswith('/playlists'):
+                    return self.send_json({
+                        'id': f'playlist{random.randint(0, 10 ** 12):014d}',
+                        'name': body.get('name'),
+                        'description': body.get('description'),
+                    }, status=201)
+                if path.endswith(('/tracks', '/items')):
+                    return self.send_json({'snapshot_id': 'bench'}, status=201)
+                return self.send_json({'error': {'status': 404, 'message': 'not found'}}, status=404)
+
+        return Handler
+
+
+class FakeOpenRouter(FakeServer):
+    # OpenAI-compatible chat completions endpoint with optional SSE streaming.
+    # model_latency_ms overrides the latency per requested model
+    def __init__(self, model_latency_ms=None, **kwargs):
+        super().__init__(**kwargs)
+        self.model_latency_ms = model_latency_ms or {}
+        # System prompts already seen: a crude stand-in for provider prefix caching
+        self.cached_prefixes = set()
+
+    def cached_tokens(self, messages):
+        system = messages[0].get('content', '') if messages and messages[0].get('role') == 'system' else ''
+        key = hashlib.sha1(system.encode('utf-8')).hexdigest()
+        with self.lock:
+            hit = key in self.cached_prefixes
+            self.cached_prefixes.add(key)
+        return len(system) // 4 if hit else 0
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(_JSONHandler):
+            def do_POST(self):
+                body = self.read_json()
+                fake.count(f"POST /chat/completions {body.get('model')}")
+                if fake.delay(fake.model_latency_ms.get(body.get('model'))):
+                    return self.send_error_json()
+
+                system = ' '.join(m.get('content', '') for m in body.get('messages', []) if m.get('role') == 'system')
+                completion = PLAYLIST_NAME_COMPLETION if 'playlist' in system.lower() else ANALYSIS_COMPLETION
+                content = json.dumps(completion)
+                prompt_tokens = sum(len(m.get('content', '')) for m in body.get('messages', [])) // 4
+                usage = {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': len(content) // 4,
+                    'total_tokens': prompt_tokens + len(content) // 4,
+                    'prompt_tokens_details': {'cached_tokens': fake.cached_tokens(body.get('messages', []))},
+                }
+
+                if not body.get('stream'):
+                    return self.send_json({
+                        'id': 'bench',
+                        'model': body.get('model'),
+                        'choices': [{'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                        'usage': usage,
+                    })
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for start in range(0, len(content), 16):
+                    event = {'choices': [{'delta': {'content': content[start:start + 16]}}]}
+                    self.wfile.write(f'data: {json.dumps(event)}\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+                if (body.get('stream_options') or {}).get('include_usage'):
+                    event = {'model': body.get('model'), 'choices': [], 'usage': usage}
+                    self.wfile.write(f'data: {json.dumps(event)}\n\n'.encode('utf-8'))
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.close_connection = True
+
+        return Handler
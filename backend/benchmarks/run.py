@@ -0,0 +1,295 @@
+# Endpoint benchmark harness.
+#
+#   cd backend
+#   python -m benchmarks.run --concurrency 1,8,32 --requests 200 \
+#       --spotify-latency-ms 80 --llm-latency-ms 1500 --output bench.json
+#
+# Starts local stand-ins for Spotify and OpenRouter, seeds a SQLite database,
+# drives the API through Django's test client at each concurrency level and
+# writes latency percentiles, throughput, DB query counts and outbound call
+# counts as JSON. Use --set KEY=VALUE to flip environment-driven settings
+# (for example --set API_VIEW_STACK=async or --set SPOTIFY_SNAPSHOT_CACHE_BACKEND=none)
+# and benchmarks.compare to diff two result files.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.fakes import FakeOpenRouter, FakeSpotify
+
+# The profile fields the frontend dashboard requests
+DASHBOARD_PROFILE_FIELDS = ('display_name', 'email', 'followers', 'images', 'top_tracks', 'top_artists', 'recently_played')
+
+ENDPOINTS = {
+    'analyze': ('post', '/api/analyze/', lambda user_id: {'user_id': user_id}),
+    'analyze-force': ('post', '/api/analyze/', lambda user_id: {'user_id': user_id, 'force': True}),
+    'generate-playlist': ('post', '/api/generate-playlist/', lambda user_id: {'user_id': user_id, 'mood': 'chill'}),
+    'profile': ('get', '/api/users/{user_id}/profile/', None),
+    'profile-dashboard': ('get', '/api/users/{user_id}/profile/?fields=' + ','.join(DASHBOARD_PROFILE_FIELDS), None),
+    'analyses': ('get', '/api/users/{user_id}/analyses/', None),
+    'analyses-summary': ('get', '/api/users/{user_id}/analyses/?view=summary&page_size=20', None),
+    'playlists': ('get', '/api/users/{user_id}/playlists/', None),
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Maestro API endpoints against local fakes')
+    parser.add_argument('--endpoints', default='profile,analyze,generate-playlist,analyses,analyses-summary,playlists',
+                        help=f"Comma-separated subset of: {', '.join(ENDPOINTS)}")
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per endpoint and concurrency level')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed requests before each measurement')
+    parser.add_argument('--users', type=int, default=20, help='Seeded user profiles requests rotate over')
+    parser.add_argument('--history', type=int, default=200, help='Seeded analyses and playlists per user')
+    parser.add_argument('--payload-items', type=int, default=50, help='Items in each fake Spotify list')
+    parser.add_argument('--library-items', type=int, default=None,
+                        help='Saved tracks seen by paged (deep fetch) requests; defaults to --payload-items')
+    parser.add_argument('--spotify-latency-ms', type=float, default=80.0)
+    parser.add_argument('--llm-latency-ms', type=float, default=1500.0)
+    parser.add_argument('--llm-model-latency-ms', action='append', default=[], metavar='MODEL=MS',
+                        help='Per-model fake LLM latency, e.g. for OPENROUTER_MODEL_TIERS hedging runs')
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of fake upstream calls that fail')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='Environment override applied before Django settings load')
+    parser.add_argument('--label', default='', help='Free-form label stored with the results')
+    parser.add_argument('--output', default='bench_results.json')
+    return parser.parse_args(argv)
+
+
+def setup_django(args, spotify, openrouter):
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    os.environ['BENCH_SPOTIFY_URL'] = spotify.url
+    os.environ['BENCH_OPENROUTER_URL'] = openrouter.url
+    for item in args.set:
+        key, _, value = item.partition('=')
+        os.environ[key] = value
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.conf import settings
+
+    if os.path.exists(settings.DATABASES['default']['NAME']):
+        os.remove(settings.DATABASES['default']['NAME'])
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def seed(args):
+    from django.contrib.auth.models import User
+    from core.models import GeneratedPlaylist, UserAnalysis, UserProfile
+    from benchmarks.fakes import ANALYSIS_COMPLETION, SEED_ANALYTICS
+
+    expires = datetime.now(timezone.utc) + timedelta(days=1)
+    profiles = []
+    for i in range(args.users):
+        user = User.objects.create(username=f'bench-{i}')
+        profiles.append(UserProfile.objects.create(
+            user=user,
+            spotify_id=f'bench-{i}',
+            access_token=f'token-{i}',
+            refresh_token=f'refresh-{i}',
+            token_expires=expires,
+        ))
+
+    for profile in profiles:
+        UserAnalysis.objects.bulk_create([UserAnalysis(
+            user=profile,
+            personality_type=ANALYSIS_COMPLETION['personality_type'],
+            description=ANALYSIS_COMPLETION['description'],
+            music_analytics=SEED_ANALYTICS,
+            insights=ANALYSIS_COMPLETION['insights'],
+            recommendations=ANALYSIS_COMPLETION['recommendations'],
+        ) for _ in range(args.history)])
+        GeneratedPlaylist.objects.bulk_create([GeneratedPlaylist(
+            user=profile,
+            playlist_id=f'playlist-{n}',
+            name=f'Playlist {n}',
+            description='Seeded history',
+            mood='chill',
+        ) for n in range(args.history)])
+
+    return [profile.id for profile in profiles]
+
+
+class QueryCounter:
+    # Counts queries per thread through a connection execute wrapper
+    def __init__(self):
+        self.local = threading.local()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+        return execute(sql, params, many, context)
+
+    def reset(self):
+        self.local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self.local, 'count', 0)
+
+
+def run_level(endpoint, concurrency, args, user_ids):
+    from django.db import connection
+    from django.test import Client
+
+    method, path, body = ENDPOINTS[endpoint]
+    counter = QueryCounter()
+    local = threading.local()
+
+    def one(n):
+        client = getattr(local, 'client', None)
+        if client is None:
+            # Accepts gzip like a browser, so response_bytes is the size on the wire
+            client = local.client = Client(HTTP_ACCEPT_ENCODING='gzip')
+        user_id = user_ids[n % len(user_ids)]
+        url = path.format(user_id=user_id)
+
+        with connection.execute_wrapper(counter):
+            counter.reset()
+            started = time.perf_counter()
+            if method == 'post':
+                response = client.post(url, data=json.dumps(body(user_id)), content_type='application/json')
+            else:
+                response = client.get(url)
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+            else:
+                response.content
+            elapsed = time.perf_counter() - started
+            queries = counter.count
+
+        connection.close()
+        return elapsed, response.status_code, queries, len(getattr(response, 'content', b'') or b'')
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(args.warmup)))
+
+        started = time.perf_counter()
+        results = list(executor.map(one, range(args.requests)))
+        wall = time.perf_counter() - started
+
+    latencies = sorted(r[0] for r in results)
+    statuses = {}
+    for _, code, _, _ in results:
+        statuses[str(code)] = statuses.get(str(code), 0) + 1
+    queries = [r[2] for r in results]
+    sizes = [r[3] for r in results]
+
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': len(results),
+        'wall_seconds': wall,
+        'throughput_rps': len(results) / wall if wall else None,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'mean': sum(latencies) / len(latencies) * 1000,
+            'max': latencies[-1] * 1000,
+        },
+        'status_codes': statuses,
+        'errors': sum(count for code, count in statuses.items() if not code.startswith('2')),
+        'db_queries': {'mean': sum(queries) / len(queries), 'max': max(queries)},
+        'response_bytes': {'mean': sum(sizes) / len(sizes), 'max': max(sizes)},
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if unknown:
+        sys.exit(f"Unknown endpoints: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    spotify = FakeSpotify(
+        items=args.payload_items, library_items=args.library_items, latency_ms=args.spotify_latency_ms,
+        jitter_ms=args.jitter_ms, error_rate=args.error_rate, seed=args.seed
+    ).start()
+    model_latency_ms = {
+        model: float(ms) for model, _, ms in (item.rpartition('=') for item in args.llm_model_latency_ms)
+    }
+    openrouter = FakeOpenRouter(
+        model_latency_ms=model_latency_ms, latency_ms=args.llm_latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, seed=args.seed + 1
+    ).start()
+
+    try:
+        setup_django(args, spotify, openrouter)
+        user_ids = seed(args)
+
+        from django.conf import settings
+
+        runs = []
+        for endpoint in endpoints:
+            for concurrency in levels:
+                spotify.reset_counts()
+                openrouter.reset_counts()
+                # Keep the services' print() chatter out of the report
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = run_level(endpoint, concurrency, args, user_ids)
+                result['upstream_calls'] = {
+                    'spotify': spotify.request_counts(),
+                    'openrouter': openrouter.request_counts(),
+                }
+                runs.append(result)
+                latency = result['latency_ms']
+                print(
+                    f"{endpoint:>18} c={concurrency:<4} "
+                    f"p50={latency['p50']:8.1f}ms p95={latency['p95']:8.1f}ms p99={latency['p99']:8.1f}ms "
+                    f"{result['throughput_rps']:7.1f} req/s  queries={result['db_queries']['mean']:.1f}  "
+                    f"errors={result['errors']}"
+                )
+
+        report = {
+            'label': args.label,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'config': {key: value for key, value in vars(args).items() if key != 'output'},
+            'settings': {
+                'API_VIEW_STACK': settings.API_VIEW_STACK,
+                'SPOTIFY_CONCURRENT_FETCH': settings.SPOTIFY_CONCURRENT_FETCH,
+                'SPOTIFY_SNAPSHOT_CACHE_BACKEND': settings.SPOTIFY_SNAPSHOT_CACHE_BACKEND,
+                'PLAYLIST_TRACK_SOURCE': settings.PLAYLIST_TRACK_SOURCE,
+                'ANALYSIS_REUSE_WINDOW': settings.ANALYSIS_REUSE_WINDOW,
+            },
+            'runs': runs,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    finally:
+        spotify.stop()
+        openrouter.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+from backend.settings import *  # noqa: F401,F403
+
+# Self-contained settings for the benchmark harness: a local SQLite file and the
+# fake Spotify/OpenRouter servers started by benchmarks.run
+
+SECRET_KEY = 'benchmark-only'
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+CORS_ALLOWED_ORIGINS = ['http://localhost']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('BENCH_DB_PATH', os.path.join(tempfile.gettempdir(), 'maestro_bench.sqlite3')),
+        'OPTIONS': {'timeout': 30},
+    }
+}
+
+SPOTIFY_API_BASE = os.getenv('BENCH_SPOTIFY_URL', 'http://127.0.0.1:8801') + '/v1/'
+OPENROUTER_API_URL = os.getenv('BENCH_OPENROUTER_URL', 'http://127.0.0.1:8802') + '/chat/completions'
+OPENROUTER_API_KEY = 'benchmark'
+
+# The harness drives the app from a single process, so the in-memory cache holds the
+# whole Spotify request budget
+SILENCED_SYSTEM_CHECKS = ['core.W001']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'loggers': {
+        'django.request': {'level': 'CRITICAL'},
+        'core': {'level': 'WARNING'},
+    },
+}
@@ -0,0 +1,257 @@
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+
+from .library import SOURCE_SAVED
+
+# Deterministic music analytics computed from the top artists and tracks we already
+# fetch. Genre-derived scores use a keyword lexicon: each genre takes the mean trait
+# vector of the keywords it contains, so "indie folk" blends indie and folk.
+TRAITS = (
+    'happy', 'melancholic', 'energetic', 'calm', 'angsty',
+    'danceability', 'acousticness', 'instrumentalness', 'complexity', 'energy',
+)
+MOODS = TRAITS[:5]
+AUDIO_FEATURES = ('danceability', 'acousticness', 'instrumentalness', 'complexity')
+# Fields read off the lexicon rather than counted from the data; they are listed under
+# 'estimated' in the analytics so the prompt and the client can tell them apart
+ESTIMATED_FIELDS = ['mood_distribution', 'audio_features']
+
+#                   happy mel  ener calm angst dance acou inst cmplx energy
+GENRE_TRAITS = {
+    'pop':          (0.8, 0.2, 0.6, 0.3, 0.1, 0.7, 0.2, 0.1, 0.3, 0.6),
+    'dance':        (0.8, 0.1, 0.9, 0.1, 0.1, 0.9, 0.0, 0.3, 0.3, 0.9),
+    'edm':          (0.7, 0.1, 1.0, 0.0, 0.2, 0.9, 0.0, 0.5, 0.4, 1.0),
+    'house':        (0.7, 0.1, 0.8, 0.2, 0.1, 0.9, 0.0, 0.6, 0.4, 0.8),
+    'techno':       (0.4, 0.2, 0.9, 0.1, 0.3, 0.8, 0.0, 0.8, 0.5, 0.9),
+    'trance':       (0.6, 0.3, 0.9, 0.1, 0.1, 0.8, 0.0, 0.7, 0.4, 0.9),
+    'drum and bass': (0.5, 0.2, 1.0, 0.0, 0.4, 0.7, 0.0, 0.6, 0.6, 1.0),
+    'dubstep':      (0.3, 0.2, 1.0, 0.0, 0.7, 0.6, 0.0, 0.5, 0.5, 1.0),
+    'hip hop':      (0.5, 0.3, 0.7, 0.2, 0.5, 0.8, 0.1, 0.1, 0.5, 0.7),
+    'rap':          (0.4, 0.3, 0.7, 0.1, 0.6, 0.8, 0.1, 0.0, 0.6, 0.7),
+    'trap':         (0.3, 0.3, 0.8, 0.1, 0.7, 0.8, 0.0, 0.1, 0.4, 0.8),
+    'drill':        (0.1, 0.3, 0.8, 0.0, 0.9, 0.7, 0.0, 0.1, 0.4, 0.8),
+    'r&b':          (0.5, 0.5, 0.4, 0.6, 0.1, 0.7, 0.3, 0.1, 0.5, 0.4),
+    'soul':         (0.5, 0.6, 0.4, 0.6, 0.1, 0.6, 0.5, 0.1, 0.6, 0.4),
+    'funk':         (0.9, 0.1, 0.8, 0.2, 0.1, 0.9, 0.3, 0.3, 0.6, 0.8),
+    'disco':        (0.9, 0.1, 0.8, 0.1, 0.0, 1.0, 0.1, 0.3, 0.4, 0.8),
+    'jazz':         (0.5, 0.4, 0.4, 0.7, 0.1, 0.5, 0.7, 0.6, 0.9, 0.4),
+    'blues':        (0.3, 0.8, 0.4, 0.5, 0.3, 0.4, 0.7, 0.3, 0.6, 0.4),
+    'classical':    (0.4, 0.5, 0.3, 0.8, 0.1, 0.1, 0.9, 1.0, 1.0, 0.3),
+    'orchestra':    (0.4, 0.5, 0.5, 0.6, 0.1, 0.1, 0.9, 1.0, 0.9, 0.5),
+    'piano':        (0.3, 0.6, 0.2, 0.9, 0.0, 0.1, 0.9, 0.9, 0.7, 0.2),
+    'ambient':      (0.3, 0.5, 0.1, 1.0, 0.0, 0.1, 0.5, 0.9, 0.6, 0.1),
+    'lo-fi':        (0.4, 0.5, 0.2, 0.9, 0.0, 0.5, 0.4, 0.8, 0.4, 0.2),
+    'chill':        (0.5, 0.4, 0.2, 0.9, 0.0, 0.5, 0.4, 0.5, 0.4, 0.2),
+    'acoustic':     (0.5, 0.5, 0.2, 0.8, 0.0, 0.3, 1.0, 0.2, 0.4, 0.2),
+    'folk':         (0.5, 0.6, 0.3, 0.7, 0.1, 0.3, 0.9, 0.2, 0.5, 0.3),
+    'singer-songwriter': (0.4, 0.7, 0.2, 0.7, 0.1, 0.3, 0.8, 0.1, 0.5, 0.2),
+    'country':      (0.6, 0.5, 0.5, 0.5, 0.1, 0.5, 0.7, 0.1, 0.4, 0.5),
+    'indie':        (0.5, 0.5, 0.5, 0.5, 0.3, 0.5, 0.4, 0.2, 0.6, 0.5),
+    'rock':         (0.5, 0.3, 0.8, 0.2, 0.5, 0.4, 0.3, 0.2, 0.6, 0.8),
+    'punk':         (0.4, 0.2, 0.9, 0.0, 0.9, 0.5, 0.2, 0.1, 0.4, 0.9),
+    'metal':        (0.2, 0.3, 1.0, 0.0, 1.0, 0.3, 0.1, 0.3, 0.8, 1.0),
+    'hardcore':     (0.1, 0.3, 1.0, 0.0, 1.0, 0.3, 0.1, 0.1, 0.6, 1.0),
+    'emo':          (0.1, 0.9, 0.6, 0.1, 0.8, 0.3, 0.3, 0.1, 0.5, 0.6),
+    'grunge':       (0.2, 0.6, 0.8, 0.1, 0.8, 0.3, 0.2, 0.1, 0.5, 0.8),
+    'shoegaze':     (0.3, 0.7, 0.5, 0.5, 0.3, 0.2, 0.1, 0.4, 0.7, 0.5),
+    'post-rock':    (0.3, 0.6, 0.6, 0.5, 0.2, 0.1, 0.2, 0.9, 0.9, 0.6),
+    'progressive':  (0.4, 0.4, 0.6, 0.3, 0.3, 0.3, 0.3, 0.5, 1.0, 0.6),
+    'math':         (0.4, 0.3, 0.7, 0.2, 0.4, 0.3, 0.3, 0.5, 1.0, 0.7),
+    'k-pop':        (0.8, 0.2, 0.8, 0.2, 0.1, 0.9, 0.1, 0.1, 0.4, 0.8),
+    'latin':        (0.8, 0.2, 0.7, 0.2, 0.1, 0.9, 0.4, 0.1, 0.4, 0.7),
+    'reggaeton':    (0.8, 0.1, 0.8, 0.1, 0.2, 1.0, 0.1, 0.1, 0.3, 0.8),
+    'reggae':       (0.8, 0.2, 0.4, 0.7, 0.1, 0.8, 0.5, 0.1, 0.4, 0.4),
+    'bossa nova':   (0.6, 0.4, 0.2, 0.9, 0.0, 0.6, 0.9, 0.2, 0.7, 0.2),
+    'soundtrack':   (0.4, 0.5, 0.5, 0.6, 0.1, 0.1, 0.6, 0.9, 0.8, 0.5),
+    'gospel':       (0.8, 0.3, 0.6, 0.4, 0.0, 0.5, 0.6, 0.1, 0.6, 0.6),
+    'sad':          (0.0, 1.0, 0.2, 0.5, 0.3, 0.2, 0.6, 0.2, 0.4, 0.2),
+}
+NEUTRAL_TRAITS = np.full(len(TRAITS), 0.4)
+
+_KEYWORDS = list(GENRE_TRAITS)
+_KEYWORD_MATRIX = np.array([GENRE_TRAITS[keyword] for keyword in _KEYWORDS])
+
+TOP_GENRES = 5
+GENRE_DISTRIBUTION_SIZE = 10
+RECENT_RELEASE_YEARS = 5
+
+
+def genre_traits(genre):
+    hits = [i for i, keyword in enumerate(_KEYWORDS) if keyword in genre]
+    if not hits:
+        return NEUTRAL_TRAITS
+    return _KEYWORD_MATRIX[hits].mean(axis=0)
+
+
+def percentages(weights):
+    # Integer percentages summing to exactly 100 (largest remainder)
+    total = weights.sum()
+    if total <= 0:
+        return np.zeros(len(weights), dtype=int)
+    raw = weights / total * 100
+    result = np.floor(raw).astype(int)
+    shortfall = 100 - result.sum()
+    result[np.argsort(-(raw - result), kind='stable')[:shortfall]] += 1
+    return result
+
+
+def score_1_to_10(value):
+    return int(round(1 + 9 * float(np.clip(value, 0.0, 1.0))))
+
+
+def genre_weights(top_artists):
+    # Artists are weighted by rank, from 1.0 for the top artist down to 0.5
+    weights = defaultdict(float)
+    n = len(top_artists)
+    for rank, artist in enumerate(top_artists):
+        weight = 1.0 - 0.5 * rank / max(n - 1, 1)
+        for genre in artist.get('genres') or []:
+            weights[genre.lower()] += weight
+    return weights
+
+
+def genre_metrics(top_artists):
+    weights = genre_weights(top_artists)
+    if not weights:
+        return {'top_genres': [], 'genre_distribution': {}, 'genre_count': 0}, None
+
+    genres = sorted(weights, key=lambda genre: (-weights[genre], genre))
+    values = np.array([weights[genre] for genre in genres])
+    shares = values / values.sum()
+
+    head = genres[:GENRE_DISTRIBUTION_SIZE]
+    metrics = {
+        'top_genres': genres[:TOP_GENRES],
+        'genre_distribution': {genre: round(float(share) * 100, 1) for genre, share in zip(head, shares)},
+        'genre_count': len(genres),
+    }
+
+    # Weighted mean trait vector over every genre the user listens to
+    traits = np.array([genre_traits(genre) for genre in genres])
+    return metrics, shares @ traits
+
+
+def mood_and_features(profile):
+    if profile is None:
+        return {}
+
+    mood = dict(zip(MOODS, (int(value) for value in percentages(profile[:len(MOODS)]))))
+    features = dict(zip(TRAITS, profile))
+    energy = features['energy']
+    audio_features = {
+        'energy_level': 'high' if energy >= 0.65 else 'medium' if energy >= 0.4 else 'low',
+        **{name: score_1_to_10(features[name]) for name in AUDIO_FEATURES},
+    }
+    return {'mood_distribution': mood, 'audio_features': audio_features, 'estimated': ESTIMATED_FIELDS}
+
+
+def artist_diversity(top_tracks):
+    lead_artists = [
+        (track.get('artists') or [{}])[0].get('id') or (track.get('artists') or [{}])[0].get('name')
+        for track in top_tracks
+    ]
+    return diversity([artist for artist in lead_artists if artist])
+
+
+def diversity(lead_artists):
+    if not len(lead_artists):
+        return {}
+
+    _, counts = np.unique(lead_artists, return_counts=True)
+    shares = counts / counts.sum()
+    entropy = float(-(shares * np.log(shares)).sum())
+    max_entropy = np.log(len(lead_artists)) if len(lead_artists) > 1 else 1.0
+    return {
+        'unique_artists': int(len(counts)),
+        'top_artist_share': round(float(shares.max()) * 100, 1),
+        # 0 when every track is by one artist, 1 when no artist repeats
+        'diversity_index': round(entropy / max_entropy, 3),
+    }
+
+
+def popularity_spread(top_tracks, top_artists):
+    track_popularity = np.array([t['popularity'] for t in top_tracks if t.get('popularity') is not None], dtype=float)
+    artist_popularity = np.array([a['popularity'] for a in top_artists if a.get('popularity') is not None], dtype=float)
+    if not track_popularity.size and not artist_popularity.size:
+        return {}
+
+    values = track_popularity if track_popularity.size else artist_popularity
+    p25, median, p75 = np.percentile(values, [25, 50, 75])
+    return {
+        'mean': round(float(values.mean()), 1),
+        'std': round(float(values.std()), 1),
+        'p25': round(float(p25), 1),
+        'median': round(float(median), 1),
+        'p75': round(float(p75), 1),
+        # Share of tracks outside the mainstream (popularity below 40)
+        'niche_share': round(float((values < 40).mean()) * 100, 1),
+        'artist_mean': round(float(artist_popularity.mean()), 1) if artist_popularity.size else None,
+    }
+
+
+def catalog_recency(top_tracks, now=None):
+    years = []
+    for track in top_tracks:
+        release_date = ((track.get('album') or {}).get('release_date') or '')[:4]
+        if release_date.isdigit():
+            years.append(int(release_date))
+    return recency(np.array(years, dtype=int), now)
+
+
+def recency(years, now=None):
+    now = now or datetime.now(dt_timezone.utc)
+    if not years.size:
+        return {}
+
+    decades, counts = np.unique(years // 10 * 10, return_counts=True)
+    decade_shares = percentages(counts.astype(float))
+    return {
+        'median_release_year': int(np.median(years)),
+        'mean_age_years': round(float(now.year - years.mean()), 1),
+        'recent_share': round(float((years >= now.year - RECENT_RELEASE_YEARS).mean()) * 100, 1),
+        'decades': {f'{decade}s': int(share) for decade, share in zip(decades, decade_shares)},
+    }
+
+
+def library_metrics(library, now=None):
+    # The same measures over the whole deep-fetched library, straight from its columns
+    saved = library.rows(SOURCE_SAVED)
+    tracks = library.tracks
+    artist_ids = tracks['artist_id'][saved]
+    years = tracks['release_year'][saved].astype(int)
+    popularity = tracks['popularity'][saved].astype(float)
+    popularity = popularity[popularity >= 0]
+
+    long_range_genres, _ = genre_metrics(library.artist_items())
+    return {
+        'track_count': len(library),
+        'saved_tracks': int(len(saved)),
+        'artist_diversity': diversity(artist_ids[artist_ids >= 0]),
+        'popularity': {
+            'mean': round(float(popularity.mean()), 1),
+            'niche_share': round(float((popularity < 40).mean()) * 100, 1),
+        } if popularity.size else {},
+        'catalog_recency': recency(years[years > 0], now),
+        'long_term_genres': long_range_genres['top_genres'],
+    }
+
+
+def compute_music_analytics(data, now=None, library=None):
+    # Everything in music_analytics that can be derived from the fetched data,
+    # plus library-wide measures when a deep-fetched library is given
+    top_tracks = data.get('top_tracks', {}).get('items', [])
+    top_artists = data.get('top_artists', {}).get('items', [])
+
+    genres, profile = genre_metrics(top_artists)
+    analytics = {
+        **genres,
+        **mood_and_features(profile),
+        'artist_diversity': artist_diversity(top_tracks),
+        'popularity': popularity_spread(top_tracks, top_artists),
+        'catalog_recency': catalog_recency(top_tracks, now),
+    }
+    if library is not None and len(library):
+        analytics['library'] = library_metrics(library, now)
+    return analytics
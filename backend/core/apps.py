@@ -1,6 +1,60 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.core import checks
+
+logger = logging.getLogger(__name__)
+
+
+def describe_database_pooling():
+    database = settings.DATABASES['default']
+    pool = database.get('OPTIONS', {}).get('pool')
+    details = [
+        f"mode={getattr(settings, 'DB_POOL_MODE', 'none')}",
+        f"engine={database['ENGINE']}",
+        f"host={database.get('HOST') or 'local'}:{database.get('PORT') or '-'}",
+        f"conn_max_age={database.get('CONN_MAX_AGE', 0)}",
+        f"health_checks={database.get('CONN_HEALTH_CHECKS', False)}",
+    ]
+    if pool:
+        pool = pool if isinstance(pool, dict) else {}
+        details.append(
+            f"pool(min={pool.get('min_size', '-')}, max={pool.get('max_size', '-')}, timeout={pool.get('timeout', '-')})"
+        )
+    if database.get('DISABLE_SERVER_SIDE_CURSORS'):
+        details.append("server_side_cursors=off")
+    return ", ".join(details)
+
+
+# Cache backends whose state lives in one process, so every worker would get its own budget
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def check_rate_limit_cache(app_configs, **kwargs):
+    if settings.SPOTIFY_RATE_LIMIT <= 0:
+        return []
+    alias = settings.SPOTIFY_RATE_LIMIT_CACHE_ALIAS
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHE_BACKENDS:
+        return []
+    return [checks.Warning(
+        f"SPOTIFY_RATE_LIMIT={settings.SPOTIFY_RATE_LIMIT} is enforced per process: "
+        f"the '{alias}' cache ({backend}) is not shared between workers.",
+        hint="Set REDIS_URL (or point SPOTIFY_RATE_LIMIT_CACHE_ALIAS at a shared cache), "
+             "or set SPOTIFY_RATE_LIMIT=0 to turn the limiter off.",
+        id='core.W001',
+    )]
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Startup report of the connection reuse in effect for this process
+        logger.info("Database connections: %s", describe_database_pooling())
+        checks.register(check_rate_limit_cache, checks.Tags.caches)
@@ -0,0 +1,235 @@
+import asyncio
+import weakref
+from datetime import timedelta
+from urllib.parse import urljoin
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import snapshot_cache
+from .metrics import span
+from .models import UserAnalysis
+from .openrouter import openrouter_client
+from .services import (
+    PROFILE_HISTORY_LIMIT,
+    SPOTIFY_USER_DATA_ENDPOINTS,
+    AIService,
+    AnalysisService,
+    CatalogService,
+    ListeningHistoryService,
+    SpotifyService,
+    spotify_rate_limiter,
+)
+from .throttle import RateLimitExceeded
+from .utils import fingerprint_spotify_data, parse_and_normalize_ai_json
+
+SPOTIFY_RETRY_STATUSES = {500, 502, 503, 504}
+
+# httpx clients are bound to the event loop they were created on
+_spotify_clients = weakref.WeakKeyDictionary()
+
+
+def _spotify_client():
+    loop = asyncio.get_running_loop()
+    client = _spotify_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=settings.SPOTIFY_REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=settings.SPOTIFY_POOL_SIZE)
+        )
+        _spotify_clients[loop] = client
+    return client
+
+
+class AsyncSpotifyService:
+    @staticmethod
+    async def get_valid_access_token(user_profile):
+        # Refreshes are rare and coalesced behind a row lock, so they stay on the sync path
+        if user_profile.token_expires <= timezone.now() + timedelta(seconds=settings.SPOTIFY_TOKEN_REFRESH_MARGIN):
+            return await sync_to_async(SpotifyService.get_valid_access_token)(user_profile)
+        return user_profile.access_token
+
+    @staticmethod
+    async def api_request(access_token, path, params=None, etag=None):
+        headers = {'Authorization': f'Bearer {access_token}'}
+        if etag:
+            headers['If-None-Match'] = etag
+
+        client = _spotify_client()
+        url = urljoin(settings.SPOTIFY_API_BASE, path)
+        rate_limited = server_errors = 0
+        while True:
+            if spotify_rate_limiter is not None:
+                # The shared bucket may sleep; keep that off the event loop
+                await sync_to_async(spotify_rate_limiter, thread_sensitive=False)()
+
+            response = await client.get(url, params=params, headers=headers)
+
+            if response.status_code == 429 and spotify_rate_limiter is not None:
+                retry_after = spotify_rate_limiter.observe(response)
+                if rate_limited >= 2:
+                    raise RateLimitExceeded("Spotify rate limit exceeded", retry_after=retry_after)
+                rate_limited += 1
+                continue
+
+            if response.status_code in SPOTIFY_RETRY_STATUSES and server_errors < 3:
+                await asyncio.sleep(0.3 * 2 ** server_errors)
+                server_errors += 1
+                continue
+
+            response.raise_for_status()
+            return response
+
+    @staticmethod
+    async def fetch_endpoint(access_token, name, spotify_id=None):
+        path, params = SPOTIFY_USER_DATA_ENDPOINTS[name]
+        with span(f'spotify.{name}'):
+            if not spotify_id or snapshot_cache is None:
+                return (await AsyncSpotifyService.api_request(access_token, path, params)).json()
+
+            async def fetch(etag):
+                response = await AsyncSpotifyService.api_request(access_token, path, params, etag=etag)
+                if response.status_code == 304:
+                    return None, etag
+                return response.json(), response.headers.get('ETag')
+
+            return await snapshot_cache.aget_or_fetch(spotify_id, name, fetch)
+
+    @staticmethod
+    async def fetch_plays(access_token, after=None):
+        path, params = SPOTIFY_USER_DATA_ENDPOINTS['recently_played']
+        params = dict(params, after=after) if after else params
+        items = []
+        with span('spotify.recently_played'):
+            for _ in range(settings.LISTENING_HISTORY_SYNC_MAX_PAGES):
+                page = (await AsyncSpotifyService.api_request(access_token, path, params)).json()
+                page_items = page.get('items') or []
+                items.extend(page_items)
+                if not page_items or not page.get('next'):
+                    break
+                path, params = page['next'], None
+        return {'items': items}
+
+    @staticmethod
+    async def get_user_data(user_profile=None, access_token=None, history_limit=None, endpoints=None):
+        if not access_token:
+            if not user_profile:
+                raise ValueError("Must provide either user_profile or access_token")
+            access_token = await AsyncSpotifyService.get_valid_access_token(user_profile)
+
+        spotify_id = user_profile.spotify_id if user_profile else None
+
+        # Recently played comes from the stored history, topped up with plays after its cursor
+        use_history = (
+            settings.LISTENING_HISTORY_ENABLED and user_profile is not None
+            and (endpoints is None or 'recently_played' in endpoints)
+        )
+        if use_history:
+            due, after = await sync_to_async(ListeningHistoryService.sync_cursor)(user_profile)
+
+        fetches = {}
+        for name in SPOTIFY_USER_DATA_ENDPOINTS:
+            if endpoints is not None and name not in endpoints:
+                continue
+            if use_history and name == 'recently_played':
+                fetches[name] = (
+                    AsyncSpotifyService.fetch_plays(access_token, after) if due
+                    else asyncio.sleep(0, result={'items': []})
+                )
+            else:
+                fetches[name] = AsyncSpotifyService.fetch_endpoint(access_token, name, spotify_id)
+
+        with span('spotify.user_data'):
+            results = await asyncio.wait_for(
+                asyncio.gather(*fetches.values()),
+                timeout=settings.SPOTIFY_REQUEST_TIMEOUT * 3
+            )
+        data = dict(zip(fetches, results))
+
+        if settings.CATALOG_ENABLED:
+            await sync_to_async(CatalogService.upsert_user_data)(data)
+        if use_history:
+            await sync_to_async(ListeningHistoryService.store)(user_profile, data['recently_played'])
+            data['recently_played'] = await sync_to_async(ListeningHistoryService.recent_plays)(
+                user_profile, history_limit or PROFILE_HISTORY_LIMIT, access_token=access_token
+            )
+
+        missing = [name for name, value in data.items() if value is None]
+        if missing:
+            raise ValueError(f"Incomplete Spotify data, missing: {', '.join(missing)}")
+
+        return data
+
+
+class AsyncAIService:
+    @staticmethod
+    async def analyze_music_data(data, analytics=None):
+        payload = AIService.build_analysis_payload(data, analytics)
+        with span('ai.completion'):
+            completion = await openrouter_client.acomplete_hedged(payload, accept=parse_and_normalize_ai_json)
+        return completion['choices'][0]['message']['content']
+
+    @staticmethod
+    async def generate_playlist(data, mood=None, additional_prompt=""):
+        payload, cache_key = AIService.prepare_generate_playlist(data, mood, additional_prompt)
+        return await AsyncAIService.cached_completion(payload, cache_key)
+
+    @staticmethod
+    async def describe_playlist(tracks, mood=None, additional_prompt=""):
+        payload, cache_key = AIService.prepare_describe_playlist(tracks, mood, additional_prompt)
+        return await AsyncAIService.cached_completion(payload, cache_key)
+
+    @staticmethod
+    async def cached_completion(payload, cache_key):
+        content = AIService.cached_playlist_completion(cache_key)
+        if content is None:
+            with span('ai.completion'):
+                completion = await openrouter_client.acomplete_hedged(payload, accept=parse_and_normalize_ai_json)
+            content = completion['choices'][0]['message']['content']
+            AIService.cache_playlist_completion(cache_key, content)
+        return content
+
+
+class AsyncAnalysisService:
+    @staticmethod
+    async def find_reusable_analysis(user_profile, fingerprint):
+        if settings.ANALYSIS_REUSE_WINDOW <= 0:
+            return None
+
+        fresh_since = timezone.now() - timedelta(seconds=settings.ANALYSIS_REUSE_WINDOW)
+        with span('db.reuse_lookup'):
+            return await (
+                UserAnalysis.objects
+                .filter(user=user_profile, input_fingerprint=fingerprint, generated_at__gte=fresh_since)
+                .order_by('-generated_at')
+                .afirst()
+            )
+
+    @staticmethod
+    async def run_analysis(user_profile, force=False):
+        spotify_data = await AsyncSpotifyService.get_user_data(
+            user_profile=user_profile,
+            history_limit=settings.LISTENING_HISTORY_ANALYSIS_LIMIT
+        )
+
+        fingerprint = fingerprint_spotify_data(spotify_data)
+        if not force:
+            existing = await AsyncAnalysisService.find_reusable_analysis(user_profile, fingerprint)
+            if existing:
+                return existing
+
+        if settings.LIBRARY_DEEP_FETCH_ENABLED:
+            spotify_data, library = await sync_to_async(AnalysisService.load_library)(user_profile, spotify_data)
+        else:
+            library = None
+        analytics = AnalysisService.compute_analytics(spotify_data, library)
+        ai_response = await AsyncAIService.analyze_music_data(spotify_data, analytics)
+        with span('ai.parse'):
+            parsed_data = parse_and_normalize_ai_json(ai_response)
+
+        analysis = AnalysisService.build_analysis(user_profile, parsed_data, fingerprint, analytics)
+        with span('db.save'):
+            await analysis.asave()
+        return analysis
@@ -0,0 +1,238 @@
+import json
+import math
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .async_services import AsyncAIService, AsyncAnalysisService, AsyncSpotifyService
+from .jobs import enqueue_analysis
+from .metrics import span
+from .models import GeneratedPlaylist, UserProfile
+from .ranking import rank_candidate_tracks
+from .serializers import AnalysisJobSerializer, GeneratedPlaylistSerializer, UserAnalysisSerializer
+from .services import SpotifyService
+from .throttle import RateLimitExceeded
+from .utils import parse_and_normalize_ai_json, parse_flag
+from .views import conditional_profile_response, parse_profile_fields, profile_endpoints, profile_response_data
+
+# Async counterparts of the Spotify- and LLM-bound views in views.py, selected with
+# API_VIEW_STACK = 'async' and served through backend.asgi. Request and response
+# shapes match the sync views.
+
+
+def request_data(request):
+    # Accepts what DRF's default parsers do for the sync views: a JSON object, or a
+    # form or multipart body. Raises ValueError for anything else
+    if request.content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        return request.POST
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError as e:
+        raise ValueError(f'JSON parse error - {e}') from e
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    return data
+
+
+def error_response(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def rate_limited_response(error):
+    response = error_response(str(error), 429)
+    if error.retry_after is not None:
+        response['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncSpotifyCallbackView(View):
+    async def get(self, request):
+        code = request.GET.get('code')
+        if not code:
+            return error_response('Authorization code not provided', 400)
+
+        try:
+            tokens = await sync_to_async(SpotifyService.get_tokens)(code)
+
+            access_token = tokens['access_token']
+            refresh_token = tokens.get('refresh_token')
+            token_expires = timezone.now() + timedelta(seconds=tokens.get('expires_in', 3600))  # fallback to 1h
+
+            sp_data = await AsyncSpotifyService.get_user_data(access_token=access_token)
+            spotify_user = sp_data['user']
+            spotify_id = spotify_user['id']
+            display_name = spotify_user.get('display_name', '')
+
+            user, _ = await User.objects.aget_or_create(
+                username=spotify_id,
+                defaults={'first_name': display_name}
+            )
+
+            user_profile, created = await UserProfile.objects.aget_or_create(
+                spotify_id=spotify_id,
+                defaults={
+                    'user': user,
+                    'access_token': access_token,
+                    'refresh_token': refresh_token,
+                    'token_expires': token_expires,
+                }
+            )
+
+            if not created:
+                user_profile.access_token = access_token
+                if refresh_token:
+                    user_profile.refresh_token = refresh_token
+                user_profile.token_expires = token_expires
+                await user_profile.asave()
+                # Signing in again should show fresh data, not cached snapshots
+                SpotifyService.invalidate_user_data(spotify_id)
+
+                profile_user = await User.objects.aget(id=user_profile.user_id)
+                if profile_user.first_name != display_name:
+                    profile_user.first_name = display_name
+                    await profile_user.asave()
+
+            return JsonResponse({
+                'user_id': user_profile.id,
+                'spotify_id': user_profile.spotify_id,
+                'access_token': user_profile.access_token,
+                'token_expires': user_profile.token_expires.isoformat(),
+            })
+
+        except RateLimitExceeded as e:
+            return rate_limited_response(e)
+        except Exception as e:
+            return error_response(str(e), 400)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncUserProfileView(View):
+    async def get(self, request, user_id):
+        try:
+            fields = parse_profile_fields(request)
+            user_profile = await UserProfile.objects.aget(id=user_id)
+            sp_data = await AsyncSpotifyService.get_user_data(
+                user_profile=user_profile, endpoints=profile_endpoints(fields)
+            )
+            data = profile_response_data(user_profile, sp_data, fields)
+            return conditional_profile_response(request, data, JsonResponse)
+        except UserProfile.DoesNotExist:
+            return error_response('User not found', 404)
+        except RateLimitExceeded as e:
+            return rate_limited_response(e)
+        except Exception as e:
+            return error_response(str(e), 400)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAnalyzeUserView(View):
+    async def post(self, request):
+        try:
+            data = request_data(request)
+        except ValueError as e:
+            return error_response(str(e), 400)
+        user_id = data.get('user_id')
+        if not user_id:
+            return error_response('User ID not provided', 400)
+
+        try:
+            user = await UserProfile.objects.aget(id=user_id)
+            force = parse_flag(data.get('force'))
+
+            # Job mode: queue the analysis and let the client poll for it
+            if settings.ANALYSIS_JOBS_ENABLED or parse_flag(data.get('async')):
+                job, _ = await sync_to_async(enqueue_analysis)(user, force=force)
+                return JsonResponse(AnalysisJobSerializer(job).data, status=202)
+
+            analysis = await AsyncAnalysisService.run_analysis(user, force=force)
+            return JsonResponse(UserAnalysisSerializer(analysis).data)
+
+        except UserProfile.DoesNotExist:
+            return error_response('User not found', 404)
+        except ValueError as ve:
+            return error_response(f'Parsing error: {ve}', 400)
+        except RateLimitExceeded as e:
+            return rate_limited_response(e)
+        except Exception as e:
+            return error_response(f'Unexpected server error: {str(e)}', 500)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGeneratePlaylistView(View):
+    async def post(self, request):
+        try:
+            data = request_data(request)
+        except ValueError as e:
+            return error_response(str(e), 400)
+        user_id = data.get('user_id')
+        mood = data.get('mood')
+        prompt = data.get('prompt')
+
+        if not user_id:
+            return error_response('User ID not provided', 400)
+
+        if not mood and not prompt:
+            return error_response('Either mood or prompt must be provided.', 400)
+
+        try:
+            user = await UserProfile.objects.aget(id=user_id)
+            sp_data = await AsyncSpotifyService.get_user_data(
+                user_profile=user,
+                history_limit=settings.LISTENING_HISTORY_ANALYSIS_LIMIT
+            )
+
+            if settings.PLAYLIST_TRACK_SOURCE == 'llm':
+                ai_response = await AsyncAIService.generate_playlist(sp_data, mood, prompt)
+                with span('ai.parse'):
+                    playlist_data = parse_and_normalize_ai_json(ai_response)
+            else:
+                with span('playlist.rank'):
+                    ranked = rank_candidate_tracks(sp_data, mood, prompt, limit=settings.PLAYLIST_TRACK_COUNT)
+                if not ranked:
+                    return error_response('Not enough listening data to build a playlist', 400)
+
+                ai_response = await AsyncAIService.describe_playlist(ranked, mood, prompt)
+                with span('ai.parse'):
+                    playlist_data = parse_and_normalize_ai_json(ai_response)
+                playlist_data['tracks'] = [track['uri'] for track in ranked]
+
+            # A handful of spotipy writes plus token and database queries; run them off the
+            # event loop on the request's sync thread, where Django manages DB connections
+            playlist = await sync_to_async(SpotifyService.create_playlist)(
+                user.spotify_id,
+                playlist_data['name'],
+                playlist_data['description'],
+                playlist_data['tracks'],
+                user_profile=user
+            )
+
+            with span('db.save'):
+                generated_playlist = await GeneratedPlaylist.objects.acreate(
+                    user=user,
+                    playlist_id=playlist['id'],
+                    name=playlist['name'],
+                    description=playlist['description'],
+                    mood=mood,
+                    prompt=prompt
+                )
+
+            return JsonResponse({
+                **GeneratedPlaylistSerializer(generated_playlist).data,
+                'tracks_added': playlist['tracks_added'],
+                'tracks_rejected': playlist['tracks_rejected'],
+            })
+
+        except UserProfile.DoesNotExist:
+            return error_response('User not found', 404)
+        except RateLimitExceeded as e:
+            return rate_limited_response(e)
+        except Exception as e:
+            return error_response(str(e), 400)
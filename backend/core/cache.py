@@ -0,0 +1,211 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+# Size-bounded LRU store local to the current process
+class InProcessBackend:
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, timeout=None):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared across workers; eviction is left to the Django cache itself (MAX_ENTRIES)
+class DjangoCacheBackend:
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, entry, timeout=None):
+        self.cache.set(key, entry, timeout=timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+
+class CacheStats:
+    def __init__(self, *names):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(names, 0)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts = dict.fromkeys(self._counts, 0)
+
+
+# Per-user cache of Spotify endpoint payloads keyed by spotify_id. Entries younger
+# than their endpoint's TTL are served directly; stale entries carrying an ETag are
+# revalidated with If-None-Match, so an unchanged payload costs a 304.
+class SnapshotCache:
+    def __init__(self, backend, ttls, default_ttl=300, retention=86400):
+        self.backend = backend
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.retention = retention
+        self.stats = CacheStats('hits', 'misses', 'revalidated')
+
+    def _key(self, spotify_id, endpoint):
+        return f'spotify-snapshot:{spotify_id}:{endpoint}'
+
+    def get_or_fetch(self, spotify_id, endpoint, fetch):
+        # fetch(etag) returns (payload, etag), with payload None when Spotify answered 304
+        key, entry, fresh = self._lookup(spotify_id, endpoint)
+        if fresh:
+            return entry['payload']
+
+        payload, etag = fetch(entry['etag'] if entry is not None else None)
+        return self._store(key, entry, payload, etag)
+
+    async def aget_or_fetch(self, spotify_id, endpoint, fetch):
+        # Same as get_or_fetch with an awaitable fetch(etag)
+        key, entry, fresh = self._lookup(spotify_id, endpoint)
+        if fresh:
+            return entry['payload']
+
+        payload, etag = await fetch(entry['etag'] if entry is not None else None)
+        return self._store(key, entry, payload, etag)
+
+    def _lookup(self, spotify_id, endpoint):
+        key = self._key(spotify_id, endpoint)
+        entry = self.backend.get(key)
+        fresh = entry is not None and time.time() - entry['fetched_at'] < self.ttls.get(endpoint, self.default_ttl)
+        if fresh:
+            self.stats.incr('hits')
+        return key, entry, fresh
+
+    def _store(self, key, entry, payload, etag):
+        now = time.time()
+        if payload is None and entry is not None:
+            self.stats.incr('revalidated')
+            entry = dict(entry, fetched_at=now)
+        else:
+            self.stats.incr('misses')
+            entry = {'payload': payload, 'etag': etag, 'fetched_at': now}
+
+        # Keep entries past their TTL so their ETag can still be revalidated
+        self.backend.set(key, entry, timeout=self.retention)
+        return entry['payload']
+
+    def invalidate(self, spotify_id, endpoints):
+        for endpoint in endpoints:
+            self.backend.delete(self._key(spotify_id, endpoint))
+
+    def get_stats(self):
+        counts = self.stats.snapshot()
+        lookups = counts['hits'] + counts['misses'] + counts['revalidated']
+        counts['outbound_calls'] = counts['misses'] + counts['revalidated']
+        counts['full_downloads_saved'] = counts['hits'] + counts['revalidated']
+        counts['hit_rate'] = counts['hits'] / lookups if lookups else 0.0
+        return counts
+
+
+# Completed LLM responses keyed by a hash of everything that shapes the prompt, so a
+# repeated request skips the round trip. Expiry is checked on read because the
+# in-process backend does not honour timeouts.
+class CompletionCache:
+    def __init__(self, backend, ttl=86400):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = CacheStats('hits', 'misses', 'expired', 'stores')
+
+    @staticmethod
+    def key(*parts):
+        digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return f'llm-completion:{digest}'
+
+    def get(self, key):
+        entry = self.backend.get(key)
+        if entry is not None and time.time() >= entry['expires_at']:
+            self.backend.delete(key)
+            self.stats.incr('expired')
+            entry = None
+        if entry is None:
+            self.stats.incr('misses')
+            return None
+        self.stats.incr('hits')
+        return entry['content']
+
+    def set(self, key, content):
+        self.backend.set(key, {'content': content, 'expires_at': time.time() + self.ttl}, timeout=self.ttl)
+        self.stats.incr('stores')
+
+    def get_stats(self):
+        counts = self.stats.snapshot()
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_rate'] = counts['hits'] / lookups if lookups else 0.0
+        return counts
+
+
+def build_snapshot_cache():
+    backend_name = settings.SPOTIFY_SNAPSHOT_CACHE_BACKEND
+    if backend_name == 'none':
+        return None
+    if backend_name == 'django':
+        backend = DjangoCacheBackend(settings.SPOTIFY_SNAPSHOT_CACHE_ALIAS)
+    elif backend_name == 'memory':
+        backend = InProcessBackend(settings.SPOTIFY_SNAPSHOT_CACHE_MAX_ENTRIES)
+    else:
+        raise ValueError(f"Unknown snapshot cache backend: {backend_name}")
+
+    return SnapshotCache(
+        backend,
+        ttls=settings.SPOTIFY_SNAPSHOT_TTLS,
+        retention=settings.SPOTIFY_SNAPSHOT_RETENTION
+    )
+
+
+snapshot_cache = build_snapshot_cache()
+
+
+def build_completion_cache():
+    backend_name = settings.PLAYLIST_COMPLETION_CACHE_BACKEND
+    if backend_name == 'none':
+        return None
+    if backend_name == 'django':
+        backend = DjangoCacheBackend(settings.PLAYLIST_COMPLETION_CACHE_ALIAS)
+    elif backend_name == 'memory':
+        backend = InProcessBackend(settings.PLAYLIST_COMPLETION_CACHE_MAX_ENTRIES)
+    else:
+        raise ValueError(f"Unknown completion cache backend: {backend_name}")
+
+    return CompletionCache(backend, ttl=settings.PLAYLIST_COMPLETION_CACHE_TTL)
+
+
+playlist_completion_cache = build_completion_cache()
@@ -0,0 +1,116 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AnalysisJob
+from .services import AnalysisService
+
+
+def enqueue_analysis(user_profile, force=False):
+    # Collapse onto the user's queued or running job when there is one
+    existing = AnalysisJob.objects.filter(user=user_profile, status__in=AnalysisJob.ACTIVE_STATUSES).first()
+    if existing:
+        if force and existing.status == AnalysisJob.STATUS_PENDING and not existing.force:
+            AnalysisJob.objects.filter(id=existing.id, status=AnalysisJob.STATUS_PENDING).update(force=True)
+        return existing, False
+
+    try:
+        with transaction.atomic():
+            job = AnalysisJob.objects.create(user=user_profile, force=force)
+    except IntegrityError:
+        # Lost the race against a concurrent enqueue for the same user
+        return AnalysisJob.objects.get(user=user_profile, status__in=AnalysisJob.ACTIVE_STATUSES), False
+
+    worker_pool.wake()
+    return job, True
+
+
+def claim_next_job():
+    stale_before = timezone.now() - timedelta(seconds=settings.ANALYSIS_JOB_TIMEOUT)
+
+    with transaction.atomic():
+        # Pending jobs, plus running jobs whose worker died before finishing
+        job = (
+            AnalysisJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=AnalysisJob.STATUS_PENDING)
+                | Q(status=AnalysisJob.STATUS_RUNNING, started_at__lt=stale_before)
+            )
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = AnalysisJob.STATUS_RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+
+    return job
+
+
+def run_job(job):
+    try:
+        analysis = AnalysisService.run_analysis(job.user, force=job.force)
+    except Exception as e:
+        job.status = AnalysisJob.STATUS_FAILED
+        job.error = str(e)
+    else:
+        job.status = AnalysisJob.STATUS_DONE
+        job.analysis = analysis
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'analysis', 'error', 'finished_at'])
+    return job
+
+
+def process_jobs(max_jobs=None):
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        job = claim_next_job()
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
+
+
+class JobWorkerPool:
+    # In-process workers that drain the job table after each enqueue
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = None
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def wake(self):
+        if self.workers <= 0:
+            return
+
+        with self._lock:
+            if self._active >= self.workers:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='analysis-job')
+            self._active += 1
+
+        self._executor.submit(self._drain)
+
+    def _drain(self):
+        try:
+            process_jobs()
+        finally:
+            with self._lock:
+                self._active -= 1
+            # A job enqueued while this worker was winding down would otherwise wait
+            if AnalysisJob.objects.filter(status=AnalysisJob.STATUS_PENDING).exists():
+                self.wake()
+            connection.close()
+
+
+worker_pool = JobWorkerPool(settings.ANALYSIS_JOB_WORKERS)
@@ -0,0 +1,251 @@
+import io
+import json
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Compact columnar store for a user's deep-fetched library: the full saved library
+# plus the medium and long term top tracks and artists. Every string (ids, names,
+# genres) is interned once into a shared table and the columns hold indexes into
+# it, so a 10k track library takes a few hundred KB instead of the tens of MB the
+# raw Spotify objects would. Only each track's lead artist is kept.
+
+SOURCE_SAVED = 1
+SOURCE_TOP_MEDIUM = 2
+SOURCE_TOP_LONG = 4
+
+# column -> dtype. Missing strings and numbers are -1; unknown years, durations and
+# save times are 0
+TRACK_COLUMNS = {
+    'id': np.int32,
+    'name': np.int32,
+    'artist_id': np.int32,
+    'artist_name': np.int32,
+    'album_id': np.int32,
+    'album_name': np.int32,
+    'release_year': np.int16,
+    'popularity': np.int8,
+    'duration_ms': np.int32,
+    'explicit': np.bool_,
+    'sources': np.uint8,
+    # Best position in the top lists, -1 for tracks that are only saved
+    'rank': np.int16,
+    # Unix seconds the track was saved, 0 when it isn't in the saved library
+    'added_at': np.int64,
+}
+ARTIST_COLUMNS = {
+    'id': np.int32,
+    'name': np.int32,
+    'popularity': np.int8,
+    'sources': np.uint8,
+    'rank': np.int16,
+    # Slice of the flat genres array
+    'genre_start': np.int32,
+    'genre_count': np.int16,
+}
+
+
+def parse_timestamp(value):
+    if not value:
+        return 0
+    try:
+        return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+    except ValueError:
+        return 0
+
+
+def release_year(album):
+    year = (album.get('release_date') or '')[:4]
+    return int(year) if year.isdigit() else 0
+
+
+class TrackStore:
+    def __init__(self, strings, tracks, artists, genres):
+        self.strings = strings
+        self.tracks = tracks
+        self.artists = artists
+        self.genres = genres
+
+    def __len__(self):
+        return len(self.tracks['id'])
+
+    def string(self, index):
+        return self.strings[index] if index >= 0 else None
+
+    def rows(self, source):
+        return np.flatnonzero(self.tracks['sources'] & source)
+
+    def sample(self, size, source=SOURCE_SAVED, seed=0):
+        # A fixed seed keeps the sample, and the prompts built from it, stable between analyses
+        rows = self.rows(source)
+        if len(rows) > size:
+            rows = np.sort(np.random.default_rng(seed).choice(rows, size, replace=False))
+        return rows
+
+    def track(self, row):
+        columns = self.tracks
+        track_id = self.string(columns['id'][row])
+        year = int(columns['release_year'][row])
+        popularity = int(columns['popularity'][row])
+        return {
+            'id': track_id,
+            'name': self.string(columns['name'][row]),
+            'uri': f'spotify:track:{track_id}',
+            'popularity': popularity if popularity >= 0 else None,
+            'duration_ms': int(columns['duration_ms'][row]),
+            'explicit': bool(columns['explicit'][row]),
+            'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'},
+            'artists': [{'id': self.string(columns['artist_id'][row]), 'name': self.string(columns['artist_name'][row])}],
+            'album': {
+                'id': self.string(columns['album_id'][row]),
+                'name': self.string(columns['album_name'][row]),
+                'release_date': str(year) if year else None,
+            },
+        }
+
+    def saved_items(self, rows):
+        return [{
+            'track': self.track(row),
+            'added_at': datetime.fromtimestamp(int(self.tracks['added_at'][row]), timezone.utc).isoformat().replace('+00:00', 'Z'),
+        } for row in rows]
+
+    def artist_items(self, source=SOURCE_TOP_MEDIUM | SOURCE_TOP_LONG):
+        # Top artists of the given ranges, best ranked first
+        columns = self.artists
+        rows = np.flatnonzero(columns['sources'] & source)
+        rows = rows[np.argsort(columns['rank'][rows], kind='stable')]
+        items = []
+        for row in rows:
+            start, count = int(columns['genre_start'][row]), int(columns['genre_count'][row])
+            popularity = int(columns['popularity'][row])
+            items.append({
+                'id': self.string(columns['id'][row]),
+                'name': self.string(columns['name'][row]),
+                'popularity': popularity if popularity >= 0 else None,
+                'genres': [self.strings[index] for index in self.genres[start:start + count]],
+            })
+        return items
+
+    def to_bytes(self):
+        arrays = {f'track_{name}': values for name, values in self.tracks.items()}
+        arrays.update({f'artist_{name}': values for name, values in self.artists.items()})
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            strings=np.frombuffer(json.dumps(self.strings).encode('utf-8'), dtype=np.uint8),
+            genres=self.genres,
+            **arrays
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(bytes(data)), allow_pickle=False) as arrays:
+            return cls(
+                strings=json.loads(arrays['strings'].tobytes().decode('utf-8')),
+                tracks={name: arrays[f'track_{name}'] for name in TRACK_COLUMNS},
+                artists={name: arrays[f'artist_{name}'] for name in ARTIST_COLUMNS},
+                genres=arrays['genres'],
+            )
+
+
+class TrackStoreBuilder:
+    # Takes fetched pages one at a time and keeps only their interned columns, so
+    # memory grows with the number of distinct tracks, never with raw page size
+    def __init__(self, max_tracks):
+        self.max_tracks = max_tracks
+        self.strings = []
+        self._string_index = {}
+        self.tracks = {name: [] for name in TRACK_COLUMNS}
+        self.artists = {name: [] for name in ARTIST_COLUMNS}
+        self.genres = []
+        self._track_rows = {}
+        self._artist_rows = {}
+
+    def intern(self, value):
+        if value is None:
+            return -1
+        index = self._string_index.get(value)
+        if index is None:
+            index = self._string_index[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def add_page(self, kind, source, offset, items):
+        for position, item in enumerate(items, start=offset):
+            if kind == 'artists':
+                self.add_artist(item, source, position)
+            elif source == SOURCE_SAVED:
+                self.add_track(item.get('track'), source, added_at=item.get('added_at'))
+            else:
+                self.add_track(item, source, rank=position)
+
+    def add_track(self, track, source, rank=-1, added_at=None):
+        if not track or not track.get('id'):
+            return
+        row = self._track_rows.get(track['id'])
+        if row is not None:
+            # Seen through another source: merge the flags, keep the best rank
+            self.tracks['sources'][row] |= source
+            if rank >= 0 and (self.tracks['rank'][row] < 0 or rank < self.tracks['rank'][row]):
+                self.tracks['rank'][row] = rank
+            if added_at:
+                self.tracks['added_at'][row] = parse_timestamp(added_at)
+            return
+        if len(self._track_rows) >= self.max_tracks:
+            return
+
+        self._track_rows[track['id']] = len(self.tracks['id'])
+        artist = (track.get('artists') or [{}])[0]
+        album = track.get('album') or {}
+        popularity = track.get('popularity')
+        values = {
+            'id': self.intern(track['id']),
+            'name': self.intern(track.get('name')),
+            'artist_id': self.intern(artist.get('id')),
+            'artist_name': self.intern(artist.get('name')),
+            'album_id': self.intern(album.get('id')),
+            'album_name': self.intern(album.get('name')),
+            'release_year': release_year(album),
+            'popularity': popularity if popularity is not None else -1,
+            'duration_ms': track.get('duration_ms') or 0,
+            'explicit': bool(track.get('explicit')),
+            'sources': source,
+            'rank': rank,
+            'added_at': parse_timestamp(added_at),
+        }
+        for name, value in values.items():
+            self.tracks[name].append(value)
+
+    def add_artist(self, artist, source, rank):
+        if not artist or not artist.get('id'):
+            return
+        row = self._artist_rows.get(artist['id'])
+        if row is not None:
+            self.artists['sources'][row] |= source
+            self.artists['rank'][row] = min(self.artists['rank'][row], rank)
+            return
+
+        self._artist_rows[artist['id']] = len(self.artists['id'])
+        genres = [self.intern(genre) for genre in artist.get('genres') or []]
+        popularity = artist.get('popularity')
+        values = {
+            'id': self.intern(artist['id']),
+            'name': self.intern(artist.get('name')),
+            'popularity': popularity if popularity is not None else -1,
+            'sources': source,
+            'rank': rank,
+            'genre_start': len(self.genres),
+            'genre_count': len(genres),
+        }
+        self.genres.extend(genres)
+        for name, value in values.items():
+            self.artists[name].append(value)
+
+    def build(self):
+        return TrackStore(
+            strings=self.strings,
+            tracks={name: np.array(self.tracks[name], dtype=dtype) for name, dtype in TRACK_COLUMNS.items()},
+            artists={name: np.array(self.artists[name], dtype=dtype) for name, dtype in ARTIST_COLUMNS.items()},
+            genres=np.array(self.genres, dtype=np.int32),
+        )
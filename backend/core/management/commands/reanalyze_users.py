@@ -0,0 +1,190 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+def _init_worker(rate, lock, next_slot, llm_rate, llm_lock, llm_next_slot):
+    # Runs once in each worker process: set up Django and share the request budgets
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+    from core.openrouter import openrouter_client
+    from core.services import spotify_adapter
+    from core.throttle import SharedRateLimiter, ThrottleChain
+
+    if rate > 0:
+        limiter = SharedRateLimiter(rate, lock, next_slot)
+        # Paces on top of the Spotify token bucket, which keeps handling Retry-After
+        spotify_adapter.throttle = ThrottleChain(limiter, spotify_adapter.throttle) if spotify_adapter.throttle else limiter
+    if llm_rate > 0:
+        # OpenRouter has a budget of its own; its client retries 429s itself
+        openrouter_client.adapter.throttle = SharedRateLimiter(llm_rate, llm_lock, llm_next_slot)
+
+
+def _analyze_user(profile_id, force):
+    # Fetch and analyze in the worker; rows are written in bulk by the parent
+    from core.models import UserProfile
+    from core.services import AnalysisService
+
+    try:
+        user_profile = UserProfile.objects.get(id=profile_id)
+        analysis = AnalysisService.prepare_analysis(user_profile, force=force)
+    except Exception as e:
+        return profile_id, None, f"{type(e).__name__}: {e}"
+
+    if analysis.pk is not None:
+        # A fresh analysis for unchanged data already exists
+        return profile_id, None, None
+
+    return profile_id, {
+        'personality_type': analysis.personality_type,
+        'description': analysis.description,
+        'music_analytics': analysis.music_analytics,
+        'insights': analysis.insights,
+        'recommendations': analysis.recommendations,
+        'input_fingerprint': analysis.input_fingerprint,
+    }, None
+
+
+class Command(BaseCommand):
+    help = 'Recompute analyses for many users with a process pool and a shared request rate limit'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filter', action='append', default=[], metavar='FIELD=VALUE',
+                            help='UserProfile filter, e.g. --filter token_expires__gte=2025-01-01 (repeatable)')
+        parser.add_argument('--limit', type=int, help='Maximum number of users to process')
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes')
+        parser.add_argument('--rate', type=float, default=5.0,
+                            help='Spotify requests per second across all workers (0 = unlimited)')
+        parser.add_argument('--llm-rate', type=float, default=0.0,
+                            help='LLM requests per second across all workers (0 = unlimited)')
+        parser.add_argument('--batch-size', type=int, default=50, help='Rows per bulk insert')
+        parser.add_argument('--checkpoint', default='reanalyze_checkpoint.json',
+                            help='File recording finished users so an interrupted run can resume; '
+                                 'removed once a run completes without failures')
+        parser.add_argument('--force', action='store_true', help='Call the LLM even when listening data is unchanged')
+
+    def handle(self, *args, **options):
+        from core.models import UserAnalysis, UserProfile
+
+        filters = {}
+        for item in options['filter']:
+            field, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f"Invalid filter {item!r}, expected FIELD=VALUE")
+            filters[field] = value
+
+        checkpoint = self.load_checkpoint(options['checkpoint'])
+        done = set(checkpoint['done'])
+
+        queryset = UserProfile.objects.filter(**filters).exclude(id__in=done).order_by('id')
+        if options['limit']:
+            queryset = queryset[:options['limit']]
+        profile_ids = list(queryset.values_list('id', flat=True))
+
+        self.stdout.write(f"Reanalyzing {len(profile_ids)} users ({len(done)} already done per checkpoint)")
+        if not profile_ids:
+            self.clear_checkpoint(options['checkpoint'])
+            return
+
+        # Workers must not inherit the parent's database connections
+        connections.close_all()
+
+        context = multiprocessing.get_context('spawn')
+        lock = context.Lock()
+        next_slot = context.Value('d', 0.0, lock=False)
+        llm_lock = context.Lock()
+        llm_next_slot = context.Value('d', 0.0, lock=False)
+
+        pending_rows, pending_ids = [], []
+        failures = {}
+        created = reused = 0
+        started = time.monotonic()
+
+        def flush():
+            nonlocal created
+            if pending_rows:
+                UserAnalysis.objects.bulk_create(pending_rows, batch_size=options['batch_size'])
+                created += len(pending_rows)
+            done.update(pending_ids)
+            pending_rows.clear()
+            pending_ids.clear()
+            self.save_checkpoint(options['checkpoint'], done, failures)
+
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(options['rate'], lock, next_slot, options['llm_rate'], llm_lock, llm_next_slot),
+        ) as executor:
+            remaining = iter(profile_ids)
+            in_flight = set()
+            try:
+                while True:
+                    # Keep a bounded window of submitted users instead of queueing everyone
+                    while len(in_flight) < options['workers'] * 2:
+                        profile_id = next(remaining, None)
+                        if profile_id is None:
+                            break
+                        in_flight.add(executor.submit(_analyze_user, profile_id, options['force']))
+                    if not in_flight:
+                        break
+
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        profile_id, fields, error = future.result()
+                        if error:
+                            failures[str(profile_id)] = error
+                            continue
+                        failures.pop(str(profile_id), None)
+                        if fields is None:
+                            reused += 1
+                        else:
+                            pending_rows.append(UserAnalysis(user_id=profile_id, **fields))
+                        pending_ids.append(profile_id)
+
+                    if len(pending_ids) >= options['batch_size']:
+                        flush()
+            finally:
+                flush()
+
+        # Every matching user went through: the next run starts over instead of resuming.
+        # A --limit run that filled its limit may have left users for the next one, and
+        # after failures the checkpoint stays so the next run retries just those users
+        complete = not options['limit'] or len(profile_ids) < options['limit']
+        if complete and not failures:
+            self.clear_checkpoint(options['checkpoint'])
+
+        elapsed = time.monotonic() - started
+        processed = created + reused
+        throughput = processed / elapsed * 60 if elapsed else 0.0
+
+        self.stdout.write(
+            f"Processed {processed} users in {elapsed:.1f}s ({throughput:.1f} users/min): "
+            f"{created} new analyses, {reused} reused, {len(failures)} failed"
+        )
+        for profile_id, error in failures.items():
+            self.stderr.write(f"  user {profile_id}: {error}")
+
+    def load_checkpoint(self, path):
+        if not os.path.exists(path):
+            return {'done': [], 'failed': {}}
+        with open(path) as f:
+            return json.load(f)
+
+    def clear_checkpoint(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    def save_checkpoint(self, path, done, failures):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'done': sorted(done), 'failed': failures}, f)
+        os.replace(tmp_path, path)
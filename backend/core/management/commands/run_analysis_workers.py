@@ -0,0 +1,43 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.jobs import process_jobs
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of workers that process queued analysis jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of worker threads')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+
+        def work():
+            try:
+                while not stop.is_set():
+                    processed = process_jobs()
+                    if options['once']:
+                        break
+                    if not processed:
+                        stop.wait(options['poll_interval'])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, name=f'analysis-worker-{i}') for i in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+
+        self.stdout.write(f"Started {len(threads)} analysis workers")
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
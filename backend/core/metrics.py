@@ -0,0 +1,199 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process metrics: stage spans feed both the current request's Server-Timing
+# header and process-wide histograms rendered in Prometheus text format. Each
+# worker process keeps its own numbers; scrape every worker or sum downstream.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+# Spans recorded for the request being handled; None outside a request
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DURATION_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, [list(counts), total, count]) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, gauges=None):
+        # gauges: {metric name prefix: {field: number}} sampled at scrape time
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, values in (gauges or {}).items():
+            for field, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f'# TYPE {prefix}_{field} gauge')
+                lines.append(f'{prefix}_{field} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+stage_duration = registry.register(Histogram(
+    'maestro_stage_duration_seconds', 'Time spent in each instrumented stage', labelnames=('stage',)
+))
+request_duration = registry.register(Histogram(
+    'maestro_request_duration_seconds', 'Request handling time per view', labelnames=('view', 'method', 'status')
+))
+llm_tokens = registry.register(Histogram(
+    'maestro_llm_tokens', 'Tokens per LLM completion', buckets=TOKEN_BUCKETS, labelnames=('model', 'kind')
+))
+llm_tokens_total = registry.register(Counter(
+    'maestro_llm_tokens_total', 'Tokens consumed by LLM completions', labelnames=('model', 'kind')
+))
+llm_completions_total = registry.register(Counter(
+    'maestro_llm_completions_total', 'LLM completions by model', labelnames=('model',)
+))
+llm_latency = registry.register(Histogram(
+    'maestro_llm_latency_seconds', 'LLM completion latency per model', labelnames=('model',)
+))
+llm_outcomes_total = registry.register(Counter(
+    'maestro_llm_outcomes_total', 'LLM completion outcomes per model (ok, parse_failure, error, cancelled)',
+    labelnames=('model', 'outcome')
+))
+llm_hedges_total = registry.register(Counter(
+    'maestro_llm_hedges_total', 'Hedged requests sent to a fallback model, by reason', labelnames=('model', 'reason')
+))
+
+
+@contextmanager
+def span(name):
+    # Times the block into the stage histogram and the current request's spans
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_duration.observe(elapsed, stage=name)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((name, elapsed))
+
+
+def start_request():
+    return _request_spans.set([])
+
+
+def finish_request(token):
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    return spans
+
+
+def record_llm_usage(model, usage):
+    if not usage:
+        return
+    llm_completions_total.inc(model=model or '')
+    counts = {
+        'prompt': usage.get('prompt_tokens'),
+        'completion': usage.get('completion_tokens'),
+        # Prompt tokens served from the provider's prompt cache, when it reports them
+        'cached_prompt': (usage.get('prompt_tokens_details') or {}).get('cached_tokens'),
+    }
+    for kind, count in counts.items():
+        if count is None:
+            continue
+        llm_tokens.observe(count, model=model or '', kind=kind)
+        llm_tokens_total.inc(count, model=model or '', kind=kind)
+
+
+def server_timing_header(spans, total=None):
+    # Repeated stages are summed, keeping the order they first ran in
+    durations = {}
+    counts = {}
+    for name, elapsed in spans:
+        durations[name] = durations.get(name, 0.0) + elapsed
+        counts[name] = counts.get(name, 0) + 1
+
+    entries = []
+    for name, elapsed in durations.items():
+        entry = f'{name};dur={elapsed * 1000:.1f}'
+        if counts[name] > 1:
+            entry += f';desc="x{counts[name]}"'
+        entries.append(entry)
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
@@ -0,0 +1,65 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+from .metrics import finish_request, request_duration, server_timing_header, start_request
+
+
+class ServerTimingMiddleware:
+    # Collects the stage spans of each request into a Server-Timing header and
+    # records the request duration per view
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        token = start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            spans = finish_request(token)
+        return self.finish(request, response, spans, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        token = start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            spans = finish_request(token)
+        return self.finish(request, response, spans, time.perf_counter() - started)
+
+    def finish(self, request, response, spans, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        request_duration.observe(
+            elapsed,
+            view=match.url_name if match and match.url_name else 'unmatched',
+            method=request.method,
+            status=response.status_code
+        )
+        # Streaming bodies are still running; their header only covers the setup
+        if settings.SERVER_TIMING_ENABLED:
+            response['Server-Timing'] = server_timing_header(spans, total=elapsed)
+        return response
+
+
+class CompressionMiddleware(GZipMiddleware):
+    # gzip for clients that accept it. Event streams are left alone: the gzip
+    # stream buffers small writes, which would hold back SSE events
+    def process_response(self, request, response):
+        if not settings.RESPONSE_COMPRESSION_ENABLED:
+            return response
+        if response.get('Content-Type', '').startswith('text/event-stream'):
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,66 @@
+# Generated by Django 5.2 on 2026-10-18 17:32
+
+# Schema as it stood before migrations were tracked. Databases that already have
+# these tables are brought under migrations with: manage.py migrate core --fake-initial
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=255, unique=True)),
+                ('access_token', models.TextField()),
+                ('refresh_token', models.TextField()),
+                ('token_expires', models.DateTimeField()),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'users',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserAnalysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('personality_type', models.CharField(max_length=255)),
+                ('description', models.TextField(blank=True, default='')),
+                ('music_analytics', models.JSONField()),
+                ('generated_at', models.DateTimeField(auto_now_add=True)),
+                ('insights', models.JSONField(default=list)),
+                ('recommendations', models.JSONField(default=dict)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.userprofile')),
+            ],
+            options={
+                'db_table': 'user_analyses',
+            },
+        ),
+        migrations.CreateModel(
+            name='GeneratedPlaylist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('playlist_id', models.CharField(max_length=255)),
+                ('name', models.CharField(max_length=255)),
+                ('description', models.TextField()),
+                ('generated_at', models.DateTimeField(auto_now_add=True)),
+                ('mood', models.CharField(blank=True, max_length=255, null=True)),
+                ('prompt', models.TextField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.userprofile')),
+            ],
+            options={
+                'db_table': 'generated_playlists',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_analysis_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='force',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='useranalysis',
+            name='input_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='useranalysis',
+            index=models.Index(fields=['user', 'input_fingerprint'], name='user_analys_user_id_afe99c_idx'),
+        ),
+    ]
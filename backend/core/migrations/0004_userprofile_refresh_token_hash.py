@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 17:32
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_refresh_tokens(apps, schema_editor):
+    # Backfill existing rows so refresh-token lookups hit the index straight away
+    UserProfile = apps.get_model('core', 'UserProfile')
+    profiles = list(UserProfile.objects.exclude(refresh_token='').only('id', 'refresh_token'))
+    for profile in profiles:
+        profile.refresh_token_hash = hashlib.sha256(profile.refresh_token.encode('utf-8')).hexdigest()
+    UserProfile.objects.bulk_update(profiles, ['refresh_token_hash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_analysis_input_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='refresh_token_hash',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=64),
+        ),
+        migrations.RunPython(hash_refresh_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_userprofile_refresh_token_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='generatedplaylist',
+            index=models.Index(fields=['user', '-generated_at'], name='generated_p_user_id_3cea96_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useranalysis',
+            index=models.Index(fields=['user', '-generated_at'], name='user_analys_user_id_d84c43_idx'),
+        ),
+    ]
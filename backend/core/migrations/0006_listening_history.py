@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 17:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListeningHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('track_id', models.CharField(max_length=64)),
+                ('played_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.userprofile')),
+            ],
+            options={
+                'db_table': 'listening_history',
+                'indexes': [models.Index(fields=['user', '-played_at'], name='listening_h_user_id_481e20_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'played_at'), name='unique_listening_history_play')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 17:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_listening_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackLibrary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('track_count', models.PositiveIntegerField(default=0)),
+                ('synced_at', models.DateTimeField()),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='track_library', to='core.userprofile')),
+            ],
+            options={
+                'db_table': 'track_library',
+            },
+        ),
+    ]
@@ -0,0 +1,107 @@
+# Generated by Django 5.2 on 2026-10-18 17:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def add_history_tracks(apps, schema_editor):
+    # Every stored play needs a catalog track to reference. The catalog starts empty,
+    # so each played track gets a placeholder row with no name; readers treat those as
+    # unknown and fill them in from Spotify the next time the play is read
+    ListeningHistory = apps.get_model('core', 'ListeningHistory')
+    Track = apps.get_model('core', 'Track')
+
+    track_ids = set(ListeningHistory.objects.values_list('track_id', flat=True).distinct())
+    Track.objects.bulk_create(
+        [Track(spotify_id=track_id, name='') for track_id in sorted(track_ids)],
+        batch_size=500, ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_track_library'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'db_table': 'catalog_genres',
+            },
+        ),
+        migrations.CreateModel(
+            name='Track',
+            fields=[
+                ('spotify_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=512)),
+                ('album_id', models.CharField(blank=True, default='', max_length=64)),
+                ('album_name', models.CharField(blank=True, default='', max_length=512)),
+                ('album_image_url', models.TextField(blank=True, default='')),
+                ('release_date', models.CharField(blank=True, default='', max_length=10)),
+                ('popularity', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('duration_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('explicit', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'catalog_tracks',
+            },
+        ),
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('spotify_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=512)),
+                ('popularity', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('genres', models.ManyToManyField(db_table='catalog_artist_genres', related_name='artists', to='core.genre')),
+            ],
+            options={
+                'db_table': 'catalog_artists',
+            },
+        ),
+        migrations.CreateModel(
+            name='TrackArtist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credits', to='core.artist')),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credits', to='core.track')),
+            ],
+            options={
+                'db_table': 'catalog_track_artists',
+            },
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='artists',
+            field=models.ManyToManyField(related_name='tracks', through='core.TrackArtist', to='core.artist'),
+        ),
+        migrations.AddConstraint(
+            model_name='trackartist',
+            constraint=models.UniqueConstraint(fields=('track', 'artist'), name='unique_catalog_track_artist'),
+        ),
+        migrations.RunPython(add_history_tracks, migrations.RunPython.noop),
+        # Turn the existing track_id column into a foreign key to the catalog
+        migrations.AlterField(
+            model_name='listeninghistory',
+            name='track_id',
+            field=models.CharField(db_column='track_id', max_length=64),
+        ),
+        migrations.RenameField(
+            model_name='listeninghistory',
+            old_name='track_id',
+            new_name='track',
+        ),
+        migrations.AlterField(
+            model_name='listeninghistory',
+            name='track',
+            field=models.ForeignKey(db_column='track_id', on_delete=django.db.models.deletion.PROTECT, related_name='plays', to='core.track'),
+        ),
+    ]
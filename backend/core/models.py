@@ -1,16 +1,40 @@
+import hashlib
+
 from django.db import models
 from django.contrib.auth.models import User
 
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest() if token else ""
+
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     spotify_id = models.CharField(max_length=255, unique=True)
     access_token = models.TextField()
     refresh_token = models.TextField()
+    # Indexed digest of refresh_token, so lookups by token avoid scanning the TextField
+    refresh_token_hash = models.CharField(max_length=64, db_index=True, default="", editable=False)
     token_expires = models.DateTimeField()
 
     class Meta:
         db_table = 'users'
 
+    def save(self, *args, **kwargs):
+        self.refresh_token_hash = hash_token(self.refresh_token)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'refresh_token' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'refresh_token_hash'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def get_by_refresh_token(cls, refresh_token):
+        try:
+            return cls.objects.get(refresh_token_hash=hash_token(refresh_token))
+        except cls.DoesNotExist:
+            # Rows saved before the hash column existed; they are hashed on their next save
+            return cls.objects.get(refresh_token_hash="", refresh_token=refresh_token)
+
 class UserAnalysis(models.Model):
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE) 
     personality_type = models.CharField(max_length=255)
@@ -19,9 +43,14 @@ class UserAnalysis(models.Model):
     generated_at = models.DateTimeField(auto_now_add=True)
     insights = models.JSONField(default=list)
     recommendations = models.JSONField(default=dict)
+    input_fingerprint = models.CharField(max_length=64, default="", blank=True)
 
     class Meta:
         db_table = 'user_analyses'
+        indexes = [
+            models.Index(fields=['user', 'input_fingerprint']),
+            models.Index(fields=['user', '-generated_at']),
+        ]
 
 class GeneratedPlaylist(models.Model):
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
@@ -34,3 +63,124 @@ class GeneratedPlaylist(models.Model):
 
     class Meta:
         db_table = 'generated_playlists'
+        indexes = [
+            models.Index(fields=['user', '-generated_at']),
+        ]
+
+
+# Shared catalog of Spotify tracks, artists and genres, keyed by Spotify id and
+# upserted from every fetch; per-user tables reference it instead of copying objects
+
+class Genre(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+
+    class Meta:
+        db_table = 'catalog_genres'
+
+
+class Artist(models.Model):
+    spotify_id = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=512)
+    # Only known once the full artist object has been fetched
+    popularity = models.PositiveSmallIntegerField(null=True, blank=True)
+    genres = models.ManyToManyField(Genre, related_name='artists', db_table='catalog_artist_genres')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'catalog_artists'
+
+
+class Track(models.Model):
+    spotify_id = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=512)
+    artists = models.ManyToManyField(Artist, through='TrackArtist', related_name='tracks')
+    album_id = models.CharField(max_length=64, default="", blank=True)
+    album_name = models.CharField(max_length=512, default="", blank=True)
+    # Smallest album image, the one the UI shows
+    album_image_url = models.TextField(default="", blank=True)
+    release_date = models.CharField(max_length=10, default="", blank=True)
+    popularity = models.PositiveSmallIntegerField(null=True, blank=True)
+    duration_ms = models.PositiveIntegerField(null=True, blank=True)
+    explicit = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'catalog_tracks'
+
+
+class TrackArtist(models.Model):
+    # Ordered artist credits; position 0 is the lead artist
+    track = models.ForeignKey(Track, on_delete=models.CASCADE, related_name='credits')
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE, related_name='credits')
+    position = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        db_table = 'catalog_track_artists'
+        constraints = [
+            models.UniqueConstraint(fields=['track', 'artist'], name='unique_catalog_track_artist'),
+        ]
+
+
+class ListeningHistory(models.Model):
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    # The column keeps the Spotify track id, now as a reference into the catalog
+    track = models.ForeignKey(Track, on_delete=models.PROTECT, db_column='track_id', related_name='plays')
+    played_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'listening_history'
+        indexes = [
+            models.Index(fields=['user', '-played_at']),
+        ]
+        constraints = [
+            # A user can only play one track at a time, so this also dedupes re-synced plays
+            models.UniqueConstraint(fields=['user', 'played_at'], name='unique_listening_history_play'),
+        ]
+
+
+class TrackLibrary(models.Model):
+    # Columnar snapshot of the user's saved library and long-range top items (core/library.py)
+    user = models.OneToOneField(UserProfile, on_delete=models.CASCADE, related_name='track_library')
+    data = models.BinaryField()
+    track_count = models.PositiveIntegerField(default=0)
+    synced_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'track_library'
+
+
+class AnalysisJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
+
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    analysis = models.ForeignKey(UserAnalysis, on_delete=models.SET_NULL, null=True, blank=True)
+    force = models.BooleanField(default=False)
+    error = models.TextField(default="", blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'analysis_jobs'
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+        constraints = [
+            # At most one queued or running job per user
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='unique_active_analysis_job'
+            ),
+        ]
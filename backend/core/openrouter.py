@@ -0,0 +1,372 @@
+import asyncio
+import contextvars
+import json
+import random
+import threading
+import time
+import weakref
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+import requests
+from django.conf import settings
+
+from .metrics import llm_hedges_total, llm_latency, llm_outcomes_total, record_llm_usage
+from .throttle import ThrottledAdapter, parse_retry_after
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Raised by accept() callbacks for completions that don't parse
+REJECTED_COMPLETION_ERRORS = (ValueError, KeyError, IndexError, TypeError)
+
+
+class ModelStats:
+    # Rolling per-model latencies and outcomes. Hedge delays and the tier order are
+    # derived from them, so both follow providers as they speed up or degrade
+    def __init__(self, window):
+        self.window = window
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._outcomes = defaultdict(lambda: deque(maxlen=window))
+        self._hedged = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, model, outcome, latency=None):
+        # outcome: ok, parse_failure, error or cancelled; latency only when an answer arrived
+        llm_outcomes_total.inc(model=model, outcome=outcome)
+        if latency is not None:
+            llm_latency.observe(latency, model=model)
+        with self._lock:
+            if latency is not None:
+                self._latencies[model].append(latency)
+            if outcome != 'cancelled':
+                self._outcomes[model].append(outcome == 'ok')
+
+    def hedge_delay(self, model):
+        # The model's rolling latency quantile, or the configured delay until enough samples exist
+        with self._lock:
+            latencies = sorted(self._latencies[model])
+        if len(latencies) < settings.OPENROUTER_HEDGE_MIN_SAMPLES:
+            return settings.OPENROUTER_HEDGE_DELAY
+        index = min(int(settings.OPENROUTER_HEDGE_QUANTILE * len(latencies)), len(latencies) - 1)
+        return max(latencies[index], settings.OPENROUTER_HEDGE_MIN_DELAY)
+
+    def failure_rate(self, model):
+        with self._lock:
+            outcomes = list(self._outcomes[model])
+        if len(outcomes) < settings.OPENROUTER_HEDGE_MIN_SAMPLES:
+            return 0.0
+        return 1 - sum(outcomes) / len(outcomes)
+
+    def order(self, models):
+        # Models that error or return unparseable answers too often move to the back
+        return sorted(models, key=lambda model: self.failure_rate(model) >= settings.OPENROUTER_DEMOTE_FAILURE_RATE)
+
+    def allow_hedge(self):
+        # Keeps duplicate requests to OPENROUTER_HEDGE_BUDGET of recent completions
+        with self._lock:
+            hedged, total = sum(self._hedged), len(self._hedged)
+        # Counts the hedge being considered, so a budget of 1 always allows it
+        return hedged + 1 <= settings.OPENROUTER_HEDGE_BUDGET * (total + 1)
+
+    def record_request(self, hedged):
+        with self._lock:
+            self._hedged.append(hedged)
+
+    def get_stats(self):
+        with self._lock:
+            hedged, total = sum(self._hedged), len(self._hedged)
+        return {
+            'window_requests': total,
+            'window_hedged': hedged,
+            'hedged_share': hedged / total if total else 0.0,
+        }
+
+
+model_stats = ModelStats(settings.OPENROUTER_STATS_WINDOW)
+# Hedged completions run here so the caller can wait on several at once
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=settings.OPENROUTER_POOL_SIZE * len(settings.OPENROUTER_MODEL_TIERS),
+    thread_name_prefix='llm-hedge'
+)
+
+
+class OpenRouterClient:
+    def __init__(self):
+        self.url = settings.OPENROUTER_API_URL
+        self.timeout = (settings.OPENROUTER_CONNECT_TIMEOUT, settings.OPENROUTER_READ_TIMEOUT)
+        self.max_retries = settings.OPENROUTER_MAX_RETRIES
+        self.backoff_base = settings.OPENROUTER_BACKOFF_BASE
+        self.backoff_max = settings.OPENROUTER_BACKOFF_MAX
+
+        # Keep TLS connections to the API alive between completions
+        self.session = requests.Session()
+        self.adapter = ThrottledAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.OPENROUTER_POOL_SIZE
+        )
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        # httpx clients are bound to the event loop they were created on
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {settings.OPENROUTER_API_KEY}",
+            "Content-Type": "application/json"
+        }
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = parse_retry_after(response.headers.get('Retry-After')) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def post(self, payload, stream=False, deadline=None):
+        # Retries happen before any of the body is read, so streams are never replayed.
+        # deadline (time.monotonic()) caps each attempt's read timeout, and no retry
+        # starts once it has passed
+        attempt = 0
+        while True:
+            timeout = self.timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise requests.Timeout("LLM completion deadline passed")
+                timeout = (self.timeout[0], min(self.timeout[1], remaining))
+            try:
+                response = self.session.post(
+                    self.url, headers=self._headers(), json=payload, timeout=timeout, stream=stream
+                )
+            except requests.ConnectionError:
+                # A stalled read is not retried: it already cost a full read timeout
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                response.close()
+                time.sleep(self._retry_delay(attempt, response))
+                attempt += 1
+                continue
+
+            response.raise_for_status()
+            return response
+
+    def complete(self, payload, deadline=None):
+        # Decode the body exactly once and hand back the parsed completion
+        completion = self.post(payload, deadline=deadline).json()
+        record_llm_usage(completion.get('model') or payload.get('model'), completion.get('usage'))
+        return completion
+
+    def model_tiers(self, model):
+        # The payload's model first, then the configured tiers in their adaptive order
+        tiers = [model] + [tier for tier in settings.OPENROUTER_MODEL_TIERS if tier != model]
+        if not settings.OPENROUTER_HEDGE_ENABLED:
+            return tiers[:1]
+        return model_stats.order(tiers)
+
+    def _timed_complete(self, payload, accept=None, deadline=None):
+        model = payload['model']
+        started = time.perf_counter()
+        try:
+            completion = self.complete(payload, deadline=deadline)
+        except Exception:
+            model_stats.observe(model, 'error')
+            raise
+        return self._accept(completion, model, time.perf_counter() - started, accept)
+
+    def _accept(self, completion, model, latency, accept):
+        if accept is not None:
+            try:
+                accept(completion['choices'][0]['message']['content'])
+            except REJECTED_COMPLETION_ERRORS:
+                model_stats.observe(model, 'parse_failure', latency)
+                raise
+        model_stats.observe(model, 'ok', latency)
+        return completion
+
+    def complete_hedged(self, payload, accept=None):
+        # Sends the payload to the first tier and, if no answer arrives within that
+        # model's hedge delay, to the next one too. The first completion accept()
+        # takes wins. Errors and rejected answers move on to the next tier at once.
+        # A request already on the wire can't be aborted here: the loser's thread
+        # finishes it in the background and its latency still feeds the stats. Every
+        # attempt times out at the shared OPENROUTER_HEDGE_DEADLINE, so losers free
+        # their hedge worker by then
+        models = self.model_tiers(payload['model'])
+        if len(models) == 1:
+            return self._timed_complete(dict(payload, model=models[0]), accept)
+
+        pending = {}
+        hedged = False
+        last_error = None
+        deadline = time.monotonic() + settings.OPENROUTER_HEDGE_DEADLINE
+
+        def launch(model):
+            future = _hedge_executor.submit(
+                contextvars.copy_context().run, self._timed_complete, dict(payload, model=model), accept, deadline
+            )
+            pending[future] = model
+            return time.monotonic() + model_stats.hedge_delay(model)
+
+        hedge_at = launch(models.pop(0))
+        try:
+            while pending:
+                timeout = max(hedge_at - time.monotonic(), 0) if models and hedge_at is not None else None
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    # Slow answer: hedge to the next tier while the budget allows it
+                    if model_stats.allow_hedge():
+                        hedged = True
+                        llm_hedges_total.inc(model=models[0], reason='slow')
+                        hedge_at = launch(models.pop(0))
+                    else:
+                        hedge_at = None
+                    continue
+
+                for future in done:
+                    del pending[future]
+                    try:
+                        return future.result()
+                    except Exception as e:
+                        last_error = e
+                if not pending and models:
+                    llm_hedges_total.inc(model=models[0], reason='failure')
+                    hedge_at = launch(models.pop(0))
+            raise last_error
+        finally:
+            model_stats.record_request(hedged)
+            for future, model in pending.items():
+                if future.cancel():
+                    model_stats.observe(model, 'cancelled')
+
+    def stream(self, payload):
+        # Server-sent events: yield each content delta as it arrives
+        # include_usage adds a final chunk with token counts, prompt cache hits included
+        response = self.post(dict(payload, stream=True, stream_options={'include_usage': True}), stream=True)
+        # text/event-stream without a charset would otherwise decode as latin-1
+        response.encoding = 'utf-8'
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    # Blank separators and ": OPENROUTER PROCESSING" keep-alive comments
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+
+                event = json.loads(data)
+                if 'error' in event:
+                    raise ValueError(f"Streaming completion failed: {event['error']}")
+                if event.get('usage'):
+                    # Sent with the final chunk when the provider reports usage
+                    record_llm_usage(event.get('model') or payload.get('model'), event['usage'])
+
+                choices = event.get('choices') or [{}]
+                content = (choices[0].get('delta') or {}).get('content')
+                if content:
+                    yield content
+        finally:
+            response.close()
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=httpx.Limits(max_keepalive_connections=settings.OPENROUTER_POOL_SIZE)
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def apost(self, payload):
+        client = self.async_client()
+        attempt = 0
+        while True:
+            try:
+                response = await client.post(self.url, headers=self._headers(), json=payload)
+            except httpx.ConnectError:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                await asyncio.sleep(self._retry_delay(attempt, response))
+                attempt += 1
+                continue
+
+            response.raise_for_status()
+            return response
+
+    async def acomplete(self, payload):
+        completion = (await self.apost(payload)).json()
+        record_llm_usage(completion.get('model') or payload.get('model'), completion.get('usage'))
+        return completion
+
+    async def _atimed_complete(self, payload, accept=None):
+        model = payload['model']
+        started = time.perf_counter()
+        try:
+            completion = await self.acomplete(payload)
+        except asyncio.CancelledError:
+            model_stats.observe(model, 'cancelled')
+            raise
+        except Exception:
+            model_stats.observe(model, 'error')
+            raise
+        return self._accept(completion, model, time.perf_counter() - started, accept)
+
+    async def acomplete_hedged(self, payload, accept=None):
+        # complete_hedged on the event loop; losing requests are cancelled mid-flight
+        models = self.model_tiers(payload['model'])
+        if len(models) == 1:
+            return await self._atimed_complete(dict(payload, model=models[0]), accept)
+
+        pending = set()
+        hedged = False
+        last_error = None
+
+        def launch(model):
+            pending.add(asyncio.ensure_future(self._atimed_complete(dict(payload, model=model), accept)))
+            return time.monotonic() + model_stats.hedge_delay(model)
+
+        hedge_at = launch(models.pop(0))
+        try:
+            while pending:
+                timeout = max(hedge_at - time.monotonic(), 0) if models and hedge_at is not None else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if model_stats.allow_hedge():
+                        hedged = True
+                        llm_hedges_total.inc(model=models[0], reason='slow')
+                        hedge_at = launch(models.pop(0))
+                    else:
+                        hedge_at = None
+                    continue
+
+                for task in done:
+                    pending.discard(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        last_error = e
+                if not pending and models:
+                    llm_hedges_total.inc(model=models[0], reason='failure')
+                    hedge_at = launch(models.pop(0))
+            raise last_error
+        finally:
+            model_stats.record_request(hedged)
+            for task in pending:
+                task.cancel()
+
+
+openrouter_client = OpenRouterClient()
@@ -0,0 +1,14 @@
+from rest_framework.pagination import CursorPagination
+
+
+class HistoryCursorPagination(CursorPagination):
+    # Keyset pagination over (user, generated_at); served by the composite indexes
+    ordering = '-generated_at'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    @staticmethod
+    def requested(request):
+        # Pagination is opt-in so existing clients keep receiving the full list
+        return 'cursor' in request.query_params or 'page_size' in request.query_params
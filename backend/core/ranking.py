@@ -0,0 +1,172 @@
+import re
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+
+# Genre keywords and numeric targets per mood. Genres are matched by substring,
+# so "lo-fi" also hits "lo-fi beats" and "chill lo-fi".
+MOOD_PROFILES = {
+    'chill': {
+        'genres': ['chill', 'lo-fi', 'ambient', 'acoustic', 'jazz', 'soul', 'bedroom', 'indie folk', 'downtempo'],
+        'popularity': 0.5,
+        'duration': 0.6,
+    },
+    'workout': {
+        'genres': ['edm', 'hip hop', 'rap', 'metal', 'dance', 'house', 'trap', 'drum and bass', 'punk', 'hard rock'],
+        'popularity': 0.75,
+        'duration': 0.4,
+    },
+    'focus': {
+        'genres': ['ambient', 'classical', 'lo-fi', 'instrumental', 'piano', 'post-rock', 'soundtrack', 'minimal'],
+        'popularity': 0.35,
+        'duration': 0.8,
+    },
+    'happy': {
+        'genres': ['pop', 'dance', 'funk', 'disco', 'indie pop', 'reggae', 'k-pop'],
+        'popularity': 0.8,
+        'duration': 0.4,
+    },
+    'sad': {
+        'genres': ['sad', 'emo', 'singer-songwriter', 'folk', 'slowcore', 'ballad', 'blues'],
+        'popularity': 0.5,
+        'duration': 0.6,
+    },
+    'party': {
+        'genres': ['dance', 'edm', 'house', 'reggaeton', 'hip hop', 'pop', 'latin', 'disco'],
+        'popularity': 0.9,
+        'duration': 0.4,
+    },
+    'romantic': {
+        'genres': ['r&b', 'soul', 'love', 'bossa nova', 'jazz', 'ballad', 'neo soul'],
+        'popularity': 0.6,
+        'duration': 0.5,
+    },
+}
+
+# Column weights: affinity, recency, genre match, prompt match, popularity fit, duration fit
+FEATURE_WEIGHTS = np.array([1.0, 0.6, 2.0, 1.5, 0.5, 0.3])
+RECENCY_HALF_LIFE_DAYS = 30.0
+MAX_TRACKS_PER_ARTIST = 3
+
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+def collect_candidates(data):
+    # Unique tracks from top, recent and saved lists with the signals each source adds
+    candidates = {}
+
+    def add(track, affinity=0.0, timestamp=None):
+        if not track or not track.get('id'):
+            return
+        candidate = candidates.setdefault(track['id'], {'track': track, 'affinity': 0.0, 'timestamp': None})
+        candidate['affinity'] += affinity
+        if timestamp and (candidate['timestamp'] is None or timestamp > candidate['timestamp']):
+            candidate['timestamp'] = timestamp
+
+    top_tracks = data.get('top_tracks', {}).get('items', [])
+    for rank, track in enumerate(top_tracks):
+        add(track, affinity=1.0 - rank / max(len(top_tracks), 1))
+
+    for item in data.get('recently_played', {}).get('items', []):
+        add(item.get('track'), affinity=0.3, timestamp=_parse_timestamp(item.get('played_at')))
+
+    for item in data.get('saved_tracks', {}).get('items', []):
+        add(item.get('track'), affinity=0.2, timestamp=_parse_timestamp(item.get('added_at')))
+
+    return list(candidates.values())
+
+
+def build_feature_matrix(candidates, artist_genres, mood=None, prompt=None, now=None):
+    now = now or datetime.now(dt_timezone.utc)
+    profile = MOOD_PROFILES.get((mood or '').strip().lower(), {})
+    prompt_terms = set(re.findall(r'[a-z0-9&-]{3,}', (prompt or '').lower()))
+
+    n = len(candidates)
+    affinity = np.empty(n)
+    age_days = np.full(n, np.inf)
+    popularity = np.empty(n)
+    duration = np.empty(n)
+    genre_sets = []
+    prompt_hits = np.zeros(n)
+
+    for i, candidate in enumerate(candidates):
+        track = candidate['track']
+        affinity[i] = candidate['affinity']
+        if candidate['timestamp'] is not None:
+            age_days[i] = max((now - candidate['timestamp']).total_seconds(), 0) / 86400
+        popularity[i] = track.get('popularity') or 0
+        duration[i] = track.get('duration_ms') or 0
+
+        genres = set()
+        for artist in track.get('artists', []):
+            genres.update(artist_genres.get(artist.get('id'), ()))
+        genre_sets.append(genres)
+
+        if prompt_terms:
+            text = ' '.join([track.get('name') or '', *(a.get('name') or '' for a in track.get('artists', [])), *genres]).lower()
+            prompt_hits[i] = sum(term in text for term in prompt_terms)
+
+    # Genre one-hots against the vocabulary seen in this candidate set
+    vocabulary = sorted(set().union(*genre_sets)) if genre_sets else []
+    genre_index = {genre: j for j, genre in enumerate(vocabulary)}
+    one_hot = np.zeros((n, len(vocabulary)))
+    for i, genres in enumerate(genre_sets):
+        one_hot[i, [genre_index[genre] for genre in genres]] = 1.0
+
+    mood_vector = np.array([
+        1.0 if any(keyword in genre for keyword in profile.get('genres', ())) else 0.0
+        for genre in vocabulary
+    ])
+    genre_counts = np.maximum(one_hot.sum(axis=1), 1.0)
+    genre_match = (one_hot @ mood_vector) / genre_counts if vocabulary else np.zeros(n)
+
+    popularity_norm = popularity / 100.0
+    duration_norm = np.clip(duration / 480000.0, 0.0, 1.0)
+
+    return np.column_stack([
+        affinity / max(affinity.max(initial=0.0), 1e-9),
+        np.exp2(-age_days / RECENCY_HALF_LIFE_DAYS),
+        genre_match,
+        prompt_hits / max(len(prompt_terms), 1),
+        1.0 - np.abs(popularity_norm - profile.get('popularity', popularity_norm.mean() if n else 0.5)),
+        1.0 - np.abs(duration_norm - profile.get('duration', duration_norm.mean() if n else 0.5)),
+    ])
+
+
+def rank_candidate_tracks(data, mood=None, prompt=None, limit=30):
+    candidates = collect_candidates(data)
+    if not candidates:
+        return []
+
+    artist_genres = {
+        artist.get('id'): artist.get('genres', [])
+        for artist in data.get('top_artists', {}).get('items', [])
+    }
+    scores = build_feature_matrix(candidates, artist_genres, mood, prompt) @ FEATURE_WEIGHTS
+
+    # Highest score first, capping how many picks a single artist can take
+    ranked, per_artist = [], {}
+    for i in np.argsort(-scores, kind='stable'):
+        track = candidates[i]['track']
+        lead_artist = (track.get('artists') or [{}])[0].get('id')
+        if per_artist.get(lead_artist, 0) >= MAX_TRACKS_PER_ARTIST:
+            continue
+        per_artist[lead_artist] = per_artist.get(lead_artist, 0) + 1
+        ranked.append({
+            'id': track['id'],
+            'uri': f"spotify:track:{track['id']}",
+            'name': track.get('name'),
+            'artists': [artist.get('name') for artist in track.get('artists', [])],
+            'score': float(scores[i]),
+        })
+        if len(ranked) >= limit:
+            break
+
+    return ranked
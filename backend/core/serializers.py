@@ -1,12 +1,30 @@
 from rest_framework import serializers
-from .models import UserAnalysis, GeneratedPlaylist
+from .models import UserAnalysis, GeneratedPlaylist, AnalysisJob
 
 class UserAnalysisSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserAnalysis
         fields = ['id', 'personality_type', 'description', 'music_analytics', 'insights', 'recommendations', 'generated_at']
 
+class UserAnalysisSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserAnalysis
+        fields = ['id', 'personality_type', 'generated_at']
+
 class GeneratedPlaylistSerializer(serializers.ModelSerializer):
     class Meta:
         model = GeneratedPlaylist
-        fields = ['id', 'user', 'playlist_id', 'name', 'description', 'generated_at', 'mood', 'prompt']
\ No newline at end of file
+        fields = ['id', 'user', 'playlist_id', 'name', 'description', 'generated_at', 'mood', 'prompt']
+
+class GeneratedPlaylistSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GeneratedPlaylist
+        fields = ['id', 'playlist_id', 'name', 'mood', 'generated_at']
+
+class AnalysisJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.IntegerField(source='id', read_only=True)
+    analysis = UserAnalysisSerializer(read_only=True)
+
+    class Meta:
+        model = AnalysisJob
+        fields = ['job_id', 'status', 'analysis', 'error', 'created_at', 'started_at', 'finished_at']
@@ -3,11 +3,118 @@ import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 from django.utils import timezone
 from datetime import timedelta
+import contextvars
+import functools
 import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from urllib.parse import urljoin
+from urllib3.util.retry import Retry
 from django.conf import settings
-from .utils import format_spotify_data_for_ai, normalize_ai_keys
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+from .analytics import compute_music_analytics
+from .cache import CompletionCache, InProcessBackend, playlist_completion_cache, snapshot_cache
+from .library import SOURCE_SAVED, SOURCE_TOP_LONG, SOURCE_TOP_MEDIUM, TrackStore, TrackStoreBuilder
+from .metrics import span, stage_duration
+from .models import Artist, Genre, ListeningHistory, Track, TrackArtist, TrackLibrary, UserAnalysis, UserProfile
+from .openrouter import openrouter_client
+from .prompts import (
+    ANALYSIS_SYSTEM_PROMPT,
+    ANALYSIS_USER_TEMPLATE,
+    DESCRIBE_PLAYLIST_SYSTEM_PROMPT,
+    DESCRIBE_PLAYLIST_USER_TEMPLATE,
+    PLAYLIST_SYSTEM_PROMPT,
+    PLAYLIST_USER_TEMPLATE,
+    build_messages,
+)
+from .throttle import SharedTokenBucket, ThrottledAdapter
+from .utils import (
+    IncrementalJSONParser,
+    fingerprint_spotify_data,
+    format_spotify_data_for_ai,
+    normalize_ai_keys,
+    normalize_prompt_text,
+    parse_and_normalize_ai_json,
+)
 import re
 
+logger = logging.getLogger(__name__)
+
+
+# Web API endpoints that make up a user's Spotify snapshot: name -> (path, params)
+SPOTIFY_USER_DATA_ENDPOINTS = {
+    'user': ('me', {}),
+    'top_tracks': ('me/top/tracks', {'limit': 50, 'time_range': 'short_term'}),
+    'top_artists': ('me/top/artists', {'limit': 50, 'time_range': 'short_term'}),
+    'recently_played': ('me/player/recently-played', {'limit': 50}),
+    'saved_tracks': ('me/tracks', {'limit': 50}),
+}
+
+# Plays returned as recently_played when the caller doesn't ask for more
+PROFILE_HISTORY_LIMIT = 50
+
+# Paged collections of a deep library fetch: name -> (path, params, kind, source)
+LIBRARY_COLLECTIONS = {
+    'saved_tracks': ('me/tracks', {}, 'tracks', SOURCE_SAVED),
+    'top_tracks_medium': ('me/top/tracks', {'time_range': 'medium_term'}, 'tracks', SOURCE_TOP_MEDIUM),
+    'top_tracks_long': ('me/top/tracks', {'time_range': 'long_term'}, 'tracks', SOURCE_TOP_LONG),
+    'top_artists_medium': ('me/top/artists', {'time_range': 'medium_term'}, 'artists', SOURCE_TOP_MEDIUM),
+    'top_artists_long': ('me/top/artists', {'time_range': 'long_term'}, 'artists', SOURCE_TOP_LONG),
+}
+LIBRARY_PAGE_SIZE = 50
+# Tracks or artists per catalog upsert during a deep fetch
+CATALOG_BATCH_SIZE = 500
+
+# Web API limits for multi-item calls
+PLAYLIST_ADD_BATCH_SIZE = 100
+TRACK_LOOKUP_BATCH_SIZE = 50
+TRACK_ID_RE = re.compile(r'(?:spotify:track:|open\.spotify\.com/track/)?([0-9A-Za-z]{22})(?:\?.*)?$')
+
+spotify_rate_limiter = SharedTokenBucket(
+    capacity=settings.SPOTIFY_RATE_LIMIT,
+    window=settings.SPOTIFY_RATE_WINDOW,
+    max_wait=settings.SPOTIFY_RATE_MAX_WAIT,
+    cache_alias=settings.SPOTIFY_RATE_LIMIT_CACHE_ALIAS
+) if settings.SPOTIFY_RATE_LIMIT > 0 else None
+
+
+def _build_spotify_session():
+    # One keep-alive pool shared by every Spotify call in the process
+    session = requests.Session()
+    # 429s are left to the shared rate limiter so every worker honours Retry-After
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504))
+    adapter = ThrottledAdapter(
+        pool_connections=settings.SPOTIFY_POOL_SIZE,
+        pool_maxsize=settings.SPOTIFY_POOL_SIZE,
+        max_retries=retry,
+        throttle=spotify_rate_limiter
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session, adapter
+
+
+_spotify_session, spotify_adapter = _build_spotify_session()
+_spotify_executor = ThreadPoolExecutor(max_workers=settings.SPOTIFY_POOL_SIZE, thread_name_prefix='spotify-fetch')
+# track id -> whether Spotify knows it; track ids don't change, so entries never expire
+_track_validity_cache = InProcessBackend(settings.SPOTIFY_TRACK_CACHE_MAX_ENTRIES)
+# catalog key -> digest of the values last written from this process
+_catalog_seen = InProcessBackend(settings.CATALOG_SEEN_MAX_ENTRIES)
+
+# Token refreshes are coalesced per user: threads queue on an in-process lock,
+# processes on a row lock. Users share a fixed set of striped locks, so the set
+# doesn't grow with every user the process has seen
+TOKEN_REFRESH_LOCK_STRIPES = 64
+_token_refresh_locks = [threading.Lock() for _ in range(TOKEN_REFRESH_LOCK_STRIPES)]
+_token_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='token-refresh')
+_scheduled_token_refreshes = set()
+_scheduled_token_refreshes_lock = threading.Lock()
+_library_sync_executor = ThreadPoolExecutor(max_workers=settings.LIBRARY_SYNC_WORKERS, thread_name_prefix='library-sync')
 
 
 class SpotifyService:
@@ -47,192 +154,901 @@ class SpotifyService:
         token_info = auth_manager.refresh_access_token(refresh_token)
         return token_info
 
+    @staticmethod
+    def refresh_user_token(user_profile, min_valid=0):
+        # Refresh unless the stored token stays valid for min_valid more seconds.
+        # Waiters that find a token refreshed by someone else just reuse it.
+        with _token_refresh_locks[user_profile.id % TOKEN_REFRESH_LOCK_STRIPES]:
+            with transaction.atomic():
+                locked = UserProfile.objects.select_for_update().get(id=user_profile.id)
+
+                if locked.token_expires <= timezone.now() + timedelta(seconds=min_valid):
+                    with span('spotify.token_refresh'):
+                        token_info = SpotifyService.refresh_access_token(locked.refresh_token)
+
+                    locked.access_token = token_info['access_token']
+                    locked.token_expires = timezone.now() + timedelta(seconds=token_info['expires_in'])
+
+                    if 'refresh_token' in token_info:
+                        locked.refresh_token = token_info['refresh_token']
+
+                    locked.save(update_fields=['access_token', 'refresh_token', 'token_expires'])
+
+        user_profile.access_token = locked.access_token
+        user_profile.refresh_token = locked.refresh_token
+        user_profile.refresh_token_hash = locked.refresh_token_hash
+        user_profile.token_expires = locked.token_expires
+        return user_profile.access_token
+
+    @staticmethod
+    def schedule_token_refresh(user_profile_id):
+        with _scheduled_token_refreshes_lock:
+            if user_profile_id in _scheduled_token_refreshes:
+                return
+            _scheduled_token_refreshes.add(user_profile_id)
+
+        def refresh():
+            try:
+                user_profile = UserProfile.objects.get(id=user_profile_id)
+                SpotifyService.refresh_user_token(user_profile, min_valid=settings.SPOTIFY_TOKEN_REFRESH_MARGIN)
+            except Exception:
+                logger.exception("Background token refresh failed for user %s", user_profile_id)
+            finally:
+                with _scheduled_token_refreshes_lock:
+                    _scheduled_token_refreshes.discard(user_profile_id)
+                connection.close()
+
+        _token_refresh_executor.submit(refresh)
+
     @staticmethod
     def get_valid_access_token(user_profile):
-        if user_profile.token_expires <= timezone.now():
-            token_info = SpotifyService.refresh_access_token(user_profile.refresh_token)
+        now = timezone.now()
+        if user_profile.token_expires <= now:
+            return SpotifyService.refresh_user_token(user_profile)
 
-            user_profile.access_token = token_info['access_token']
-            user_profile.token_expires = timezone.now() + timedelta(seconds=token_info['expires_in'])
+        # Close to expiry: keep serving the current token while a fresh one is fetched
+        if user_profile.token_expires <= now + timedelta(seconds=settings.SPOTIFY_TOKEN_REFRESH_MARGIN):
+            SpotifyService.schedule_token_refresh(user_profile.id)
 
-            if 'refresh_token' in token_info:
-                user_profile.refresh_token = token_info['refresh_token']
-            
-            user_profile.save()
-        
         return user_profile.access_token
 
 
     @staticmethod
-    def get_user_data(user_profile=None, access_token=None):
+    def get_client(access_token):
+        sp = spotipy.Spotify(
+            auth=access_token,
+            requests_session=_spotify_session,
+            requests_timeout=settings.SPOTIFY_REQUEST_TIMEOUT
+        )
+        sp.prefix = settings.SPOTIFY_API_BASE
+        return sp
+
+    @staticmethod
+    def api_request(access_token, path, params=None, etag=None):
+        headers = {'Authorization': f'Bearer {access_token}'}
+        if etag:
+            headers['If-None-Match'] = etag
+
+        response = _spotify_session.get(
+            urljoin(settings.SPOTIFY_API_BASE, path),
+            params=params,
+            headers=headers,
+            timeout=settings.SPOTIFY_REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def api_get(access_token, path, params=None):
+        return SpotifyService.api_request(access_token, path, params).json()
+
+    @staticmethod
+    def fetch_endpoint(access_token, name, spotify_id=None):
+        path, params = SPOTIFY_USER_DATA_ENDPOINTS[name]
+        with span(f'spotify.{name}'):
+            if not spotify_id or snapshot_cache is None:
+                return SpotifyService.api_get(access_token, path, params)
+
+            def fetch(etag):
+                response = SpotifyService.api_request(access_token, path, params, etag=etag)
+                if response.status_code == 304:
+                    return None, etag
+                return response.json(), response.headers.get('ETag')
+
+            return snapshot_cache.get_or_fetch(spotify_id, name, fetch)
+
+    @staticmethod
+    def invalidate_user_data(spotify_id):
+        # Drops the user's cached endpoint payloads so the next fetch goes to Spotify
+        if snapshot_cache is not None:
+            snapshot_cache.invalidate(spotify_id, SPOTIFY_USER_DATA_ENDPOINTS)
+
+    @staticmethod
+    def get_user_data(user_profile=None, access_token=None, history_limit=None, endpoints=None):
+        # history_limit: plays to return as recently_played when stored history is on;
+        # endpoints: subset of SPOTIFY_USER_DATA_ENDPOINTS to fetch (default all)
         if not access_token:
             if not user_profile:
                 raise ValueError("Must provide either user_profile or access_token")
             access_token = SpotifyService.get_valid_access_token(user_profile)
 
-        sp = spotipy.Spotify(auth=access_token)
+        spotify_id = user_profile.spotify_id if user_profile else None
 
-        user = sp.current_user()
-        top_tracks = sp.current_user_top_tracks(limit=50, time_range='short_term')
-        top_artists = sp.current_user_top_artists(limit=50, time_range='short_term')
-        recently_played = sp.current_user_recently_played(limit=50)
-        saved_tracks = sp.current_user_saved_tracks(limit=50)
-
-        return {
-            'user': user,
-            'top_tracks': top_tracks,
-            'top_artists': top_artists,
-            'recently_played': recently_played,
-            'saved_tracks': saved_tracks
+        fetchers = {
+            name: functools.partial(SpotifyService.fetch_endpoint, access_token, name, spotify_id)
+            for name in SPOTIFY_USER_DATA_ENDPOINTS
+            if endpoints is None or name in endpoints
         }
+        # Recently played comes from the stored history, topped up with plays after its cursor
+        use_history = settings.LISTENING_HISTORY_ENABLED and user_profile is not None and 'recently_played' in fetchers
+        if use_history:
+            due, after = ListeningHistoryService.sync_cursor(user_profile)
+            fetchers['recently_played'] = (
+                functools.partial(ListeningHistoryService.fetch_plays, access_token, after) if due
+                else functools.partial(dict, items=[])
+            )
+
+        with span('spotify.user_data'):
+            if not settings.SPOTIFY_CONCURRENT_FETCH:
+                data = {name: fetch() for name, fetch in fetchers.items()}
+            else:
+                # Each fetch runs in a copy of this context so its span reaches the request
+                futures = {
+                    name: _spotify_executor.submit(contextvars.copy_context().run, fetch)
+                    for name, fetch in fetchers.items()
+                }
+                # Each request has its own timeout; the deadline also bounds queueing and retries
+                deadline = time.monotonic() + settings.SPOTIFY_REQUEST_TIMEOUT * 3
+                data = {}
+                try:
+                    for name, future in futures.items():
+                        data[name] = future.result(timeout=max(deadline - time.monotonic(), 0))
+                except FutureTimeoutError:
+                    raise TimeoutError(f"Timed out fetching Spotify data: {name}")
+                finally:
+                    for future in futures.values():
+                        future.cancel()
+
+        # Catalog and history are written on this thread so the fetch threads never hold connections
+        if settings.CATALOG_ENABLED:
+            CatalogService.upsert_user_data(data)
+        if use_history:
+            ListeningHistoryService.store(user_profile, data['recently_played'])
+            data['recently_played'] = ListeningHistoryService.recent_plays(
+                user_profile, history_limit or PROFILE_HISTORY_LIMIT, access_token=access_token
+            )
+
+        missing = [name for name, value in data.items() if value is None]
+        if missing:
+            raise ValueError(f"Incomplete Spotify data, missing: {', '.join(missing)}")
+
+        return data
+
+    @staticmethod
+    def validate_track_ids(sp, tracks):
+        # Returns (valid ids in order, rejected inputs); unknown ids are checked in bulk
+        ids, rejected, seen = [], [], set()
+        for track in tracks:
+            match = TRACK_ID_RE.search(str(track).strip())
+            if not match:
+                rejected.append(track)
+                continue
+            track_id = match.group(1)
+            if track_id not in seen:
+                seen.add(track_id)
+                ids.append(track_id)
+
+        unknown = [track_id for track_id in ids if _track_validity_cache.get(track_id) is None]
+        # Tracks in the catalog came from Spotify, so they need no lookup
+        if unknown and settings.CATALOG_ENABLED:
+            cataloged = CatalogService.known_track_ids(unknown)
+            for track_id in cataloged:
+                _track_validity_cache.set(track_id, True)
+            unknown = [track_id for track_id in unknown if track_id not in cataloged]
+
+        for start in range(0, len(unknown), TRACK_LOOKUP_BATCH_SIZE):
+            batch = unknown[start:start + TRACK_LOOKUP_BATCH_SIZE]
+            found = [track for track in sp.tracks(batch).get('tracks') or [] if track]
+            known = {track['id'] for track in found}
+            for track_id in batch:
+                _track_validity_cache.set(track_id, track_id in known)
+            if settings.CATALOG_ENABLED:
+                CatalogService.upsert_tracks(found)
+
+        valid = []
+        for track_id in ids:
+            if _track_validity_cache.get(track_id):
+                valid.append(track_id)
+            else:
+                rejected.append(track_id)
+        return valid, rejected
+
+    @staticmethod
+    def lookup_tracks(access_token, track_ids):
+        # Full track objects for the given ids, fetched in batches; unknown ids are left out
+        found = []
+        for start in range(0, len(track_ids), TRACK_LOOKUP_BATCH_SIZE):
+            batch = track_ids[start:start + TRACK_LOOKUP_BATCH_SIZE]
+            page = SpotifyService.api_get(access_token, 'tracks', {'ids': ','.join(batch)})
+            found.extend(track for track in page.get('tracks') or [] if track)
+        return found
 
-    
-        
     @staticmethod
     def create_playlist(user_id, name, description, tracks, user_profile=None):
         access_token = SpotifyService.get_valid_access_token(user_profile)
-        sp = spotipy.Spotify(auth=access_token)
-        playlist = sp.user_playlist_create(
-            user=user_id,
-            name=name,
-            public=True,
-            description=description
-        )
-        
-        sp.playlist_add_items(playlist['id'], tracks)
+        sp = SpotifyService.get_client(access_token)
+
+        # Drop malformed and unknown (often hallucinated) ids before creating anything
+        with span('spotify.validate_tracks'):
+            valid, rejected = SpotifyService.validate_track_ids(sp, tracks)
+        if not valid:
+            raise ValueError("None of the suggested tracks exist on Spotify")
+
+        with span('spotify.create_playlist'):
+            playlist = sp.user_playlist_create(
+                user=user_id,
+                name=name,
+                public=True,
+                description=description
+            )
+
+            for start in range(0, len(valid), PLAYLIST_ADD_BATCH_SIZE):
+                sp.playlist_add_items(playlist['id'], valid[start:start + PLAYLIST_ADD_BATCH_SIZE])
+
+        playlist['tracks_added'] = len(valid)
+        playlist['tracks_rejected'] = len(rejected)
         return playlist
 
 
-class AIService:
+class CatalogService:
+    # Concurrent requests upsert overlapping rows, so every bulk write goes in
+    # primary key order: row locks are then always taken in the same order and two
+    # transactions can't deadlock on each other's rows
+    TRACK_UPDATE_FIELDS = [
+        'name', 'album_id', 'album_name', 'album_image_url', 'release_date',
+        'popularity', 'duration_ms', 'explicit', 'updated_at',
+    ]
+
+    @staticmethod
+    def unseen(kind, objects, digest):
+        # Drops objects written from this process with the same values, so repeat
+        # fetches of an unchanged snapshot cost no writes
+        fresh = {}
+        for obj in objects:
+            if obj and obj.get('id') and obj['id'] not in fresh:
+                if _catalog_seen.get(f'{kind}:{obj["id"]}') != digest(obj):
+                    fresh[obj['id']] = obj
+        return list(fresh.values())
+
+    @staticmethod
+    def mark_seen(kind, objects, digest):
+        for obj in objects:
+            _catalog_seen.set(f'{kind}:{obj["id"]}', digest(obj))
+
+    @staticmethod
+    def track_digest(track):
+        album = track.get('album') or {}
+        return hash((
+            track.get('name'), track.get('popularity'), track.get('duration_ms'), track.get('explicit'),
+            album.get('id'), album.get('name'), album.get('release_date'),
+            tuple(artist.get('id') for artist in track.get('artists') or []),
+        ))
+
+    @staticmethod
+    def artist_digest(artist):
+        return hash((artist.get('name'), artist.get('popularity'), tuple(artist.get('genres') or [])))
+
+    @staticmethod
+    def upsert_tracks(tracks):
+        tracks = CatalogService.unseen('track', tracks, CatalogService.track_digest)
+        if not tracks:
+            return 0
+
+        tracks.sort(key=lambda track: track['id'])
+        credits = sorted(
+            (track['id'], artist['id'], artist.get('name') or '', position)
+            for track in tracks
+            for position, artist in enumerate(track.get('artists') or [])
+            if artist.get('id')
+        )
+        credited = {artist_id: name for _, artist_id, name, _ in credits}
+        with span('db.catalog_write'), transaction.atomic():
+            # Credited artists come without popularity or genres: only add the missing ones
+            Artist.objects.bulk_create(
+                [Artist(spotify_id=artist_id, name=credited[artist_id]) for artist_id in sorted(credited)],
+                ignore_conflicts=True
+            )
+            Track.objects.bulk_create(
+                [CatalogService.track_row(track) for track in tracks],
+                update_conflicts=True,
+                unique_fields=['spotify_id'],
+                update_fields=CatalogService.TRACK_UPDATE_FIELDS
+            )
+            TrackArtist.objects.bulk_create(
+                [TrackArtist(track_id=track_id, artist_id=artist_id, position=position)
+                 for track_id, artist_id, _, position in credits],
+                ignore_conflicts=True
+            )
+        CatalogService.mark_seen('track', tracks, CatalogService.track_digest)
+        return len(tracks)
+
+    @staticmethod
+    def upsert_artists(artists):
+        # Full artist objects, e.g. top artists, with popularity and genres
+        artists = CatalogService.unseen('artist', artists, CatalogService.artist_digest)
+        if not artists:
+            return 0
+
+        artists.sort(key=lambda artist: artist['id'])
+        names = sorted({genre for artist in artists for genre in artist.get('genres') or []})
+        with span('db.catalog_write'), transaction.atomic():
+            Genre.objects.bulk_create([Genre(name=name) for name in names], ignore_conflicts=True)
+            genre_ids = dict(Genre.objects.filter(name__in=names).values_list('name', 'id'))
+            Artist.objects.bulk_create(
+                [Artist(spotify_id=artist['id'], name=artist.get('name') or '', popularity=artist.get('popularity'))
+                 for artist in artists],
+                update_conflicts=True,
+                unique_fields=['spotify_id'],
+                update_fields=['name', 'popularity', 'updated_at']
+            )
+            Artist.genres.through.objects.bulk_create(
+                [Artist.genres.through(artist_id=artist_id, genre_id=genre_id) for artist_id, genre_id in sorted({
+                    (artist['id'], genre_ids[genre]) for artist in artists for genre in artist.get('genres') or []
+                })],
+                ignore_conflicts=True
+            )
+        CatalogService.mark_seen('artist', artists, CatalogService.artist_digest)
+        return len(artists)
+
+    @staticmethod
+    def upsert_user_data(data):
+        # Everything a get_user_data snapshot carries; recently played is left to the history sync
+        tracks = [track for track in (data.get('top_tracks') or {}).get('items', [])]
+        tracks += [item.get('track') for item in (data.get('saved_tracks') or {}).get('items', [])]
+        CatalogService.upsert_tracks(tracks)
+        CatalogService.upsert_artists((data.get('top_artists') or {}).get('items', []))
+
+    @staticmethod
+    def track_row(track):
+        album = track.get('album') or {}
+        images = album.get('images') or []
+        return Track(
+            spotify_id=track['id'],
+            name=track.get('name') or '',
+            album_id=album.get('id') or '',
+            album_name=album.get('name') or '',
+            album_image_url=images[-1].get('url', '') if images else '',
+            release_date=album.get('release_date') or '',
+            popularity=track.get('popularity'),
+            duration_ms=track.get('duration_ms'),
+            explicit=bool(track.get('explicit'))
+        )
+
+    @staticmethod
+    def get_tracks(track_ids):
+        # track id -> track dict shaped like ListeningHistoryService.slim_track, for ids in the catalog
+        track_ids = list(dict.fromkeys(track_ids))
+        if not track_ids:
+            return {}
+
+        with span('db.catalog_read'):
+            rows = Track.objects.filter(spotify_id__in=track_ids).exclude(name='').values(
+                'spotify_id', 'name', 'album_id', 'album_name', 'album_image_url',
+                'release_date', 'popularity', 'duration_ms', 'explicit'
+            )
+            credits = defaultdict(list)
+            for track_id, artist_id, artist_name in (
+                TrackArtist.objects
+                .filter(track_id__in=track_ids)
+                .order_by('track_id', 'position')
+                .values_list('track_id', 'artist_id', 'artist__name')
+            ):
+                credits[track_id].append({'id': artist_id, 'name': artist_name})
+
+            tracks = {}
+            for row in rows:
+                track_id = row['spotify_id']
+                tracks[track_id] = {
+                    'id': track_id,
+                    'name': row['name'],
+                    'uri': f'spotify:track:{track_id}',
+                    'popularity': row['popularity'],
+                    'duration_ms': row['duration_ms'],
+                    'explicit': row['explicit'],
+                    'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'},
+                    'artists': credits[track_id],
+                    'album': {
+                        'id': row['album_id'] or None,
+                        'name': row['album_name'] or None,
+                        'release_date': row['release_date'] or None,
+                        'images': [{'url': row['album_image_url']}] if row['album_image_url'] else [],
+                    },
+                }
+        return tracks
+
+    @staticmethod
+    def known_track_ids(track_ids):
+        with span('db.catalog_read'):
+            return set(Track.objects.filter(spotify_id__in=track_ids).values_list('spotify_id', flat=True))
+
+
+class ListeningHistoryService:
     @staticmethod
-    def analyze_music_data(data):
-        formatted_data = format_spotify_data_for_ai(data)
-        
-        prompt = f"""
-You are a music psychologist analyzing a user's Spotify data to provide insights about their personality and music preferences.
-
-### Instructions:
-1. Analyze the provided music data thoroughly
-2. Respond with ONLY valid JSON format
-3. If a field cannot be determined, use null
-4. Base your analysis on patterns in the data
-
-### Required Analysis:
-1. Personality Type: 
-   - Choose from: ["The Explorer", "The Romantic", "The Rebel", "The Intellectual", "The Socializer", "The Nostalgic", "The Trendsetter"]
-   - Or create a new appropriate type with 1-2 word label and description
-
-2. Music Analytics:
-   - Identify top 5 genres
-   - Estimate mood distribution (assign percentages that sum to 100)
-   - Assess overall energy level (low/medium/high)
-   - Other audio features (rate 1-10 where applicable)
-
-3. Psychological Insights:
-   - 3-5 bullet points about what the music suggests
-   - Focus on personality traits, not just musical preferences
-
-### User Music Data:
-{formatted_data}
-
-### Response Format (STRICT JSON ONLY):
-{{
-  "personality_type": "",
-  "description": "",
-  "analytics": {{
-    "top_genres": [],
-    "mood_distribution": {{
-      "happy": 0,
-      "melancholic": 0,
-      "energetic": 0,
-      "calm": 0,
-      "angsty": 0
-    }},
-    "audio_features": {{
-      "energy_level": "",
-      "danceability": 0,
-      "acousticness": 0,
-      "instrumentalness": 0,
-      "complexity": 0
-    }}
-  }},
-  "insights": [
-    "",
-    "",
-    ""
-  ],
-  "recommendations": {{
-    "similar_artists": [],
-    "growth_opportunities": []
-  }}
-}}
-
-IMPORTANT:
-- Respond with ONLY the JSON object
-- Do not include any explanatory text
-- Ensure all brackets and quotes are properly closed
-- Maintain consistent formatting
-"""
-        
-        headers = {
-            "Authorization": f"Bearer {settings.OPENROUTER_API_KEY}",
-            "Content-Type": "application/json"
+    def slim_track(track):
+        # The fields analyses, ranking and the frontend read; markets and all but the
+        # smallest album image are dropped
+        album = track.get('album') or {}
+        return {
+            'id': track.get('id'),
+            'name': track.get('name'),
+            'uri': track.get('uri'),
+            'popularity': track.get('popularity'),
+            'duration_ms': track.get('duration_ms'),
+            'explicit': track.get('explicit'),
+            'external_urls': track.get('external_urls', {}),
+            'artists': [{'id': artist.get('id'), 'name': artist.get('name')} for artist in track.get('artists', [])],
+            'album': {
+                'id': album.get('id'),
+                'name': album.get('name'),
+                'release_date': album.get('release_date'),
+                'images': (album.get('images') or [])[-1:],
+            },
         }
-        
+
+    @staticmethod
+    def sync_cursor(user_profile):
+        # Returns (due, after): whether to ask Spotify for new plays, and the
+        # millisecond cursor of the newest stored play. A failed sync only delays
+        # the next one; the cursor still covers everything missed.
+        key = f'listening-history-sync:{user_profile.id}'
+        if not cache.add(key, 1, timeout=settings.LISTENING_HISTORY_SYNC_INTERVAL):
+            return False, None
+
+        latest = (
+            ListeningHistory.objects
+            .filter(user=user_profile)
+            .order_by('-played_at')
+            .values_list('played_at', flat=True)
+            .first()
+        )
+        return True, int(latest.timestamp() * 1000) if latest else None
+
+    @staticmethod
+    def fetch_plays(access_token, after=None):
+        path, params = SPOTIFY_USER_DATA_ENDPOINTS['recently_played']
+        params = dict(params, after=after) if after else params
+        items = []
+        with span('spotify.recently_played'):
+            for _ in range(settings.LISTENING_HISTORY_SYNC_MAX_PAGES):
+                page = SpotifyService.api_get(access_token, path, params)
+                page_items = page.get('items') or []
+                items.extend(page_items)
+                if not page_items or not page.get('next'):
+                    break
+                path, params = page['next'], None
+        return {'items': items}
+
+    @staticmethod
+    def build_rows(user_profile, plays):
+        rows = []
+        for item in plays.get('items', []):
+            track = item.get('track')
+            played_at = parse_datetime(item.get('played_at') or '')
+            if not track or not track.get('id') or played_at is None:
+                continue
+            rows.append(ListeningHistory(user=user_profile, track_id=track['id'], played_at=played_at))
+        return rows
+
+    @staticmethod
+    def store(user_profile, plays):
+        rows = ListeningHistoryService.build_rows(user_profile, plays)
+        if rows:
+            # Plays reference catalog tracks, so those are written first, whatever
+            # CATALOG_ENABLED says
+            CatalogService.upsert_tracks([item.get('track') for item in plays.get('items', [])])
+            with span('db.history_write'):
+                ListeningHistory.objects.bulk_create(rows, ignore_conflicts=True)
+        return len(rows)
+
+    @staticmethod
+    def recent_plays(user_profile, limit=PROFILE_HISTORY_LIMIT, access_token=None):
+        # Stored plays shaped like Spotify's recently-played response, newest first
+        with span('db.history_read'):
+            rows = list(
+                ListeningHistory.objects
+                .filter(user=user_profile)
+                .order_by('-played_at')
+                .values_list('track_id', 'played_at')[:limit]
+            )
+        tracks = CatalogService.get_tracks(track_id for track_id, _ in rows)
+        missing = list(dict.fromkeys(track_id for track_id, _ in rows if track_id not in tracks))
+        if missing and access_token:
+            with span('spotify.track_lookup'):
+                found = SpotifyService.lookup_tracks(access_token, missing)
+            CatalogService.upsert_tracks(found)
+            tracks.update(CatalogService.get_tracks(track['id'] for track in found))
+        return ListeningHistoryService.as_plays(
+            (tracks[track_id], played_at) for track_id, played_at in rows if track_id in tracks
+        )
+
+    @staticmethod
+    def as_plays(rows):
+        return {'items': [
+            {'track': track, 'played_at': played_at.isoformat().replace('+00:00', 'Z')}
+            for track, played_at in rows
+        ]}
+
+
+class TrackLibraryService:
+    @staticmethod
+    def deep_fetch(access_token):
+        # Pages through every LIBRARY_COLLECTIONS entry into a TrackStore. The first
+        # pages go out together and their totals decide the rest; at most
+        # LIBRARY_FETCH_CONCURRENCY pages are in flight, and each is folded into the
+        # store as soon as it arrives, in order
+        builder = TrackStoreBuilder(settings.LIBRARY_MAX_TRACKS)
+        timeout = settings.SPOTIFY_REQUEST_TIMEOUT * 3
+
+        def submit(name, offset):
+            path, params, _, _ = LIBRARY_COLLECTIONS[name]
+            params = dict(params, limit=LIBRARY_PAGE_SIZE, offset=offset)
+            return _spotify_executor.submit(
+                contextvars.copy_context().run, SpotifyService.api_get, access_token, path, params
+            )
+
+        # Catalog writes are batched across pages; a transaction per page is far slower
+        pending = {'tracks': [], 'artists': []}
+
+        def flush_catalog(minimum=0):
+            if len(pending['tracks']) >= minimum:
+                CatalogService.upsert_tracks(pending['tracks'])
+                pending['tracks'] = []
+            if len(pending['artists']) >= minimum:
+                CatalogService.upsert_artists(pending['artists'])
+                pending['artists'] = []
+
+        def add(name, offset, page):
+            _, _, kind, source = LIBRARY_COLLECTIONS[name]
+            items = page.get('items') or []
+            builder.add_page(kind, source, offset, items)
+            if settings.CATALOG_ENABLED:
+                pending[kind].extend([item.get('track') for item in items] if source == SOURCE_SAVED else items)
+                flush_catalog(minimum=CATALOG_BATCH_SIZE)
+
+        in_flight = deque((name, 0, submit(name, 0)) for name in LIBRARY_COLLECTIONS)
+        remaining = deque()
+        try:
+            with span('spotify.deep_fetch'):
+                for _ in range(len(LIBRARY_COLLECTIONS)):
+                    name, offset, future = in_flight.popleft()
+                    page = future.result(timeout=timeout)
+                    add(name, offset, page)
+                    total = min(page.get('total') or 0, settings.LIBRARY_MAX_TRACKS)
+                    remaining.extend((name, offset) for offset in range(LIBRARY_PAGE_SIZE, total, LIBRARY_PAGE_SIZE))
+
+                while remaining or in_flight:
+                    while remaining and len(in_flight) < max(settings.LIBRARY_FETCH_CONCURRENCY, 1):
+                        name, offset = remaining.popleft()
+                        in_flight.append((name, offset, submit(name, offset)))
+                    name, offset, future = in_flight.popleft()
+                    add(name, offset, future.result(timeout=timeout))
+        finally:
+            for _, _, future in in_flight:
+                future.cancel()
+
+        if settings.CATALOG_ENABLED:
+            flush_catalog()
+        return builder.build()
+
+    @staticmethod
+    def sync(user_profile, access_token=None):
+        store = TrackLibraryService.deep_fetch(
+            access_token or SpotifyService.get_valid_access_token(user_profile)
+        )
+        with span('db.library_save'):
+            TrackLibrary.objects.update_or_create(
+                user=user_profile,
+                defaults={'data': store.to_bytes(), 'track_count': len(store), 'synced_at': timezone.now()}
+            )
+        return store
+
+    @staticmethod
+    def schedule_sync(user_profile_id):
+        # One sync per user at a time across processes; it runs on the library-sync
+        # pool, never in the request that noticed the library was stale
+        lock_key = f'track-library-sync:{user_profile_id}'
+        if not cache.add(lock_key, 1, timeout=settings.LIBRARY_SYNC_LOCK_TIMEOUT):
+            return
+
+        def sync():
+            try:
+                TrackLibraryService.sync(UserProfile.objects.get(id=user_profile_id))
+            except Exception:
+                logger.exception("Deep library fetch failed for user %s", user_profile_id)
+            finally:
+                cache.delete(lock_key)
+                connection.close()
+
+        _library_sync_executor.submit(sync)
+
+    @staticmethod
+    def get_store(user_profile):
+        # The user's stored library, with a background refresh scheduled when it is
+        # missing or stale. Returns None when deep fetch is off or nothing is stored yet
+        if not settings.LIBRARY_DEEP_FETCH_ENABLED:
+            return None
+
+        with span('db.library_load'):
+            library = TrackLibrary.objects.filter(user=user_profile).first()
+        if library is None or library.synced_at < timezone.now() - timedelta(seconds=settings.LIBRARY_SYNC_INTERVAL):
+            TrackLibraryService.schedule_sync(user_profile.id)
+
+        if library is None:
+            return None
+        return TrackStore.from_bytes(library.data)
+
+    @staticmethod
+    def sample_into(store, spotify_data, seed=0):
+        # Replaces the 50 newest saved tracks with a sample of the whole saved library
+        rows = store.sample(settings.LIBRARY_SAMPLE_SIZE, source=SOURCE_SAVED, seed=seed)
+        return dict(spotify_data, saved_tracks={
+            'items': store.saved_items(rows),
+            'total': len(store.rows(SOURCE_SAVED)),
+        })
+
+
+class AIService:
+    @staticmethod
+    def build_analysis_payload(data, analytics=None):
+        # Genres, moods and audio features are computed locally; the model only
+        # interprets them, which keeps the response short
+        with span('ai.format'):
+            formatted_data = format_spotify_data_for_ai(data)
+        if analytics is None:
+            analytics = compute_music_analytics(data)
+        formatted_analytics = json.dumps(analytics, separators=(',', ':'))
+
         payload = {
-            "model": "deepseek/deepseek-chat:free",
-            "messages": [
-                {"role": "system", "content": "You are a music psychologist that analyzes people's music taste and provides insights about their personality."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7
+            "model": settings.OPENROUTER_MODEL_TIERS[0],
+            "messages": build_messages(
+                ANALYSIS_SYSTEM_PROMPT,
+                ANALYSIS_USER_TEMPLATE.format(data=formatted_data, analytics=formatted_analytics)
+            ),
+            "temperature": 0.7,
+            "max_tokens": 700
         }
-        
-        response = requests.post(settings.OPENROUTER_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
+        return payload
+
+    @staticmethod
+    def analyze_music_data(data, analytics=None):
+        payload = AIService.build_analysis_payload(data, analytics)
+        with span('ai.completion'):
+            completion = openrouter_client.complete_hedged(payload, accept=parse_and_normalize_ai_json)
+        content = completion['choices'][0]['message']['content']
 
-        print("AI Response:", response.json()['choices'][0]['message']['content'])
+        print("AI Response:", content)
 
-        return response.json()['choices'][0]['message']['content']
-        
+        return content
 
     @staticmethod
-    def generate_playlist(data, mood=None, additional_prompt=""):
-        formatted_data = format_spotify_data_for_ai(data)
-        
-        prompt = f"""
-        Based on the user's music taste below, generate a playlist recommendation.
-        The playlist should include specific track IDs from the user's preferences or similar tracks.
-        
-        {f"Focus on this mood: {mood}" if mood else ""}
-        {additional_prompt if additional_prompt else ""}
-        
-        User Music Data:
-        {formatted_data}
-        
-        Respond in JSON format with:
-        {{
-            "name": "Playlist name based on analysis",
-            "description": "Playlist description explaining why these tracks were chosen",
-            "tracks": ["spotify:track:track_id_1", "spotify:track:track_id_2", ...]
-        }}
-        """
-        
-        headers = {
-            "Authorization": f"Bearer {settings.OPENROUTER_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
+    def stream_analyze_music_data(data, analytics=None):
+        # Yields the completion text as it is generated
+        return openrouter_client.stream(AIService.build_analysis_payload(data, analytics))
+
+    @staticmethod
+    def build_playlist_payload(data, mood=None, additional_prompt="", formatted_data=None):
+        if formatted_data is None:
+            with span('ai.format'):
+                formatted_data = format_spotify_data_for_ai(data)
+
         payload = {
-            "model": "deepseek/deepseek-chat:free",
-            "messages": [
-                {"role": "system", "content": "You are a music curator that creates personalized playlists based on user preferences."},
-                {"role": "user", "content": prompt}
-            ],
+            "model": settings.OPENROUTER_MODEL_TIERS[0],
+            "messages": build_messages(
+                PLAYLIST_SYSTEM_PROMPT,
+                PLAYLIST_USER_TEMPLATE.format(data=formatted_data),
+                mood, additional_prompt
+            ),
             "temperature": 0.8
         }
-        
-        response = requests.post(settings.OPENROUTER_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        return response.json()['choices'][0]['message']['content']
\ No newline at end of file
+        return payload
+
+    @staticmethod
+    def generate_playlist(data, mood=None, additional_prompt=""):
+        payload, cache_key = AIService.prepare_generate_playlist(data, mood, additional_prompt)
+        content = AIService.cached_playlist_completion(cache_key)
+        if content is None:
+            with span('ai.completion'):
+                completion = openrouter_client.complete_hedged(payload, accept=parse_and_normalize_ai_json)
+            content = completion['choices'][0]['message']['content']
+            AIService.cache_playlist_completion(cache_key, content)
+        return content
+
+    @staticmethod
+    def prepare_generate_playlist(data, mood=None, additional_prompt=""):
+        # Returns the payload and its completion cache key, formatting the taste data once
+        with span('ai.format'):
+            formatted_data = format_spotify_data_for_ai(data)
+        payload = AIService.build_playlist_payload(data, mood, additional_prompt, formatted_data=formatted_data)
+        cache_key = AIService.playlist_cache_key('generate', payload['model'], formatted_data, mood, additional_prompt)
+        return payload, cache_key
+
+    @staticmethod
+    def playlist_cache_key(kind, model, taste, mood, additional_prompt):
+        return CompletionCache.key(
+            kind, model, taste, normalize_prompt_text(mood), normalize_prompt_text(additional_prompt)
+        )
+
+    @staticmethod
+    def cached_playlist_completion(cache_key):
+        if playlist_completion_cache is None:
+            return None
+        return playlist_completion_cache.get(cache_key)
+
+    @staticmethod
+    def cache_playlist_completion(cache_key, content):
+        # Only answers that parse are kept, so a malformed completion is retried next time
+        if playlist_completion_cache is None:
+            return
+        try:
+            parse_and_normalize_ai_json(content)
+        except ValueError:
+            return
+        playlist_completion_cache.set(cache_key, content)
+
+    @staticmethod
+    def build_describe_playlist_payload(tracks, mood=None, additional_prompt=""):
+        # Tracks are already chosen locally; the LLM only names the playlist
+        track_lines = "\n".join(
+            f"- {track['name']} - {', '.join(track['artists'])}" for track in tracks[:15]
+        )
+
+        payload = {
+            "model": settings.OPENROUTER_MODEL_TIERS[0],
+            "messages": build_messages(
+                DESCRIBE_PLAYLIST_SYSTEM_PROMPT,
+                DESCRIBE_PLAYLIST_USER_TEMPLATE.format(tracks=track_lines),
+                mood, additional_prompt
+            ),
+            "temperature": 0.8,
+            "max_tokens": 200
+        }
+        return payload
+
+    @staticmethod
+    def describe_playlist(tracks, mood=None, additional_prompt=""):
+        payload, cache_key = AIService.prepare_describe_playlist(tracks, mood, additional_prompt)
+        content = AIService.cached_playlist_completion(cache_key)
+        if content is None:
+            with span('ai.completion'):
+                completion = openrouter_client.complete_hedged(payload, accept=parse_and_normalize_ai_json)
+            content = completion['choices'][0]['message']['content']
+            AIService.cache_playlist_completion(cache_key, content)
+        return content
+
+    @staticmethod
+    def prepare_describe_playlist(tracks, mood=None, additional_prompt=""):
+        payload = AIService.build_describe_playlist_payload(tracks, mood, additional_prompt)
+        cache_key = AIService.playlist_cache_key(
+            'describe', payload['model'], [track['id'] for track in tracks], mood, additional_prompt
+        )
+        return payload, cache_key
+
+
+class AnalysisService:
+    @staticmethod
+    def find_reusable_analysis(user_profile, fingerprint):
+        if settings.ANALYSIS_REUSE_WINDOW <= 0:
+            return None
+
+        fresh_since = timezone.now() - timedelta(seconds=settings.ANALYSIS_REUSE_WINDOW)
+        with span('db.reuse_lookup'):
+            return (
+                UserAnalysis.objects
+                .filter(user=user_profile, input_fingerprint=fingerprint, generated_at__gte=fresh_since)
+                .order_by('-generated_at')
+                .first()
+            )
+
+    @staticmethod
+    def run_analysis(user_profile, force=False):
+        analysis = AnalysisService.prepare_analysis(user_profile, force=force)
+        if analysis.pk is None:
+            with span('db.save'):
+                analysis.save()
+        return analysis
+
+    @staticmethod
+    def prepare_analysis(user_profile, force=False):
+        # Returns a reusable stored analysis, or an unsaved one built from a new completion
+        # Collect Spotify data for the user
+        spotify_data = SpotifyService.get_user_data(
+            user_profile=user_profile,
+            history_limit=settings.LISTENING_HISTORY_ANALYSIS_LIMIT
+        )
+
+        # Listening data unchanged since a recent analysis: reuse it instead of calling the LLM
+        fingerprint = fingerprint_spotify_data(spotify_data)
+        if not force:
+            existing = AnalysisService.find_reusable_analysis(user_profile, fingerprint)
+            if existing:
+                return existing
+
+        spotify_data, library = AnalysisService.load_library(user_profile, spotify_data)
+        analytics = AnalysisService.compute_analytics(spotify_data, library)
+
+        # Get and normalize AI response
+        ai_response = AIService.analyze_music_data(spotify_data, analytics)
+        with span('ai.parse'):
+            parsed_data = parse_and_normalize_ai_json(ai_response)
+
+        return AnalysisService.build_analysis(user_profile, parsed_data, fingerprint, analytics)
+
+    @staticmethod
+    def compute_analytics(spotify_data, library=None):
+        with span('analytics.compute'):
+            return compute_music_analytics(spotify_data, library=library)
+
+    @staticmethod
+    def load_library(user_profile, spotify_data):
+        # With deep fetch on, saved tracks are sampled from the user's whole library
+        library = TrackLibraryService.get_store(user_profile)
+        if library is not None:
+            spotify_data = TrackLibraryService.sample_into(library, spotify_data, seed=user_profile.id)
+        return spotify_data, library
+
+    @staticmethod
+    def stream_analysis(user_profile, force=False):
+        # Yields ('field', {'key', 'value'}) as each top-level field of the completion
+        # finishes, then ('analysis', UserAnalysis) once the result is stored
+        spotify_data = SpotifyService.get_user_data(
+            user_profile=user_profile,
+            history_limit=settings.LISTENING_HISTORY_ANALYSIS_LIMIT
+        )
+
+        fingerprint = fingerprint_spotify_data(spotify_data)
+        if not force:
+            existing = AnalysisService.find_reusable_analysis(user_profile, fingerprint)
+            if existing:
+                yield 'analysis', existing
+                return
+
+        # The locally computed analytics are ready before the model starts
+        spotify_data, library = AnalysisService.load_library(user_profile, spotify_data)
+        analytics = AnalysisService.compute_analytics(spotify_data, library)
+        yield 'field', {'key': 'analytics', 'value': analytics}
+
+        parser = IncrementalJSONParser()
+        chunks = []
+        started = time.perf_counter()
+        for chunk in AIService.stream_analyze_music_data(spotify_data, analytics):
+            chunks.append(chunk)
+            for key, value in parser.feed(chunk):
+                yield 'field', {'key': key, 'value': value}
+        # Not a span: the generator is suspended between yields
+        stage_duration.observe(time.perf_counter() - started, stage='ai.stream')
+
+        with span('ai.parse'):
+            parsed_data = parse_and_normalize_ai_json(''.join(chunks))
+        yield 'analysis', AnalysisService.save_analysis(user_profile, parsed_data, fingerprint, analytics)
+
+    @staticmethod
+    def save_analysis(user_profile, parsed_data, fingerprint="", analytics=None):
+        analysis = AnalysisService.build_analysis(user_profile, parsed_data, fingerprint, analytics)
+        with span('db.save'):
+            analysis.save()
+        return analysis
+
+    @staticmethod
+    def build_analysis(user_profile, parsed_data, fingerprint="", analytics=None):
+        print("parsed data:", parsed_data)
+
+        return UserAnalysis(
+            user=user_profile,
+            personality_type=parsed_data['personality_type'],
+            description=parsed_data['description'],
+            # Locally computed analytics take precedence over anything the model returns
+            music_analytics=analytics if analytics is not None else parsed_data.get('analytics', {}),
+            insights=parsed_data['insights'],
+            recommendations=parsed_data.get('recommendations') or {},
+            input_fingerprint=fingerprint
+        )
@@ -1,3 +1,384 @@
-from django.test import TestCase
+import io
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from requests import PreparedRequest, Response
+from requests.adapters import HTTPAdapter
+from rest_framework.test import APIClient
+
+from .analytics import compute_music_analytics
+from .async_views import AsyncAnalyzeUserView
+from .cache import InProcessBackend, SnapshotCache
+from .jobs import claim_next_job, enqueue_analysis, worker_pool
+from .library import SOURCE_SAVED, SOURCE_TOP_MEDIUM, TrackStore, TrackStoreBuilder
+from .models import AnalysisJob, UserAnalysis, UserProfile
+from .ranking import MAX_TRACKS_PER_ARTIST, rank_candidate_tracks
+from .services import PLAYLIST_ADD_BATCH_SIZE, SpotifyService
+from .throttle import RateLimitExceeded, SharedTokenBucket, ThrottleChain, ThrottledAdapter
+from .utils import IncrementalJSONParser, encode_spotify_data_for_ai
+
+# Runs against SQLite without Supabase: python manage.py test core --settings=benchmarks.settings
+
+
+def make_profile(name='listener', expires_in=3600):
+    user = User.objects.create(username=name)
+    return UserProfile.objects.create(
+        user=user,
+        spotify_id=f'spotify-{name}',
+        access_token='access',
+        refresh_token=f'refresh-{name}',
+        token_expires=timezone.now() + timedelta(seconds=expires_in)
+    )
+
+
+def make_track(index, artist_index=None, popularity=50):
+    artist_index = index if artist_index is None else artist_index
+    return {
+        'id': f'{index:022d}',
+        'name': f'Track {index}',
+        'popularity': popularity,
+        'duration_ms': 200000,
+        'artists': [{'id': f'artist{artist_index}', 'name': f'Artist {artist_index}'}],
+        'album': {'id': f'album{index}', 'name': f'Album {index}', 'release_date': '2020-01-01'},
+    }
+
+
+def make_spotify_data(tracks=0, artists=0, plays=0, saved=0):
+    return {
+        'user': {'id': 'listener', 'display_name': 'Listener'},
+        'top_tracks': {'items': [make_track(i) for i in range(tracks)]},
+        'top_artists': {'items': [
+            {'id': f'artist{i}', 'name': f'Artist {i}', 'popularity': 60, 'genres': ['indie pop', 'folk']}
+            for i in range(artists)
+        ]},
+        'recently_played': {'items': [
+            {'track': make_track(1000 + i), 'played_at': '2026-01-01T00:00:00Z'} for i in range(plays)
+        ]},
+        'saved_tracks': {'items': [
+            {'track': make_track(2000 + i), 'added_at': '2025-06-01T00:00:00Z'} for i in range(saved)
+        ]},
+    }
+
+
+def make_response(status_code, headers=None):
+    response = Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response.raw = io.BytesIO()
+    return response
+
+
+class IncrementalJSONParserTests(TestCase):
+    def test_member_split_across_chunks(self):
+        parser = IncrementalJSONParser()
+        self.assertEqual(parser.feed('{"personality_type": "The Ex'), [])
+        self.assertEqual(parser.feed('plorer", "desc'), [('personality_type', 'The Explorer')])
+        self.assertEqual(parser.feed('ription": "Curious"}'), [('description', 'Curious')])
+
+    def test_escaped_quote_inside_string(self):
+        parser = IncrementalJSONParser()
+        members = parser.feed('{"description": "Says \\"hi\\", then leaves", "insights": ["a"]}')
+        self.assertEqual(members, [('description', 'Says "hi", then leaves'), ('insights', ['a'])])
+
+    def test_leading_fence_is_skipped(self):
+        parser = IncrementalJSONParser()
+        members = parser.feed('```json\n{"personality_type": "Nomad"}\n```')
+        self.assertEqual(members, [('personality_type', 'Nomad')])
+        self.assertTrue(parser.finished)
+
+
+class PromptEncodingTests(TestCase):
+    def test_trims_to_token_budget(self):
+        data = make_spotify_data(tracks=50, artists=20, plays=50, saved=50)
+        _, stats = encode_spotify_data_for_ai(data, compact=True, token_budget=1500)
+
+        self.assertLessEqual(stats['tokens_after'], 1500)
+        self.assertLess(stats['tokens_after'], stats['tokens_before'])
+        # Saved tracks are the lowest signal section, so they go first
+        self.assertEqual(stats['trimmed']['saved_tracks'], 50)
+        self.assertNotIn('top_artists', stats['trimmed'])
+
+    def test_untrimmed_within_budget(self):
+        _, stats = encode_spotify_data_for_ai(make_spotify_data(tracks=2, artists=2), compact=True, token_budget=4000)
+        self.assertEqual(stats['trimmed'], {})
+
+
+class AnalyticsAndRankingTests(TestCase):
+    def test_analytics_empty_input(self):
+        analytics = compute_music_analytics(make_spotify_data())
+        self.assertEqual(analytics['top_genres'], [])
+        self.assertEqual(analytics['artist_diversity'], {})
+        self.assertEqual(analytics['popularity'], {})
+        self.assertNotIn('mood_distribution', analytics)
+
+    def test_analytics_from_top_items(self):
+        analytics = compute_music_analytics(make_spotify_data(tracks=10, artists=5))
+        self.assertEqual(analytics['top_genres'], ['folk', 'indie pop'])
+        self.assertEqual(sum(analytics['mood_distribution'].values()), 100)
+        self.assertEqual(analytics['estimated'], ['mood_distribution', 'audio_features'])
+        self.assertEqual(analytics['artist_diversity']['unique_artists'], 10)
+
+    def test_ranking_empty_input(self):
+        self.assertEqual(rank_candidate_tracks(make_spotify_data()), [])
+
+    def test_ranking_caps_tracks_per_artist(self):
+        data = make_spotify_data()
+        data['top_tracks']['items'] = [make_track(i, artist_index=0) for i in range(10)] + [make_track(10)]
+
+        ranked = rank_candidate_tracks(data, limit=30)
+        by_lead_artist = [track for track in ranked if track['artists'] == ['Artist 0']]
+        self.assertEqual(len(by_lead_artist), MAX_TRACKS_PER_ARTIST)
+        self.assertIn('Track 10', [track['name'] for track in ranked])
+
+
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_bucket_rejects_once_window_budget_is_spent(self):
+        bucket = SharedTokenBucket(capacity=2, window=60, max_wait=0, prefix='test-acquire')
+        bucket()
+        bucket()
+        with self.assertRaises(RateLimitExceeded):
+            bucket()
+
+        metrics = bucket.get_metrics()
+        self.assertEqual(metrics['acquired'], 2)
+        self.assertEqual(metrics['rejected'], 1)
+        self.assertEqual(metrics['budget_remaining'], 0)
+
+    def test_observe_blocks_every_caller_until_retry_after(self):
+        bucket = SharedTokenBucket(capacity=10, window=1, max_wait=0, prefix='test-observe')
+        other_worker = SharedTokenBucket(capacity=10, window=1, max_wait=0, prefix='test-observe')
+
+        self.assertEqual(bucket.observe(make_response(429, {'Retry-After': '30'})), 30.0)
+        with self.assertRaises(RateLimitExceeded) as raised:
+            other_worker()
+        self.assertGreater(raised.exception.retry_after, 25)
+
+    def test_adapter_retries_after_429(self):
+        bucket = SharedTokenBucket(capacity=10, window=1, max_wait=5, prefix='test-adapter')
+        adapter = ThrottledAdapter(throttle=bucket, rate_limit_retries=2)
+        responses = [make_response(429, {'Retry-After': '0'}), make_response(200)]
+
+        with mock.patch.object(HTTPAdapter, 'send', side_effect=responses) as send:
+            response = adapter.send(PreparedRequest())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(send.call_count, 2)
+        self.assertEqual(bucket.get_metrics()['rate_limited_responses'], 1)
+
+    def test_chained_pacer_keeps_retry_after_handling(self):
+        bucket = SharedTokenBucket(capacity=10, window=1, max_wait=5, prefix='test-chain')
+        pacer = mock.Mock(spec=[])
+        adapter = ThrottledAdapter(throttle=ThrottleChain(pacer, bucket), rate_limit_retries=2)
+        responses = [make_response(429, {'Retry-After': '0'}), make_response(200)]
+
+        with mock.patch.object(HTTPAdapter, 'send', side_effect=responses):
+            response = adapter.send(PreparedRequest())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(pacer.call_count, 2)
+        self.assertEqual(bucket.get_metrics()['rate_limited_responses'], 1)
+
+    def test_adapter_gives_up_after_retries(self):
+        bucket = SharedTokenBucket(capacity=10, window=1, max_wait=5, prefix='test-adapter-exhausted')
+        adapter = ThrottledAdapter(throttle=bucket, rate_limit_retries=1)
+
+        with mock.patch.object(HTTPAdapter, 'send', side_effect=lambda *a, **k: make_response(429, {'Retry-After': '0'})):
+            with self.assertRaises(RateLimitExceeded):
+                adapter.send(PreparedRequest())
+
+
+@mock.patch.object(worker_pool, 'wake')
+class AnalysisJobTests(TestCase):
+    def test_enqueue_collapses_duplicates(self, wake):
+        profile = make_profile()
+        job, created = enqueue_analysis(profile)
+        again, created_again = enqueue_analysis(profile, force=True)
+
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again.id, job.id)
+        self.assertEqual(AnalysisJob.objects.filter(user=profile).count(), 1)
+        # A forced request upgrades the job that is still queued
+        self.assertTrue(AnalysisJob.objects.get(id=job.id).force)
+        wake.assert_called_once()
+
+    def test_claim_skips_claimed_jobs(self, wake):
+        first, _ = enqueue_analysis(make_profile('first'))
+        second, _ = enqueue_analysis(make_profile('second'))
+
+        with CaptureQueriesContext(connection) as queries:
+            claimed = claim_next_job()
+        if connection.features.has_select_for_update_skip_locked:
+            self.assertTrue(any('SKIP LOCKED' in query['sql'] for query in queries.captured_queries))
+
+        self.assertEqual(claimed.id, first.id)
+        self.assertEqual(claimed.status, AnalysisJob.STATUS_RUNNING)
+        self.assertEqual(claim_next_job().id, second.id)
+        self.assertIsNone(claim_next_job())
+
+    @override_settings(ANALYSIS_JOB_TIMEOUT=60)
+    def test_claim_reclaims_stale_running_jobs(self, wake):
+        job, _ = enqueue_analysis(make_profile())
+        AnalysisJob.objects.filter(id=job.id).update(
+            status=AnalysisJob.STATUS_RUNNING, started_at=timezone.now() - timedelta(minutes=5)
+        )
+        self.assertEqual(claim_next_job().id, job.id)
+
+
+@override_settings(CATALOG_ENABLED=False)
+class PlaylistTrackTests(TestCase):
+    def make_client(self, known_ids):
+        sp = mock.Mock()
+        sp.tracks.side_effect = lambda ids: {'tracks': [{'id': track_id} if track_id in known_ids else None for track_id in ids]}
+        sp.user_playlist_create.return_value = {'id': 'playlist'}
+        return sp
+
+    def test_validate_track_ids(self):
+        ids = [f'{i:022d}' for i in range(3)]
+        sp = self.make_client({ids[0], ids[1]})
+        tracks = [
+            f'spotify:track:{ids[0]}',
+            f'https://open.spotify.com/track/{ids[1]}?si=x',
+            ids[0],
+            ids[2],
+            'not a track',
+        ]
+
+        valid, rejected = SpotifyService.validate_track_ids(sp, tracks)
+
+        self.assertEqual(valid, ids[:2])
+        self.assertEqual(rejected, ['not a track', ids[2]])
+
+    def test_create_playlist_adds_tracks_in_batches(self):
+        profile = make_profile()
+        ids = [f'{i:022d}' for i in range(100, 350)]
+        sp = self.make_client(set(ids))
+
+        with mock.patch.object(SpotifyService, 'get_client', return_value=sp):
+            playlist = SpotifyService.create_playlist(profile.spotify_id, 'Mix', '', ids, user_profile=profile)
+
+        batches = [call.args[1] for call in sp.playlist_add_items.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [PLAYLIST_ADD_BATCH_SIZE, PLAYLIST_ADD_BATCH_SIZE, 50])
+        self.assertEqual(sum(batches, []), ids)
+        self.assertEqual(playlist['tracks_added'], 250)
+
+    def test_create_playlist_rejects_unknown_tracks(self):
+        profile = make_profile()
+        sp = self.make_client(set())
+
+        with mock.patch.object(SpotifyService, 'get_client', return_value=sp):
+            with self.assertRaises(ValueError):
+                SpotifyService.create_playlist(profile.spotify_id, 'Mix', '', [f'{999:022d}'], user_profile=profile)
+        sp.user_playlist_create.assert_not_called()
+
+
+class TrackStoreTests(TestCase):
+    def test_bytes_round_trip(self):
+        builder = TrackStoreBuilder(max_tracks=100)
+        builder.add_page('tracks', SOURCE_SAVED, 0, [
+            {'track': make_track(i), 'added_at': '2025-06-01T00:00:00Z'} for i in range(5)
+        ])
+        builder.add_page('tracks', SOURCE_TOP_MEDIUM, 0, [make_track(2)])
+        builder.add_page('artists', SOURCE_TOP_MEDIUM, 0, [
+            {'id': 'artist0', 'name': 'Artist 0', 'popularity': 70, 'genres': ['jazz']}
+        ])
+        store = builder.build()
+
+        restored = TrackStore.from_bytes(store.to_bytes())
+
+        self.assertEqual(len(restored), 5)
+        self.assertEqual(restored.strings, store.strings)
+        for row in range(len(store)):
+            self.assertEqual(restored.track(row), store.track(row))
+        self.assertEqual(restored.artist_items(), store.artist_items())
+        self.assertEqual(restored.tracks['sources'][2], SOURCE_SAVED | SOURCE_TOP_MEDIUM)
+
+
+class HistoryPaginationTests(TestCase):
+    def test_cursor_pages_through_analyses(self):
+        profile = make_profile()
+        now = timezone.now()
+        for i in range(5):
+            analysis = UserAnalysis.objects.create(user=profile, personality_type=f'Type {i}', music_analytics={})
+            UserAnalysis.objects.filter(id=analysis.id).update(generated_at=now - timedelta(hours=i))
+
+        client = APIClient()
+        url = f'/api/users/{profile.id}/analyses/'
+        first = client.get(url, {'page_size': 2, 'view': 'summary'}).json()
+        second = client.get(first['next']).json()
+        third = client.get(second['next']).json()
+
+        names = [item['personality_type'] for page in (first, second, third) for item in page['results']]
+        self.assertEqual(names, [f'Type {i}' for i in range(5)])
+        self.assertIsNone(third['next'])
+        # Without cursor parameters the full list is returned as before
+        self.assertEqual(len(client.get(url).json()), 5)
+
+
+class TokenRefreshTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(
+            SpotifyService, 'refresh_access_token',
+            return_value={'access_token': 'fresh', 'expires_in': 3600}
+        )
+        self.refresh = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_valid_for_min_valid_is_kept(self):
+        profile = make_profile(expires_in=600)
+        self.assertEqual(SpotifyService.refresh_user_token(profile, min_valid=300), 'access')
+        self.refresh.assert_not_called()
+
+    def test_waiters_reuse_a_refreshed_token(self):
+        profile = make_profile(expires_in=60)
+        # A second request that loaded the profile before the refresh
+        stale_copy = UserProfile.objects.get(id=profile.id)
+
+        self.assertEqual(SpotifyService.refresh_user_token(profile, min_valid=300), 'fresh')
+        self.assertEqual(SpotifyService.refresh_user_token(stale_copy, min_valid=300), 'fresh')
+
+        self.refresh.assert_called_once_with('refresh-listener')
+        self.assertGreater(stale_copy.token_expires, timezone.now() + timedelta(minutes=30))
+
+
+class SnapshotInvalidationTests(TestCase):
+    def test_reauth_drops_cached_snapshots(self):
+        profile = make_profile()
+        snapshots = SnapshotCache(InProcessBackend(), ttls={})
+        fetch = mock.Mock(return_value=({'items': []}, 'etag'))
+        snapshots.get_or_fetch(profile.spotify_id, 'top_tracks', fetch)
+
+        user = {'id': profile.spotify_id, 'display_name': 'listener'}
+        with mock.patch('core.services.snapshot_cache', snapshots), \
+                mock.patch.object(SpotifyService, 'get_tokens', return_value={'access_token': 'new'}), \
+                mock.patch.object(SpotifyService, 'get_user_data', return_value={'user': user}):
+            response = APIClient().get(reverse('spotify-callback'), {'code': 'code'})
+        self.assertEqual(response.status_code, 200)
+
+        snapshots.get_or_fetch(profile.spotify_id, 'top_tracks', fetch)
+        self.assertEqual(fetch.call_count, 2)
+
+
+class AsyncRequestBodyTests(TestCase):
+    def post(self, body, content_type):
+        request = RequestFactory().post('/', data=body, content_type=content_type)
+        return async_to_sync(AsyncAnalyzeUserView.as_view())(request)
+
+    def test_form_body_is_parsed(self):
+        response = self.post('user_id=999', 'application/x-www-form-urlencoded')
+        self.assertEqual(response.status_code, 404)
+
+    def test_non_object_json_is_rejected(self):
+        self.assertEqual(self.post('[1]', 'application/json').status_code, 400)
+        self.assertEqual(self.post('{', 'application/json').status_code, 400)
@@ -0,0 +1,185 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+
+class ThrottledAdapter(HTTPAdapter):
+    # Transport adapter that waits on an optional throttle before every request.
+    # Throttles with an observe() hook also see 429s: the request is held until
+    # the shared Retry-After has passed and then sent again.
+    def __init__(self, *args, throttle=None, rate_limit_retries=2, **kwargs):
+        self.throttle = throttle
+        self.rate_limit_retries = rate_limit_retries
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            if self.throttle is not None:
+                self.throttle()
+            response = super().send(request, **kwargs)
+
+            observe = getattr(self.throttle, 'observe', None)
+            if response.status_code != 429 or observe is None:
+                return response
+
+            retry_after = observe(response)
+            if attempt >= self.rate_limit_retries:
+                raise RateLimitExceeded("Spotify rate limit exceeded", retry_after=retry_after)
+            response.close()
+            attempt += 1
+
+
+class SharedRateLimiter:
+    # Spaces calls 1/rate seconds apart across every process holding the same
+    # lock and slot value (multiprocessing primitives)
+    def __init__(self, rate, lock, next_slot):
+        self.interval = 1.0 / rate
+        self.lock = lock
+        self.next_slot = next_slot
+
+    def __call__(self):
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot.value)
+            self.next_slot.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ThrottleChain:
+    # Waits on each throttle in turn. 429s are passed to every throttle with an
+    # observe() hook, so a pacer layered over a token bucket keeps its Retry-After handling
+    def __init__(self, *throttles):
+        self.throttles = throttles
+
+    def __call__(self):
+        for throttle in self.throttles:
+            throttle()
+
+    def observe(self, response):
+        retry_after = None
+        for throttle in self.throttles:
+            observe = getattr(throttle, 'observe', None)
+            if observe is not None:
+                waited = observe(response)
+                retry_after = waited if retry_after is None else max(retry_after, waited)
+        return retry_after
+
+
+class SharedTokenBucket:
+    # Bucket of `capacity` tokens refilled at the start of every window, with the
+    # count kept in the Django cache so all workers draw from the same budget.
+    # Callers queue for up to max_wait seconds before RateLimitExceeded is raised.
+    def __init__(self, capacity, window=1.0, max_wait=5.0, cache_alias='default', prefix='spotify-rate'):
+        self.capacity = capacity
+        self.window = window
+        self.max_wait = max_wait
+        self.cache = caches[cache_alias]
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._metrics = {
+            'acquired': 0,
+            'queued': 0,
+            'rejected': 0,
+            'rate_limited_responses': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+
+    def _window_key(self, now):
+        return f'{self.prefix}:window:{int(now // self.window)}'
+
+    def _blocked_key(self):
+        return f'{self.prefix}:blocked-until'
+
+    def _take(self, now):
+        key = self._window_key(now)
+        self.cache.add(key, 0, timeout=int(self.window * 2) + 1)
+        try:
+            return self.cache.incr(key) <= self.capacity
+        except ValueError:
+            # The window expired between add() and incr(); it starts over
+            self.cache.add(key, 1, timeout=int(self.window * 2) + 1)
+            return True
+
+    def __call__(self):
+        started = time.time()
+        deadline = started + self.max_wait
+
+        while True:
+            now = time.time()
+            blocked_until = self.cache.get(self._blocked_key()) or 0
+            if blocked_until > now:
+                wake_at = blocked_until
+            elif self._take(now):
+                self._record_wait(time.time() - started)
+                return
+            else:
+                wake_at = (int(now // self.window) + 1) * self.window
+
+            # Spread waiters over the first part of the next window
+            wake_at += random.uniform(0, self.window * 0.1)
+            if wake_at > deadline:
+                with self._lock:
+                    self._metrics['rejected'] += 1
+                raise RateLimitExceeded(
+                    "Spotify request budget exhausted",
+                    retry_after=max(wake_at - now, 0.0)
+                )
+            time.sleep(wake_at - now)
+
+    def observe(self, response):
+        # Pause every worker until Spotify's Retry-After has passed
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is None:
+            retry_after = self.window
+        blocked_until = time.time() + retry_after
+        if blocked_until > (self.cache.get(self._blocked_key()) or 0):
+            self.cache.set(self._blocked_key(), blocked_until, timeout=int(retry_after) + 1)
+        with self._lock:
+            self._metrics['rate_limited_responses'] += 1
+        return retry_after
+
+    def _record_wait(self, waited):
+        with self._lock:
+            self._metrics['acquired'] += 1
+            if waited > 0.001:
+                self._metrics['queued'] += 1
+            self._metrics['wait_seconds_total'] += waited
+            self._metrics['wait_seconds_max'] = max(self._metrics['wait_seconds_max'], waited)
+
+    def get_metrics(self):
+        now = time.time()
+        used = self.cache.get(self._window_key(now)) or 0
+        blocked_until = self.cache.get(self._blocked_key()) or 0
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics['capacity'] = self.capacity
+        metrics['window_seconds'] = self.window
+        metrics['budget_remaining'] = max(self.capacity - used, 0)
+        metrics['blocked_for_seconds'] = max(blocked_until - now, 0.0)
+        metrics['wait_seconds_avg'] = metrics['wait_seconds_total'] / metrics['acquired'] if metrics['acquired'] else 0.0
+        return metrics
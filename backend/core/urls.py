@@ -1,9 +1,12 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 from core.views import (
     SpotifyAuthView,
     SpotifyCallbackView,
     AnalyzeUserView,
+    AnalyzeUserStreamView,
+    AnalysisJobView,
     GeneratePlaylistView,
     UserAnalysesView,
     UserPlaylistsView,
@@ -11,11 +14,22 @@ from core.views import (
     RefreshTokenView
 )
 
+# The Spotify- and LLM-bound endpoints can run on native async views under ASGI
+if settings.API_VIEW_STACK == 'async':
+    from core.async_views import (
+        AsyncSpotifyCallbackView as SpotifyCallbackView,
+        AsyncAnalyzeUserView as AnalyzeUserView,
+        AsyncGeneratePlaylistView as GeneratePlaylistView,
+        AsyncUserProfileView as UserProfileView,
+    )
+
 urlpatterns = [
     path('auth/spotify/', SpotifyAuthView.as_view(), name='spotify-auth'),
     path('auth/spotify/callback/', SpotifyCallbackView.as_view(), name='spotify-callback'),
     path('auth/spotify/refresh-token/', RefreshTokenView.as_view(), name='refresh-token'),
     path('analyze/', AnalyzeUserView.as_view(), name='analyze-user'),
+    path('analyze/stream/', AnalyzeUserStreamView.as_view(), name='analyze-user-stream'),
+    path('analyze/jobs/<int:job_id>/', AnalysisJobView.as_view(), name='analysis-job'),
     path('users/<int:user_id>/profile/', UserProfileView.as_view(), name='user-profile'),
     path('generate-playlist/', GeneratePlaylistView.as_view(), name='generate-playlist'),
     path('users/<int:user_id>/analyses/', UserAnalysesView.as_view(), name='user-analyses'),
@@ -1,6 +1,28 @@
+import hashlib
 import json
+import logging
 
-def format_spotify_data_for_ai(data):
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Sections dropped first when a compact prompt is over budget, lowest signal first
+COMPACT_TRIM_ORDER = ['saved_tracks', 'recently_played', 'top_tracks', 'top_artists']
+COMPACT_TRIM_STEP = 5
+COMPACT_LEGEND = (
+    "Lookup tables: artists[i] = name; genres[i] = name; "
+    "tracks[i] = [name, [artist indexes], album, spotify id]. "
+    "top_tracks = [[track index, popularity, duration_ms]], "
+    "top_artists = [[artist index, popularity, [genre indexes]]], "
+    "recently_played / saved_tracks = [track index]. Lists are ordered most relevant first."
+)
+
+def parse_flag(value):
+    # Request body flags arrive as JSON booleans or as form/query strings like "false"
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def normalize_spotify_data(data):
     user = data.get('user', {})
     top_tracks = data.get('top_tracks', {}).get('items', [])
     top_artists = data.get('top_artists', {}).get('items', [])
@@ -45,19 +67,134 @@ def format_spotify_data_for_ai(data):
         } for item in saved_tracks]
     }
     
-    return json.dumps(formatted, indent=2)
+    return formatted
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text and JSON
+    return (len(text) + 3) // 4
+
+
+def _encode_compact(normalized, limits):
+    artists, artist_index = [], {}
+    genres, genre_index = [], {}
+    tracks, track_index = [], {}
+
+    def intern(table, index, key, value=None):
+        if key not in index:
+            index[key] = len(table)
+            table.append(value if value is not None else key)
+        return index[key]
+
+    def intern_track(track):
+        artist_ids = [intern(artists, artist_index, name) for name in track.get('artists', [])]
+        key = track.get('id') or (track.get('name'), tuple(artist_ids))
+        return intern(tracks, track_index, key, [track.get('name'), artist_ids, track.get('album'), track.get('id')])
+
+    top_tracks = [
+        [intern_track(track), track.get('popularity'), track.get('duration_ms')]
+        for track in normalized['top_tracks'][:limits['top_tracks']]
+    ]
+    top_artists = [
+        [
+            intern(artists, artist_index, artist.get('name')),
+            artist.get('popularity'),
+            [intern(genres, genre_index, genre) for genre in artist.get('genres', [])]
+        ]
+        for artist in normalized['top_artists'][:limits['top_artists']]
+    ]
+    recently_played = [intern_track(item['track']) for item in normalized['recently_played'][:limits['recently_played']]]
+    saved_tracks = [intern_track(item['track']) for item in normalized['saved_tracks'][:limits['saved_tracks']]]
+
+    compact = {
+        'user': normalized['user'],
+        'artists': artists,
+        'genres': genres,
+        'tracks': tracks,
+        'top_tracks': top_tracks,
+        'top_artists': top_artists,
+        'recently_played': recently_played,
+        'saved_tracks': saved_tracks,
+    }
+    return COMPACT_LEGEND + "\n" + json.dumps(compact, separators=(',', ':'), ensure_ascii=False)
+
+
+def encode_spotify_data_for_ai(data, compact=None, token_budget=None):
+    # Returns the prompt text plus token counts before and after compaction
+    if compact is None:
+        compact = settings.AI_PROMPT_COMPACT
+    if token_budget is None:
+        token_budget = settings.AI_PROMPT_TOKEN_BUDGET
+
+    normalized = normalize_spotify_data(data)
+    verbose = json.dumps(normalized, indent=2)
+    stats = {'tokens_before': estimate_tokens(verbose), 'compact': compact, 'trimmed': {}}
+
+    if not compact:
+        stats['tokens_after'] = stats['tokens_before']
+        return verbose, stats
+
+    limits = {section: len(normalized[section]) for section in COMPACT_TRIM_ORDER}
+    text = _encode_compact(normalized, limits)
+
+    # Trim the tail of the lowest-signal sections until the prompt fits the budget
+    for section in COMPACT_TRIM_ORDER:
+        while token_budget and estimate_tokens(text) > token_budget and limits[section] > 0:
+            limits[section] = max(limits[section] - COMPACT_TRIM_STEP, 0)
+            text = _encode_compact(normalized, limits)
+        if not token_budget or estimate_tokens(text) <= token_budget:
+            break
+
+    stats['trimmed'] = {
+        section: len(normalized[section]) - limits[section]
+        for section in COMPACT_TRIM_ORDER
+        if limits[section] < len(normalized[section])
+    }
+    stats['tokens_after'] = estimate_tokens(text)
+    return text, stats
+
+
+def format_spotify_data_for_ai(data, compact=None, token_budget=None):
+    text, stats = encode_spotify_data_for_ai(data, compact=compact, token_budget=token_budget)
+    logger.info(
+        "AI prompt data: %s -> %s tokens (trimmed %s)",
+        stats['tokens_before'], stats['tokens_after'], stats['trimmed'] or 'nothing'
+    )
+    return text
+
+
+def normalize_prompt_text(text):
+    # Case and whitespace differences should not make otherwise equal requests distinct
+    return ' '.join((text or '').lower().split())
+
+
+def fingerprint_spotify_data(data):
+    # Hash of the normalized taste signal the analysis is built on. Recently played
+    # and saved tracks are left out: they shift with every play and would make
+    # otherwise identical listening profiles look different.
+    normalized = normalize_spotify_data(data)
+    signal = {
+        'user': normalized['user']['id'],
+        'top_tracks': normalized['top_tracks'],
+        'top_artists': normalized['top_artists'],
+    }
+    encoded = json.dumps(signal, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
 
 
+AI_KEY_MAPPING = {
+    "insight": "insights",
+    "recommendation": "recommendations",
+    "analytic": "analytics",
+    "similar_artist": "similar_artists",
+    "growth_opportunity": "growth_opportunities",
+}
+
 
 def normalize_ai_keys(data: dict) -> dict:
     # Flat key replacements at any level
-    key_mapping = {
-        "insight": "insights",
-        "recommendation": "recommendations",
-        "analytic": "analytics",
-        "similar_artist": "similar_artists",
-        "growth_opportunity": "growth_opportunities",
-    }
+    key_mapping = AI_KEY_MAPPING
 
     if not isinstance(data, dict):
         return data
@@ -91,4 +228,61 @@ def parse_and_normalize_ai_json(raw_response: str) -> dict:
     except json.JSONDecodeError as e:
         raise ValueError(f"Could not parse AI JSON: {e}")
 
-    return normalize_ai_keys(data)
\ No newline at end of file
+    return normalize_ai_keys(data)
+
+
+class IncrementalJSONParser:
+    # Consumes a streamed JSON object chunk by chunk and returns each top-level
+    # member as soon as its value is complete. Anything before the opening brace
+    # (such as a ```json fence) is skipped.
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.member_start = None
+        self.finished = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        members = []
+
+        while self.position < len(self.buffer) and not self.finished:
+            char = self.buffer[self.position]
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = self.depth > 0
+            elif char in '{[':
+                self.depth += 1
+                if self.depth == 1:
+                    self.member_start = self.position + 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    members.extend(self._close_member())
+                    self.finished = True
+            elif char == ',' and self.depth == 1:
+                members.extend(self._close_member())
+                self.member_start = self.position + 1
+
+            self.position += 1
+
+        return members
+
+    def _close_member(self):
+        member = self.buffer[self.member_start:self.position].strip()
+        if not member:
+            return []
+        try:
+            parsed = json.loads('{' + member + '}')
+        except json.JSONDecodeError:
+            return []
+        return list(normalize_ai_keys(parsed).items())
@@ -2,15 +2,40 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import redirect
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
 from django.conf import settings
-from .services import SpotifyService, AIService
+from .services import SpotifyService, AIService, AnalysisService, ListeningHistoryService, spotify_rate_limiter
+from .jobs import enqueue_analysis
 from django.contrib.auth.models import User
-from .models import UserProfile, UserAnalysis, GeneratedPlaylist
-from .serializers import UserAnalysisSerializer, GeneratedPlaylistSerializer
+from .models import UserProfile, UserAnalysis, GeneratedPlaylist, AnalysisJob
+from .serializers import (
+    UserAnalysisSerializer,
+    UserAnalysisSummarySerializer,
+    GeneratedPlaylistSerializer,
+    GeneratedPlaylistSummarySerializer,
+    AnalysisJobSerializer,
+)
+from .cache import playlist_completion_cache, snapshot_cache
+from .metrics import registry, span
+from .openrouter import model_stats
+from .pagination import HistoryCursorPagination
+from .ranking import rank_candidate_tracks
+from .throttle import RateLimitExceeded
+from .utils import parse_and_normalize_ai_json, parse_flag
 from datetime import timedelta
 from django.utils import timezone
+import hashlib
+import hmac
 import json
-from .utils import parse_and_normalize_ai_json
+import math
+
+def rate_limited_response(error):
+    response = Response({'error': str(error)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    if error.retry_after is not None:
+        response['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
 
 class SpotifyAuthView(APIView):
     def get(self, request):
@@ -62,6 +87,8 @@ class SpotifyCallbackView(APIView):
                     user_profile.refresh_token = refresh_token
                 user_profile.token_expires = token_expires
                 user_profile.save()
+                # Signing in again should show fresh data, not cached snapshots
+                SpotifyService.invalidate_user_data(spotify_id)
 
                 if user_profile.user.first_name != display_name:
                     user_profile.user.first_name = display_name
@@ -75,6 +102,8 @@ class SpotifyCallbackView(APIView):
                 'token_expires': user_profile.token_expires.isoformat(),
             })
 
+        except RateLimitExceeded as e:
+            return rate_limited_response(e)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -85,19 +114,16 @@ class RefreshTokenView(APIView):
             return Response({'error': 'Refresh token not provided'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # Refresh the access token using the refresh token
-            tokens = SpotifyService.refresh_access_token(refresh_token)
+            user_profile = UserProfile.get_by_refresh_token(refresh_token)
 
-            # Update the user profile with the new access token and refresh token (if applicable)
-            user_profile = UserProfile.objects.get(refresh_token=refresh_token)
-            user_profile.access_token = tokens['access_token']
-            if 'refresh_token' in tokens:
-                user_profile.refresh_token = tokens['refresh_token']
-            user_profile.token_expires = timezone.now() + timedelta(seconds=tokens['expires_in'])
-            user_profile.save()
+            # Coalesced with concurrent refreshes; a token that is still fresh is returned as is
+            access_token = SpotifyService.refresh_user_token(
+                user_profile,
+                min_valid=settings.SPOTIFY_TOKEN_REFRESH_MARGIN
+            )
 
             return Response({
-                'access_token': user_profile.access_token,
+                'access_token': access_token,
             })
 
         except UserProfile.DoesNotExist:
@@ -107,28 +133,144 @@ class RefreshTokenView(APIView):
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+# Profile response fields -> the Spotify endpoint each one needs (None: stored locally)
+PROFILE_FIELDS = {
+    'spotify_id': None,
+    'display_name': 'user',
+    'email': 'user',
+    'followers': 'user',
+    'images': 'user',
+    'country': 'user',
+    'top_tracks': 'top_tracks',
+    'top_artists': 'top_artists',
+    'recently_played': 'recently_played',
+    'saved_tracks': 'saved_tracks',
+}
+
+
+# The dashboard draws artist art as a full-width square card
+ARTIST_IMAGE_MIN_WIDTH = 300
+
+
+def pick_image(images, min_width):
+    # Smallest image at least min_width wide, else the largest. Spotify lists images
+    # largest first; without widths, the mid-size (second) image is the usual pick
+    images = images or []
+    if not all(image.get('width') for image in images):
+        return images[1:2] or images[:1]
+    wide_enough = [image for image in images if image['width'] >= min_width]
+    if wide_enough:
+        return [min(wide_enough, key=lambda image: image['width'])]
+    return [max(images, key=lambda image: image['width'])] if images else []
+
+
+def slim_artist(artist):
+    # The artist attributes the dashboard renders
+    return {
+        'id': artist.get('id'),
+        'name': artist.get('name'),
+        'genres': artist.get('genres', []),
+        'popularity': artist.get('popularity'),
+        'external_urls': artist.get('external_urls', {}),
+        'images': pick_image(artist.get('images'), ARTIST_IMAGE_MIN_WIDTH),
+    }
+
+
+def slim_track_item(item):
+    # Recently played and saved entries wrap the track with a timestamp
+    slim = {key: item[key] for key in ('played_at', 'added_at') if key in item}
+    slim['track'] = ListeningHistoryService.slim_track(item.get('track') or {})
+    return slim
+
+
+PROFILE_ITEM_PROJECTIONS = {
+    'top_tracks': ListeningHistoryService.slim_track,
+    'top_artists': slim_artist,
+    'recently_played': slim_track_item,
+    'saved_tracks': slim_track_item,
+}
+
+
+def parse_profile_fields(request):
+    # ?fields=display_name,top_tracks,... ; None keeps the full Spotify payloads
+    raw = request.GET.get('fields')
+    if raw is None:
+        return None
+    fields = list(dict.fromkeys(field.strip() for field in raw.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in PROFILE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown profile fields: {', '.join(unknown)}")
+    return fields or list(PROFILE_FIELDS)
+
+
+def profile_endpoints(fields):
+    if fields is None:
+        return None
+    return {PROFILE_FIELDS[field] for field in fields if PROFILE_FIELDS[field]}
+
+
+def profile_response_data(user_profile, sp_data, fields=None):
+    user = sp_data.get('user') or {}
+    data = {
+        'spotify_id': user_profile.spotify_id,
+        'display_name': user.get('display_name', ''),
+        'email': user.get('email', ''),
+        'followers': user.get('followers', {}).get('total', 0),
+        'images': user.get('images', []),
+        'country': user.get('country', ''),
+        'top_tracks': sp_data.get('top_tracks'),
+        'top_artists': sp_data.get('top_artists'),
+        'recently_played': sp_data.get('recently_played'),
+        'saved_tracks': sp_data.get('saved_tracks')
+    }
+    if fields is None:
+        return data
+
+    # Projected responses keep only the requested fields and the attributes the UI reads
+    data = {field: data[field] for field in fields}
+    for field, project in PROFILE_ITEM_PROJECTIONS.items():
+        if field in data:
+            data[field] = {'items': [project(item) for item in (data[field] or {}).get('items', [])]}
+    return data
+
+
+def profile_etag(data):
+    digest = hashlib.sha1(json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(request, etag):
+    # Weak comparison: compression middleware marks the ETags it sends as weak
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    candidates = parse_etags(header)
+    return '*' in candidates or etag in (candidate.removeprefix('W/') for candidate in candidates)
+
+
+def conditional_profile_response(request, data, response_class):
+    # 304 when the client already holds this exact snapshot
+    etag = profile_etag(data)
+    response = HttpResponseNotModified() if etag_matches(request, etag) else response_class(data)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 class UserProfileView(APIView):
     def get(self, request, user_id):
         try:
             #return spotify user data from spotifyservice.get_user_data
+            fields = parse_profile_fields(request)
             user_profile = UserProfile.objects.get(id=user_id)
-            sp_data = SpotifyService.get_user_data(user_profile=user_profile)
-            user_data = {
-                'spotify_id': user_profile.spotify_id,
-                'display_name': sp_data['user'].get('display_name', ''),
-                'email': sp_data['user'].get('email', ''),
-                'followers': sp_data['user'].get('followers', {}).get('total', 0),
-                'images': sp_data['user'].get('images', []),
-                'country': sp_data['user'].get('country', ''),
-                'top_tracks': sp_data['top_tracks'],
-                'top_artists': sp_data['top_artists'],
-                'recently_played': sp_data['recently_played'],
-                'saved_tracks': sp_data['saved_tracks']
-            }
-
-            return Response(user_data)
+            sp_data = SpotifyService.get_user_data(user_profile=user_profile, endpoints=profile_endpoints(fields))
+
+            data = profile_response_data(user_profile, sp_data, fields)
+            return conditional_profile_response(request, data, Response)
         except UserProfile.DoesNotExist:
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+        except RateLimitExceeded as e:
+            return rate_limited_response(e)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
@@ -143,23 +285,15 @@ class AnalyzeUserView(APIView):
             # Get user profile
             user = UserProfile.objects.get(id=user_id)
 
-            # Collect Spotify data for the user
-            spotify_data = SpotifyService.get_user_data(user_profile=user)
+            # Skip reuse of a recent analysis with identical listening data
+            force = parse_flag(request.data.get('force'))
 
-            # Get and normalize AI response
-            ai_response = AIService.analyze_music_data(spotify_data)
-            parsed_data = parse_and_normalize_ai_json(ai_response)
+            # Job mode: queue the analysis and let the client poll for it
+            if settings.ANALYSIS_JOBS_ENABLED or parse_flag(request.data.get('async')):
+                job, _ = enqueue_analysis(user, force=force)
+                return Response(AnalysisJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
-            print("parsed data:", parsed_data)
-
-            generated_analyis = UserAnalysis.objects.create(
-                user=user,
-                personality_type = parsed_data['personality_type'],
-                description = parsed_data['description'],
-                music_analytics = parsed_data['analytics'],
-                insights = parsed_data['insights'],
-                recommendations = parsed_data['recommendations']
-            )
+            generated_analyis = AnalysisService.run_analysis(user, force=force)
 
             # Prepare serializer and validate
             serializer = UserAnalysisSerializer(generated_analyis)
@@ -171,11 +305,60 @@ class AnalyzeUserView(APIView):
         except ValueError as ve:
             return Response({'error': f'Parsing error: {ve}'}, status=status.HTTP_400_BAD_REQUEST)
 
+        except RateLimitExceeded as e:
+            return rate_limited_response(e)
+
         except Exception as e:
             return Response({'error': f'Unexpected server error: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class AnalyzeUserStreamView(APIView):
+    def post(self, request):
+        user_id = request.data.get('user_id')
+        if not user_id:
+            return Response({'error': 'User ID not provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            user = UserProfile.objects.get(id=user_id)
+        except UserProfile.DoesNotExist:
+            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        force = parse_flag(request.data.get('force'))
+
+        def events():
+            # Partial fields are forwarded as they finish; the stored analysis comes last
+            try:
+                for event, payload in AnalysisService.stream_analysis(user, force=force):
+                    if event == 'analysis':
+                        payload = UserAnalysisSerializer(payload).data
+                    yield sse_event(event, payload)
+            except ValueError as ve:
+                yield sse_event('error', {'error': f'Parsing error: {ve}'})
+            except RateLimitExceeded as e:
+                yield sse_event('error', {'error': str(e), 'retry_after': e.retry_after})
+            except Exception as e:
+                yield sse_event('error', {'error': f'Unexpected server error: {str(e)}'})
+
+        response = StreamingHttpResponse(events(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class AnalysisJobView(APIView):
+    def get(self, request, job_id):
+        try:
+            job = AnalysisJob.objects.select_related('analysis').get(id=job_id)
+            return Response(AnalysisJobSerializer(job).data)
+        except AnalysisJob.DoesNotExist:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+
+
 class GeneratePlaylistView(APIView):
     def post(self, request):
         user_id = request.data.get('user_id')
@@ -190,11 +373,27 @@ class GeneratePlaylistView(APIView):
 
         try:
             user = UserProfile.objects.get(id=user_id)
-            sp_data = SpotifyService.get_user_data(userprofile=user)
+            sp_data = SpotifyService.get_user_data(
+                user_profile=user,
+                history_limit=settings.LISTENING_HISTORY_ANALYSIS_LIMIT
+            )
 
-            # Get playlist from AI
-            ai_response = AIService.generate_playlist(sp_data, mood, prompt)
-            playlist_data = json.loads(ai_response)
+            if settings.PLAYLIST_TRACK_SOURCE == 'llm':
+                # Get playlist from AI
+                ai_response = AIService.generate_playlist(sp_data, mood, prompt)
+                with span('ai.parse'):
+                    playlist_data = parse_and_normalize_ai_json(ai_response)
+            else:
+                # Rank the user's own tracks locally and let the AI name the result
+                with span('playlist.rank'):
+                    ranked = rank_candidate_tracks(sp_data, mood, prompt, limit=settings.PLAYLIST_TRACK_COUNT)
+                if not ranked:
+                    return Response({'error': 'Not enough listening data to build a playlist'}, status=status.HTTP_400_BAD_REQUEST)
+
+                ai_response = AIService.describe_playlist(ranked, mood, prompt)
+                with span('ai.parse'):
+                    playlist_data = parse_and_normalize_ai_json(ai_response)
+                playlist_data['tracks'] = [track['uri'] for track in ranked]
 
             # Create playlist on Spotify
             playlist = SpotifyService.create_playlist(
@@ -206,31 +405,50 @@ class GeneratePlaylistView(APIView):
             )
 
             # Save to database
-            generated_playlist = GeneratedPlaylist.objects.create(
-                user=user,
-                playlist_id=playlist['id'],
-                name=playlist['name'],
-                description=playlist['description'],
-                mood=mood,
-                prompt=prompt
-            )
+            with span('db.save'):
+                generated_playlist = GeneratedPlaylist.objects.create(
+                    user=user,
+                    playlist_id=playlist['id'],
+                    name=playlist['name'],
+                    description=playlist['description'],
+                    mood=mood,
+                    prompt=prompt
+                )
 
             serializer = GeneratedPlaylistSerializer(generated_playlist)
-            return Response(serializer.data)
+            return Response({
+                **serializer.data,
+                'tracks_added': playlist['tracks_added'],
+                'tracks_rejected': playlist['tracks_rejected'],
+            })
 
         except UserProfile.DoesNotExist:
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+        except RateLimitExceeded as e:
+            return rate_limited_response(e)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+def history_response(view, request, queryset, serializer_class):
+    if not HistoryCursorPagination.requested(request):
+        return Response(serializer_class(queryset, many=True).data)
+
+    paginator = HistoryCursorPagination()
+    page = paginator.paginate_queryset(queryset, request, view=view)
+    return paginator.get_paginated_response(serializer_class(page, many=True).data)
+
+
 class UserAnalysesView(APIView):
     def get(self, request, user_id):
         try:
             analyses = UserAnalysis.objects.filter(user_id=user_id).order_by('-generated_at')
-            serializer = UserAnalysisSerializer(analyses, many=True)
 
-            return Response(serializer.data)
-        
+            # ?view=summary skips the analytics, insights and recommendations JSON columns
+            if request.query_params.get('view') == 'summary':
+                analyses = analyses.only('id', 'personality_type', 'generated_at')
+                return history_response(self, request, analyses, UserAnalysisSummarySerializer)
+
+            return history_response(self, request, analyses, UserAnalysisSerializer)
 
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -239,7 +457,30 @@ class UserPlaylistsView(APIView):
     def get(self, request, user_id):
         try:
             playlists = GeneratedPlaylist.objects.filter(user_id=user_id).order_by('-generated_at')
-            serializer = GeneratedPlaylistSerializer(playlists, many=True)
-            return Response(serializer.data)
+
+            if request.query_params.get('view') == 'summary':
+                playlists = playlists.only('id', 'playlist_id', 'name', 'mood', 'generated_at')
+                return history_response(self, request, playlists, GeneratedPlaylistSummarySerializer)
+
+            return history_response(self, request, playlists, GeneratedPlaylistSerializer)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def metrics_view(request):
+    # Prometheus text exposition of this process's stage, request and LLM token metrics
+    if not settings.METRICS_ENABLED or not settings.METRICS_TOKEN:
+        return HttpResponse(status=404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponse(status=401)
+
+    gauges = {}
+    if snapshot_cache is not None:
+        gauges['maestro_snapshot_cache'] = snapshot_cache.get_stats()
+    if playlist_completion_cache is not None:
+        gauges['maestro_playlist_completion_cache'] = playlist_completion_cache.get_stats()
+    if spotify_rate_limiter is not None:
+        gauges['maestro_spotify_rate_limiter'] = spotify_rate_limiter.get_metrics()
+    gauges['maestro_llm_hedging'] = model_stats.get_stats()
+
+    return HttpResponse(registry.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
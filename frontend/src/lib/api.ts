@@ -76,6 +76,17 @@ api.interceptors.response.use(
   },
 )
 
+// Profile fields the dashboard and navigation read
+const PROFILE_FIELDS = [
+  "display_name",
+  "email",
+  "followers",
+  "images",
+  "top_tracks",
+  "top_artists",
+  "recently_played",
+]
+
 // API service functions
 export const apiService = {
   // Auth
@@ -84,7 +95,11 @@ export const apiService = {
   refreshToken: (refreshToken: string) => api.post("/auth/spotify/refresh-token/", { refresh_token: refreshToken }),
 
   // User
-  getUserProfile: (userId: number) => api.get(`/users/${userId}/profile/`),
+  getUserProfile: (userId: number) =>
+    api.get(`/users/${userId}/profile/`, {
+      // Only what the dashboard renders; the server slims each item to match
+      params: { fields: PROFILE_FIELDS.join(",") },
+    }),
 
   // Analysis
   analyzeUser: (userId: number) => api.post("/analyze/", { user_id: userId }),
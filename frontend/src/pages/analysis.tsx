@@ -37,6 +37,7 @@ interface Analysis {
             instrumentalness: number;
             complexity: number;
         };
+        estimated?: string[];
     };
     insights: string[];
     recommendations: {
@@ -138,6 +139,13 @@ export default function AnalysisPage() {
                                     <BarChart2 className="h-5 w-5 text-spotify-green" />
                                     Mood Distribution
                                 </CardTitle>
+                                {analysis.music_analytics?.estimated?.includes(
+                                    "mood_distribution"
+                                ) && (
+                                    <CardDescription>
+                                        Estimated from your top genres
+                                    </CardDescription>
+                                )}
                             </CardHeader>
                             <CardContent className="space-y-4">
                                 {analysis.music_analytics?.mood_distribution ? (
@@ -180,6 +188,13 @@ export default function AnalysisPage() {
                                     <Music className="h-5 w-5 text-spotify-green" />
                                     Audio Features
                                 </CardTitle>
+                                {analysis.music_analytics?.estimated?.includes(
+                                    "audio_features"
+                                ) && (
+                                    <CardDescription>
+                                        Estimated from your top genres
+                                    </CardDescription>
+                                )}
                             </CardHeader>
                             <CardContent className="space-y-4">
                                 {analysis.music_analytics?.audio_features ? (